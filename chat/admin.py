@@ -1,3 +1,23 @@
 from django.contrib import admin
+from .models import ResponseCacheEntry
 
 # Register your models here.
+
+
+class ResponseCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['query', 'model_name', 'hits', 'created_at', 'last_hit_at']
+    list_filter = ['model_name']
+    search_fields = ['query']
+    readonly_fields = ['persona_key', 'context_hash', 'query_hash', 'document_ids', 'hits', 'created_at', 'last_hit_at']
+    exclude = ['query_embedding']
+
+    def changelist_view(self, request, extra_context=None):
+        from .rag.response_cache import get_response_cache, stored_stats
+        extra_context = extra_context or {}
+        # Statistik gabungan dari semua proses dan statistik proses yang melayani halaman ini
+        extra_context['cache_stats'] = stored_stats()
+        extra_context['hit_rate_percent'] = round(extra_context['cache_stats']['hit_rate'] * 100, 1)
+        extra_context['process_stats'] = get_response_cache().stats()
+        return super().changelist_view(request, extra_context=extra_context)
+
+admin.site.register(ResponseCacheEntry, ResponseCacheEntryAdmin)
@@ -1,13 +1,25 @@
 # personaai/chat/consumers.py
 import json
 import asyncio
+import logging
+import time
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from chat import metrics
 from chat.models import ChatSession, Message
-from chat.rag.retriever import DocumentRetriever
-from chat.rag.generation import generate_streaming_response, create_conversation_prompt, build_context
-from langchain.memory import ConversationBufferMemory
+from chat.rag.retriever import aget_retriever
+from chat.streaming import TokenCoalescer, replay_text
+from chat.scheduler import GenerationRejected, get_generation_scheduler
+from chat.rag.generation import generate_streaming_response
+from chat.rag.memory import RollingSummaryMemory
+from chat.rag.prompt_cache import aget_user_persona
+from chat.rag.response_cache import CacheProbe, get_response_cache
+from chat.rag.tokens import count_tokens
+from chat.session_state import load_session_state
+
+logger = logging.getLogger(__name__)
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -15,44 +27,64 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_group_name = f'chat_{self.session_id}'
         self.user = self.scope['user']
         self.response_text = ""
-        self.memory = ConversationBufferMemory(return_messages=True)
+        self.memory = RollingSummaryMemory()
+        # Channel lain (tab/worker lain) yang ikut mendengarkan grup sesi ini
+        self.peers = set()
+        # Task generasi milik koneksi ini, dibatalkan saat stop atau disconnect
+        self.generation_tasks = set()
+        self.closing = False
 
         if not self.user.is_authenticated:
             await self.close()
             return
 
-        self.memory = await self.get_or_create_memory(self.session_id)
+        # Baris sesi dibaca sekali per koneksi; perubahan ditulis ke DB dan ke state ini
+        self.state = await database_sync_to_async(load_session_state)(self.session_id, self.user)
+        if self.state is None:
+            await self.close()
+            return
+
+        self.memory = await self.get_or_create_memory()
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
+        metrics.ACTIVE_CONNECTIONS.inc()
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {'type': 'session_presence', 'action': 'join', 'channel': self.channel_name}
+        )
 
         # Kirim status awal
-        session = await self.get_session()
-        has_messages = await self.has_messages()
-        await self.send(text_data=json.dumps({
-            'type': 'session_info',
-            'use_persona': session.use_persona,
-            'disable_toggle': has_messages,
-            'disable_model_select': has_messages,
-            'session_id': self.session_id,
-            'selected_model': session.selected_model,
-        }))
+        await self.send(text_data=json.dumps(self.state.as_session_info()))
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.generation_tasks and not self.peers:
+            # Tidak ada tab lain yang menonton; hentikan generasi agar tidak membebani Ollama
+            self.closing = True
+            await self.cancel_generations(wait=True)
+        if getattr(self, 'state', None) is not None:
+            metrics.ACTIVE_CONNECTIONS.dec()
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {'type': 'session_presence', 'action': 'leave', 'channel': self.channel_name}
+            )
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message_content = text_data_json.get('message', '')
-        session_id = text_data_json.get('session_id', self.session_id)
         use_persona = text_data_json.get('use_persona', None)
         model = text_data_json.get('model', None)
         message_type = text_data_json.get('type', None)
+
+        if message_type == 'stop':
+            # Dikirim ke seluruh grup agar generasi yang dimulai dari tab lain juga berhenti
+            await self.broadcast({'type': 'generation_stop'})
+            return
         
         if message_type == 'select_model' and model:
             # periksa apakah sudah ada pesan dalam sesi
-            has_messages = await self.has_messages()
-            if has_messages:
+            if self.state.has_messages:
                 await self.send(text_data=json.dumps({
                     'type': 'error',
                     'message': 'Cannot change model after messages exist'
@@ -75,8 +107,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Tangani pembaruan use_persona
         if use_persona is not None:
-            has_messages = await self.has_messages()
-            if not has_messages:
+            if not self.state.has_messages:
                 await self.update_session_use_persona(use_persona)
                 await self.send(text_data=json.dumps({
                     'type': 'session_info',
@@ -92,53 +123,188 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Proses pesan
         if message_content:
+            # Tempat di antrean generasi dipesan dulu agar server yang sibuk langsung menolak
+            scheduler = get_generation_scheduler()
+            try:
+                ticket = scheduler.enqueue(self.state.selected_model, self.user.id)
+            except GenerationRejected as e:
+                metrics.TURNS.inc(outcome="rejected")
+                await self.send(text_data=json.dumps({'type': 'error', 'message': str(e)}))
+                return
+
             self.response_text = ""
-            await self.save_user_message(session_id, message_content)
+            try:
+                with metrics.span("message_save"):
+                    await self.save_user_message(message_content)
+            except BaseException:
+                scheduler.release(ticket)
+                raise
 
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'assistant_response_start'})
-            asyncio.create_task(self.process_streaming_response(message_content, session_id))
+            await self.broadcast({'type': 'assistant_response_start'})
+            task = asyncio.create_task(self.process_streaming_response(message_content, ticket))
+            self.generation_tasks.add(task)
+            task.add_done_callback(self.generation_tasks.discard)
 
-    async def process_streaming_response(self, query, session_id):
+    async def process_streaming_response(self, query, ticket):
+        scheduler = get_generation_scheduler()
+        collected = []
+        finished = False
+        ended = False
         try:
-            retriever = DocumentRetriever()
-            retrieved_docs = retriever.invoke(query)
-            context = build_context(retrieved_docs)
+            with metrics.span("retrieval"):
+                retriever = await aget_retriever()
+                retrieved_docs = await retriever.ainvoke(query, partitions=self.state.partitions)
+
+            # Pertanyaan pembuka yang sudah pernah dijawab diputar ulang dari cache
+            probe, cached = await self.probe_response_cache(query, retrieved_docs)
+
+            async def send_chunk(text):
+                if self.closing:
+                    return
+                await self.broadcast({'type': 'assistant_response_chunk', 'message': text})
+
+            # Token digabung menjadi frame agar tidak setiap token melewati Redis
+            coalescer = TokenCoalescer.from_settings(send_chunk)
 
             async def token_callback(token):
                 self.response_text += token
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {'type': 'assistant_response_chunk', 'message': token}
-                )
+                collected.append(token)
+                await coalescer.add(token)
 
-            session = await self.get_session()
-            full_response = await generate_streaming_response(
-                query, context, self.memory, token_callback, session.id, self.user
-            )
+            try:
+                if cached is not None:
+                    # Jawaban dari cache tidak memakai model, jadi slotnya langsung dilepas
+                    scheduler.release(ticket)
+                    await replay_text(cached.response, token_callback)
+                    full_response = cached.response
+                    self.memory.save_context({"input": query}, {"output": full_response})
+                else:
+                    # Retrieval berjalan selagi antre; generasi menunggu slot model
+                    with metrics.span("queue_wait"):
+                        await scheduler.wait(ticket, on_position=self.send_queue_position)
+                    full_response = await generate_streaming_response(
+                        query, retrieved_docs, self.memory, token_callback, self.state, self.user
+                    )
+            finally:
+                await coalescer.close()
+            finished = True
+            # Slot model dilepas sebelum menulis ke DB agar antrean berikutnya segera jalan
+            scheduler.release(ticket)
 
-            await self.save_assistant_message(session_id, full_response)
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'assistant_response_end'})
+            start = time.perf_counter()
+            await self.save_assistant_message(full_response)
+            persisted = time.perf_counter() - start
+            await self.broadcast({'type': 'assistant_response_end'})
+            ended = True
+            start = time.perf_counter()
+            await self.save_memory_summary()
+            if probe is not None and cached is None:
+                await get_response_cache().astore(probe, full_response)
+            # Waktu kirim akhir stream tidak dihitung sebagai persistensi
+            metrics.STAGE_SECONDS.observe(persisted + time.perf_counter() - start, stage="persistence")
+            metrics.TURNS.inc(outcome="cached" if cached is not None else "completed")
 
             # After processing a message and saving it:
-            has_messages = await self.has_messages()
-            if has_messages:
-                await self.send(text_data=json.dumps({
-                    'type': 'session_info',
-                    'use_persona': session.use_persona,
-                    'disable_toggle': True,
-                    'disable_model_select': True,
-                    'session_id': self.session_id,
-                    'selected_model': session.selected_model,
-                }))
+            await self.send(text_data=json.dumps(self.state.as_session_info()))
+        except asyncio.CancelledError:
+            # Jawaban parsial disimpan dan ditandai terpotong, sesuai yang sempat dilihat pengguna
+            metrics.TURNS.inc(outcome="cancelled")
+            scheduler.release(ticket)
+            partial = "".join(collected)
+            if partial and not finished:
+                self.memory.save_context({"input": query}, {"output": partial})
+                await self.save_assistant_message(partial, truncated=True)
+                await self.save_memory_summary()
+            elif not finished:
+                # Hanya pesan pengguna yang tersimpan; dihitung bersama turn berikutnya
+                self.memory.add_unpaired()
+            if not self.closing and not finished:
+                await self.broadcast({'type': 'assistant_response_end'})
+                await self.send(text_data=json.dumps(self.state.as_session_info()))
+            raise
         except Exception as e:
+            metrics.TURNS.inc(outcome="error")
+            if finished:
+                # Jawaban sudah terkirim utuh; kegagalan menyimpan ringkasan/cache tidak ditampilkan ke pengguna
+                logger.exception("Error after the answer for session %s finished", self.state.id)
+                if not ended:
+                    await self.broadcast({'type': 'assistant_response_end'})
+                return
             error_msg = f"An error occurred: {str(e)}"
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'assistant_response_chunk', 'message': error_msg})
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'assistant_response_end'})
-            await self.save_assistant_message(session_id, error_msg)
+            await self.broadcast({'type': 'assistant_response_chunk', 'message': error_msg})
+            await self.broadcast({'type': 'assistant_response_end'})
+            await self.save_assistant_message(error_msg)
+            # Memori harus mencerminkan baris Message yang tersimpan agar offset ringkasan tetap benar
+            self.memory.add_turn(query, error_msg)
+            await self.save_memory_summary()
+        finally:
+            scheduler.release(ticket)
+            metrics.TOKENS_STREAMED.inc(len(collected))
+
+    async def probe_response_cache(self, query, retrieved_docs):
+        """Look the turn up in the response cache; returns (probe, cached) or (None, None) if not cacheable."""
+        cache = get_response_cache()
+        if not cache.enabled:
+            return None, None
+        if self.memory.has_history:
+            # Jawaban turn berikutnya bergantung pada riwayat, bukan hanya pertanyaan
+            cache.skip()
+            return None, None
+        persona_id, persona_text = None, None
+        if self.state.use_persona:
+            persona_id, persona_text = await aget_user_persona(self.user)
+        probe = CacheProbe(self.state.selected_model, persona_id, persona_text, retrieved_docs, query)
+        return probe, await cache.alookup(probe)
+
+    async def cancel_generations(self, wait=False):
+        """Cancel the generation tasks of this connection, optionally waiting for them to save."""
+        tasks = list(self.generation_tasks)
+        for task in tasks:
+            task.cancel()
+        if wait and tasks:
+            await asyncio.wait(tasks, timeout=getattr(settings, "GENERATION_CANCEL_TIMEOUT", 5.0))
+
+    async def generation_stop(self, event):
+        await self.cancel_generations()
+
+    async def send_queue_position(self, position):
+        await self.broadcast({'type': 'queue_position', 'position': position})
+
+    async def broadcast(self, event):
+        """Deliver a stream event to every listener of this session.
+
+        When no other channel has joined the group the event goes straight
+        to this socket; the channel layer is only used when other tabs or
+        workers are listening.
+        """
+        if self.peers:
+            await self.channel_layer.group_send(self.room_group_name, event)
+        else:
+            await getattr(self, event['type'])(event)
+
+    async def session_presence(self, event):
+        channel = event['channel']
+        if channel == self.channel_name:
+            return
+        if event['action'] == 'join':
+            self.peers.add(channel)
+            # Beri tahu channel baru bahwa kita juga ada di grup ini
+            await self.channel_layer.send(
+                channel, {'type': 'session_presence', 'action': 'here', 'channel': self.channel_name}
+            )
+        elif event['action'] == 'here':
+            self.peers.add(channel)
+        elif event['action'] == 'leave':
+            self.peers.discard(channel)
 
     async def assistant_response_start(self, event):
+        # Tab lain pada sesi yang sama juga bisa menambah pesan
+        self.state.has_messages = True
         await self.send(text_data=json.dumps({'type': 'assistant_response_start'}))
 
+    async def queue_position(self, event):
+        await self.send(text_data=json.dumps({'type': 'queue_position', 'position': event['position']}))
+
     async def assistant_response_chunk(self, event):
         message = event['message']
         await self.send(text_data=json.dumps({'type': 'assistant_response_chunk', 'message': message}))
@@ -155,53 +321,66 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.memory.save_context({"input": ""}, {"output": msg["content"]})
 
     @database_sync_to_async
-    def save_user_message(self, session_id, content):
-        session = ChatSession.objects.get(id=session_id, user=self.user)
-        Message.objects.create(session=session, role=Message.Role.USER, content=content)
+    def save_user_message(self, content):
+        # Kepemilikan sesi sudah diperiksa saat connect, jadi cukup pakai id-nya
+        Message.objects.create(session_id=self.state.id, role=Message.Role.USER, content=content,
+                               token_count=count_tokens(content))
+        self.state.has_messages = True
 
     @database_sync_to_async
-    def save_assistant_message(self, session_id, content):
-        session = ChatSession.objects.get(id=session_id, user=self.user)
-        Message.objects.create(session=session, role=Message.Role.ASSISTANT, content=content)
-
-    @database_sync_to_async
-    def get_session(self):
-        return ChatSession.objects.get(id=self.session_id, user=self.user)
-
-    @database_sync_to_async
-    def has_messages(self):
-        session = ChatSession.objects.get(id=self.session_id, user=self.user)
-        return session.messages.exists()
+    def save_assistant_message(self, content, truncated=False):
+        Message.objects.create(session_id=self.state.id, role=Message.Role.ASSISTANT, content=content,
+                               token_count=count_tokens(content), truncated=truncated)
+        self.state.has_messages = True
 
     @database_sync_to_async
     def update_session_use_persona(self, use_persona):
-        session = ChatSession.objects.get(id=self.session_id, user=self.user)
-        session.use_persona = use_persona
-        session.save()
+        ChatSession.objects.filter(id=self.state.id).update(use_persona=use_persona)
+        self.state.use_persona = use_persona
 
     @database_sync_to_async
     def get_chat_history(self, session_id):
-        session = ChatSession.objects.get(id=session_id, user=self.user)
-        messages = Message.objects.filter(session=session).order_by('timestamp')
+        messages = Message.objects.filter(session_id=self.state.id).order_by('timestamp')
         return [{"role": msg.role, "content": msg.content} for msg in messages]
     
     @database_sync_to_async
     def update_session_model(self, model):
-        session = ChatSession.objects.get(id=self.session_id, user=self.user)
-        session.selected_model = model
-        session.save()
+        ChatSession.objects.filter(id=self.state.id).update(selected_model=model)
+        self.state.selected_model = model
 
     @database_sync_to_async
-    def get_or_create_memory(self, session_id):
-        memory = ConversationBufferMemory(return_messages=True)
-        session = ChatSession.objects.get(id=session_id, user=self.user)
-        messages = Message.objects.filter(session=session).order_by('timestamp')
+    def get_or_create_memory(self):
+        state = self.state
+        memory = RollingSummaryMemory(
+            summary=state.memory_summary,
+            summarized_messages=state.memory_summarized_messages,
+        )
+        # Pesan yang sudah masuk ringkasan tidak perlu dimuat lagi
+        messages = Message.objects.filter(session_id=state.id).order_by('timestamp')[state.memory_summarized_messages:]
         last_user_input = None
+        consumed = 0
         for msg in messages:
+            consumed += 1
             if msg.role == Message.Role.USER:
-                last_user_input = msg.content
+                last_user_input = msg
             elif msg.role == Message.Role.ASSISTANT and last_user_input:
-                memory.save_context({"input": last_user_input}, {"output": msg.content})
+                memory.add_turn(
+                    last_user_input.content, msg.content, message_count=consumed,
+                    tokens=(last_user_input.token_count, msg.token_count)
+                )
                 last_user_input = None
+                consumed = 0
         return memory
-    
+
+    @database_sync_to_async
+    def save_memory_summary(self):
+        """Persist the rolling summary if older turns were compacted this turn."""
+        if not self.memory.dirty:
+            return
+        ChatSession.objects.filter(id=self.state.id).update(
+            memory_summary=self.memory.summary,
+            memory_summarized_messages=self.memory.summarized_messages,
+        )
+        self.state.memory_summary = self.memory.summary
+        self.state.memory_summarized_messages = self.memory.summarized_messages
+        self.memory.dirty = False
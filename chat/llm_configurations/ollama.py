@@ -1,12 +1,24 @@
+import logging
+
 from langchain_ollama import ChatOllama
 
-def get_ollama_instance(model='gemma3:1b', callbacks=None):
-    """Create and return an LLM instance with specified parameters."""
-    print(f"Using Ollama model: {model}")
+from chat import metrics
+
+logger = logging.getLogger(__name__)
+
+def get_ollama_instance(model='gemma3:1b', callbacks=None, num_ctx=None, **kwargs):
+    """Create and return an LLM instance with specified parameters.
+
+    Extra keyword arguments (base_url, client_kwargs, keep_alive, ...) are
+    passed to ChatOllama; the client registry uses them to share HTTP pools.
+    """
+    metrics.log_sampled(logger, logging.INFO, "Using Ollama model: %s", model)
     return ChatOllama(
         model=model,
         streaming=True,
         callbacks=callbacks,
+        num_ctx=num_ctx,
+        **kwargs,
     )
     
     # qwen2.5-coder:0.5b
\ No newline at end of file
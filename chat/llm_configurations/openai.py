@@ -1,11 +1,12 @@
 from django.conf import settings
 from langchain_openai import ChatOpenAI
 
-def get_openai_instance(callbacks=None):
+def get_openai_instance(callbacks=None, model='chatgpt-4o-latest', **kwargs):
     """Create and return an LLM instance with specified parameters."""
     return ChatOpenAI(
-        model='chatgpt-4o-latest',
+        model=model,
         openai_api_key=settings.OPENAI_API_KEY,
         streaming=True,
         callbacks=callbacks,
+        **kwargs,
     )
\ No newline at end of file
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+from django.conf import settings
+
+from .ollama import get_ollama_instance
+from .openai import get_openai_instance
+
+logger = logging.getLogger(__name__)
+
+
+class LLMClient:
+    """A long-lived LLM instance together with the usage counters of its HTTP pool."""
+
+    def __init__(self, key, loop):
+        self.key = key
+        self.loop = loop
+        self.llm = None
+        self.health_url = None
+        self.http_clients = []
+        self.created_at = time.monotonic()
+        self.uses = 1
+        self.requests = 0
+        self.connections = 0
+        self.healthy = True
+        self.checking = False
+        self.health_failures = 0
+        self.last_health_check = self.created_at
+
+    # httpx memanggil hook request sebelum mengirim; trace httpcore memberi tahu
+    # kapan koneksi TCP baru dibuka, sehingga reuse = request - koneksi baru
+    def _count_connection(self, name, info):
+        if name == "connection.connect_tcp.complete":
+            self.connections += 1
+
+    async def _acount_connection(self, name, info):
+        self._count_connection(name, info)
+
+    def on_request(self, request):
+        self.requests += 1
+        request.extensions["trace"] = self._count_connection
+
+    async def aon_request(self, request):
+        self.requests += 1
+        request.extensions["trace"] = self._acount_connection
+
+    def sync_hooks(self):
+        return {"request": [self.on_request]}
+
+    def async_hooks(self):
+        return {"request": [self.aon_request]}
+
+    async def aclose(self):
+        try:
+            async_client = getattr(self.llm, "_async_client", None)
+            if async_client is not None and hasattr(async_client, "close"):
+                await async_client.close()
+            for http_client in self.http_clients:
+                if isinstance(http_client, httpx.AsyncClient):
+                    await http_client.aclose()
+                else:
+                    http_client.close()
+        except Exception as e:
+            logger.warning("Error closing LLM client %s:%s: %s", self.key[0], self.key[1], e)
+
+    def stats(self):
+        return {
+            "provider": self.key[0],
+            "model": self.key[1],
+            "options": dict(self.key[2]),
+            "uses": self.uses,
+            "requests": self.requests,
+            "connections": self.connections,
+            "healthy": self.healthy,
+            "health_failures": self.health_failures,
+        }
+
+
+def _pool_options():
+    return {
+        "limits": httpx.Limits(
+            max_connections=getattr(settings, "LLM_POOL_MAX_CONNECTIONS", 20),
+            max_keepalive_connections=getattr(settings, "LLM_POOL_MAX_KEEPALIVE", 10),
+            keepalive_expiry=getattr(settings, "LLM_POOL_KEEPALIVE_EXPIRY", 120.0),
+        ),
+        "timeout": httpx.Timeout(
+            getattr(settings, "LLM_REQUEST_TIMEOUT", 120.0),
+            connect=getattr(settings, "LLM_CONNECT_TIMEOUT", 5.0),
+        ),
+    }
+
+
+def _build_ollama(client, model, options):
+    base_url = getattr(settings, "OLLAMA_BASE_URL", "http://localhost:11434")
+    extra = {}
+    keep_alive = getattr(settings, "OLLAMA_KEEP_ALIVE", None)
+    if keep_alive is not None:
+        # Model tetap dimuat di server Ollama di antara giliran chat
+        extra["keep_alive"] = keep_alive
+    client.health_url = base_url.rstrip("/") + "/api/version"
+    client.llm = get_ollama_instance(
+        model=model,
+        base_url=base_url,
+        client_kwargs=_pool_options(),
+        sync_client_kwargs={"event_hooks": client.sync_hooks()},
+        async_client_kwargs={"event_hooks": client.async_hooks()},
+        **extra,
+        **options,
+    )
+
+
+def _build_openai(client, model, options):
+    pool = _pool_options()
+    client.http_clients = [
+        httpx.Client(event_hooks=client.sync_hooks(), **pool),
+        httpx.AsyncClient(event_hooks=client.async_hooks(), **pool),
+    ]
+    client.llm = get_openai_instance(
+        model=model,
+        http_client=client.http_clients[0],
+        http_async_client=client.http_clients[1],
+        **options,
+    )
+
+
+LLM_PROVIDERS = {
+    "ollama": _build_ollama,
+    "openai": _build_openai,
+}
+
+
+class LLMClientRegistry:
+    """Process-wide registry of LLM clients keyed by (provider, model, options).
+
+    Each client keeps its own keep-alive HTTP pool, so after the first turn
+    a request to the same model reuses an open connection instead of
+    building a new client and connecting again. Clients are bound to the
+    event loop that first used them; the least recently used client is
+    closed when more than LLM_REGISTRY_MAX_CLIENTS are open.
+    """
+
+    def __init__(self, max_clients=None, health_check_interval=None):
+        self.max_clients = (
+            max_clients if max_clients is not None
+            else getattr(settings, "LLM_REGISTRY_MAX_CLIENTS", 16)
+        )
+        self.health_check_interval = (
+            health_check_interval if health_check_interval is not None
+            else getattr(settings, "LLM_HEALTH_CHECK_INTERVAL", 30.0)
+        )
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self._tasks = set()
+        self._hits = 0
+        self._misses = 0
+        self._rebuilds = 0
+        self._evictions = 0
+        self._health_failures = 0
+        self._closed_requests = 0
+        self._closed_connections = 0
+
+    async def aget(self, provider, model, **options):
+        """Return the pooled LLM for `provider`/`model`/`options`, building it on first use."""
+        if provider not in LLM_PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        key = (provider, model, tuple(sorted(options.items())))
+        loop = asyncio.get_running_loop()
+        retired = []
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and client.loop is loop and client.healthy:
+                self._clients.move_to_end(key)
+                client.uses += 1
+                self._hits += 1
+            else:
+                if client is None:
+                    self._misses += 1
+                else:
+                    # Loop lain atau health check gagal: pool lama dibuang
+                    self._rebuilds += 1
+                    retired.append(self._clients.pop(key))
+                client = LLMClient(key, loop)
+                LLM_PROVIDERS[provider](client, model, options)
+                self._clients[key] = client
+                while len(self._clients) > self.max_clients:
+                    retired.append(self._clients.popitem(last=False)[1])
+                    self._evictions += 1
+            for old in retired:
+                self._closed_requests += old.requests
+                self._closed_connections += old.connections
+        for old in retired:
+            if old.loop is loop:
+                self._spawn(old.aclose())
+        self._maybe_check_health(client)
+        return client.llm
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _maybe_check_health(self, client):
+        if self.health_check_interval <= 0 or client.health_url is None or client.checking:
+            return
+        if time.monotonic() - client.last_health_check < self.health_check_interval:
+            return
+        # Health check berjalan di latar belakang agar tidak menunda token pertama
+        client.checking = True
+        self._spawn(self.check_health(client))
+
+    async def check_health(self, client):
+        """Ping the provider of `client`; an unhealthy client is rebuilt on its next use."""
+        try:
+            async with httpx.AsyncClient(timeout=getattr(settings, "LLM_HEALTH_CHECK_TIMEOUT", 2.0)) as http:
+                response = await http.get(client.health_url)
+                response.raise_for_status()
+            client.healthy = True
+        except Exception as e:
+            client.healthy = False
+            client.health_failures += 1
+            with self._lock:
+                self._health_failures += 1
+            logger.warning("LLM health check failed for %s:%s: %s", client.key[0], client.key[1], e)
+        finally:
+            client.last_health_check = time.monotonic()
+            client.checking = False
+        return client.healthy
+
+    async def aclose(self):
+        """Close every pooled client that belongs to the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._forget_all()
+        for client in clients:
+            if client.loop is loop:
+                await client.aclose()
+
+    def clear(self):
+        """Forget all clients; their pools are released when garbage collected."""
+        with self._lock:
+            self._forget_all()
+
+    def _forget_all(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            self._closed_requests += client.requests
+            self._closed_connections += client.connections
+        return clients
+
+    def stats(self) -> dict:
+        with self._lock:
+            clients = [client.stats() for client in self._clients.values()]
+            total = self._hits + self._misses
+            requests = self._closed_requests + sum(client["requests"] for client in clients)
+            connections = self._closed_connections + sum(client["connections"] for client in clients)
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "rebuilds": self._rebuilds,
+                "evictions": self._evictions,
+                "health_failures": self._health_failures,
+                "requests": requests,
+                "connections_opened": connections,
+                "connection_reuse_rate": (requests - connections) / requests if requests else 0.0,
+                "clients": clients,
+            }
+
+
+_registry = LLMClientRegistry()
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    return _registry
+
+
+async def aget_llm(provider, model, **options):
+    """Shortcut for `get_llm_registry().aget(provider, model, **options)`."""
+    return await _registry.aget(provider, model, **options)
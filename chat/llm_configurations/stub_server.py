@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Answers the parts of the Ollama API used by ChatOllama with canned streamed tokens."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Satu instance handler per koneksi TCP
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, payload):
+        line = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in self.server.models]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        self.server.requests += 1
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/api/chat":
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        model = request.get("model", "stub")
+        created_at = datetime.now(timezone.utc).isoformat()
+        tokens = self.server.reply_tokens(request)
+        if not request.get("stream", True):
+            self._send_json({
+                "model": model, "created_at": created_at, "done": True, "done_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            if self.server.think_time:
+                # Meniru waktu model memproses prompt sebelum token pertama
+                time.sleep(self.server.think_time)
+            for token in tokens:
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+                self._write_chunk({
+                    "model": model, "created_at": created_at, "done": False,
+                    "message": {"role": "assistant", "content": token},
+                })
+            self._write_chunk({
+                "model": model, "created_at": created_at, "done": True, "done_reason": "stop",
+                "message": {"role": "assistant", "content": ""},
+                "prompt_eval_count": 1, "eval_count": len(tokens),
+            })
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Klien menghentikan stream di tengah jalan
+            self.server.aborted_streams += 1
+            self.close_connection = True
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """Local stand-in for an Ollama server, for tests and benchmarks without a model."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, tokens=32, token_delay=0.0,
+                 models=("gemma3:1b", "qwen2.5-coder:0.5b", "deepseek-r1:1.5b"), verbose=False, think_time=0.0):
+        super().__init__((host, port), StubOllamaHandler)
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.think_time = think_time
+        self.models = list(models)
+        self.verbose = verbose
+        self.connections = 0
+        self.requests = 0
+        self.aborted_streams = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_tokens(self, request):
+        messages = request.get("messages") or [{}]
+        words = (messages[-1].get("content") or "stub").split() or ["stub"]
+        return [f" {words[i % len(words)]}" for i in range(self.tokens)]
+
+    def start(self):
+        """Serve from a daemon thread and return self."""
+        thread = threading.Thread(target=self.serve_forever, name="stub-ollama", daemon=True)
+        thread.start()
+        return self
@@ -0,0 +1,220 @@
+# personaai/chat/loadtest.py
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from chat.llm_configurations.stub_server import StubOllamaServer
+from chat.models import ChatSession
+from chat.rag.benchmark import SyntheticCorpus, benchmark_environment, ingest_corpus, sample_queries
+
+
+class QueryCounter:
+    """Execute wrapper counting SQL statements on every database connection it is installed on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def summarize(values):
+    """count/mean/p50/p95/p99/max of a list of seconds, in milliseconds."""
+    if not values:
+        return {"count": 0}
+    ms = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+class TurnResult:
+    def __init__(self):
+        self.ttft = None
+        self.gaps = []
+        self.tokens = 0
+        self.frames = 0
+        self.stream_time = 0.0
+        self.turn_time = None
+        self.error = None
+
+
+async def _run_turn(communicator, question, timeout):
+    """Send one message and read the reply until the session_info that follows persistence."""
+    result = TurnResult()
+    sent = time.perf_counter()
+    await communicator.send_to(text_data=json.dumps({"message": question}))
+    first = last = None
+    streaming = True
+    while True:
+        message = json.loads(await communicator.receive_from(timeout=timeout))
+        now = time.perf_counter()
+        kind = message.get("type")
+        if kind == "error":
+            # Ditolak scheduler; tidak ada stream yang menyusul
+            result.error = message.get("message")
+            return result
+        if kind == "assistant_response_chunk" and streaming:
+            text = message.get("message", "")
+            if text.startswith("An error occurred"):
+                result.error = text
+            if first is None:
+                first = now
+                result.ttft = now - sent
+            else:
+                result.gaps.append(now - last)
+            last = now
+            result.frames += 1
+            # Token stub Ollama masing-masing satu kata
+            result.tokens += len(text.split())
+        elif kind == "assistant_response_end":
+            streaming = False
+            if first is not None:
+                result.stream_time = last - first
+        elif kind == "session_info" and not streaming:
+            result.turn_time = now - sent
+            return result
+
+
+async def _run_clients(application, sessions, questions, turns, pause, timeout, counter):
+    """Connect every session, then run all clients' turns concurrently.
+
+    Returns (connect times, queries after connecting, wall time of the
+    turns, turn results, queries at the end).
+    """
+    from channels.testing import WebsocketCommunicator
+
+    communicators = [
+        WebsocketCommunicator(application, f"/ws/chat/{session_id}/", headers=[(b"cookie", cookie.encode())])
+        for session_id, cookie in sessions
+    ]
+
+    async def connect(communicator):
+        start = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=timeout)
+        if not connected:
+            raise RuntimeError("Websocket connection was rejected")
+        await communicator.receive_from(timeout=timeout)
+        return time.perf_counter() - start
+
+    connect_times = await asyncio.gather(*(connect(communicator) for communicator in communicators))
+    connect_queries = counter.count
+
+    async def client(index, communicator):
+        results = []
+        for turn in range(turns):
+            question = questions[(index * turns + turn) % len(questions)]
+            results.append(await _run_turn(communicator, question, timeout))
+            if pause:
+                await asyncio.sleep(pause)
+        await communicator.disconnect()
+        return results
+
+    start = time.perf_counter()
+    per_client = await asyncio.gather(*(client(i, c) for i, c in enumerate(communicators)))
+    wall = time.perf_counter() - start
+    results = [result for client_results in per_client for result in client_results]
+    return connect_times, connect_queries, wall, results, counter.count
+
+
+def run_load_test(clients=10, turns=3, tokens=64, token_rate=50.0, think_time=0.2, pause=0.0,
+                  chunks=200, concurrency=None, response_cache=False, timeout=60.0, seed=0, log=None,
+                  database=True):
+    """Drive `clients` simulated websocket users through mysite.asgi.application and measure each turn.
+
+    Runs offline inside `benchmark_environment`: an in-memory channel
+    layer, hashing embeddings over a small synthetic corpus, and a stub
+    Ollama server streaming `tokens` tokens at `token_rate` tokens/s after
+    `think_time` seconds. Users log in with real session cookies, so the
+    auth middleware and the consumer run exactly as in production.
+    Tests, which already run on a test database, pass `database=False`.
+    """
+    log = log or (lambda message: None)
+    server = StubOllamaServer(tokens=tokens, token_delay=1.0 / token_rate if token_rate else 0.0,
+                              think_time=think_time).start()
+    overrides = {
+        "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+        "OLLAMA_BASE_URL": server.url,
+        "RESPONSE_CACHE_ENABLED": response_cache,
+    }
+    if concurrency:
+        overrides["GENERATION_CONCURRENCY"] = concurrency
+    try:
+        with benchmark_environment(database=database, **overrides):
+            log(f"Indexing {chunks} chunks...")
+            owner = User.objects.create(username="loadtest-owner")
+            ingest_corpus(SyntheticCorpus(seed=seed), owner, chunks)
+            questions = sample_queries(max(clients * turns, 1), np.random.default_rng(seed))
+
+            sessions = []
+            for index in range(clients):
+                user = User.objects.create(username=f"loadtest-{index}")
+                browser = Client()
+                browser.force_login(user)
+                cookie = f"{settings.SESSION_COOKIE_NAME}={browser.cookies[settings.SESSION_COOKIE_NAME].value}"
+                sessions.append((ChatSession.objects.create(user=user).id, cookie))
+
+            from mysite.asgi import application
+
+            counter = QueryCounter()
+            connection_created.connect(counter.install)
+            counter.install(connection=connections["default"])
+            try:
+                log(f"Running {clients} clients x {turns} turns...")
+                connect_times, connect_queries, wall, results, total_queries = asyncio.run(
+                    _run_clients(application, sessions, questions, turns, pause, timeout, counter)
+                )
+            finally:
+                connection_created.disconnect(counter.install)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    completed = [result for result in results if result.error is None]
+    stream_rates = [result.tokens / result.stream_time for result in completed if result.stream_time > 0]
+    return {
+        "config": {
+            "clients": clients, "turns": turns, "tokens": tokens, "token_rate": token_rate,
+            "think_time": think_time, "pause": pause, "chunks": chunks,
+            "generation_concurrency": concurrency or getattr(settings, "GENERATION_CONCURRENCY", 2),
+            "response_cache": response_cache,
+        },
+        "turns": len(results),
+        "errors": len(results) - len(completed),
+        "wall_seconds": wall,
+        "turns_per_second": len(completed) / wall if wall else 0.0,
+        "tokens_per_second": sum(result.tokens for result in completed) / wall if wall else 0.0,
+        "connect_ms": summarize(connect_times),
+        "ttft_ms": summarize([result.ttft for result in completed if result.ttft is not None]),
+        "inter_frame_gap_ms": summarize([gap for result in completed for gap in result.gaps]),
+        "turn_ms": summarize([result.turn_time for result in completed if result.turn_time is not None]),
+        "stream_tokens_per_second": {
+            "p50": float(np.percentile(stream_rates, 50)) if stream_rates else 0.0,
+            # Persentil bawah: sesi paling lambat
+            "p1": float(np.percentile(stream_rates, 1)) if stream_rates else 0.0,
+        },
+        "frames_per_turn": float(np.mean([result.frames for result in completed])) if completed else 0.0,
+        "db_queries_per_connect": connect_queries / clients if clients else 0.0,
+        "db_queries_per_turn": (total_queries - connect_queries) / len(results) if results else 0.0,
+        "stub_requests": server.requests,
+    }
@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from chat.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test ChatConsumer offline: simulated websocket clients against mysite.asgi.application "
+        "with an in-memory channel layer, a stub Ollama server and hashing embeddings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help='Concurrent websocket clients.')
+        parser.add_argument('--turns', type=int, default=3, help='Messages sent by each client.')
+        parser.add_argument('--tokens', type=int, default=64, help='Tokens per stub reply.')
+        parser.add_argument('--token-rate', type=float, default=50.0, help='Stub tokens per second.')
+        parser.add_argument('--think-time', type=float, default=0.2, help='Stub seconds before the first token.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds a client waits between turns.')
+        parser.add_argument('--chunks', type=int, default=200, help='Synthetic chunks indexed for retrieval.')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Generations per model at once (default: settings.GENERATION_CONCURRENCY).')
+        parser.add_argument('--response-cache', action='store_true', help='Keep the response cache on.')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for any one frame.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+        parser.add_argument('--output', default=None, help='Also write the JSON results to this file.')
+
+    def handle(self, *args, **options):
+        result = run_load_test(
+            clients=options['clients'],
+            turns=options['turns'],
+            tokens=options['tokens'],
+            token_rate=options['token_rate'],
+            think_time=options['think_time'],
+            pause=options['pause'],
+            chunks=options['chunks'],
+            concurrency=options['concurrency'],
+            response_cache=options['response_cache'],
+            timeout=options['timeout'],
+            seed=options['seed'],
+            log=(lambda message: None) if options['json'] else self.stderr.write,
+        )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write(
+            f"{result['turns']} turns ({result['errors']} errors) in {result['wall_seconds']:.2f}s: "
+            f"{result['turns_per_second']:.1f} turns/s, {result['tokens_per_second']:.0f} tokens/s"
+        )
+        for name in ('connect_ms', 'ttft_ms', 'inter_frame_gap_ms', 'turn_ms'):
+            stats = result[name]
+            if stats['count']:
+                self.stdout.write(
+                    f"{name:>20}: p50 {stats['p50']:.1f}, p95 {stats['p95']:.1f}, "
+                    f"p99 {stats['p99']:.1f}, max {stats['max']:.1f}"
+                )
+        rates = result['stream_tokens_per_second']
+        self.stdout.write(
+            f"{'stream tokens/s':>20}: p50 {rates['p50']:.1f}, p1 {rates['p1']:.1f}; "
+            f"{result['frames_per_turn']:.1f} frames/turn"
+        )
+        self.stdout.write(
+            f"{'db queries':>20}: {result['db_queries_per_connect']:.1f}/connect, "
+            f"{result['db_queries_per_turn']:.1f}/turn"
+        )
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.rag.benchmark import run_benchmark
+
+
+def _parse_size(value):
+    value = value.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    try:
+        return int(float(value.rstrip("km")) * multiplier)
+    except ValueError:
+        raise CommandError(f"Invalid corpus size: {value}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark DocumentRetriever offline on synthetic corpora indexed through the ingestion queue: "
+        "build time, p50/p95/p99 latency, QPS, memory and recall@k per corpus size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1k,10k',
+                            help='Comma-separated corpus sizes in chunks, e.g. 1k,10k,100k,1m.')
+        parser.add_argument('--queries', type=int, default=200, help='Queries per corpus size.')
+        parser.add_argument('--k', type=int, default=4, help='Chunks returned per query.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads for the QPS pass.')
+        parser.add_argument('--backend', choices=['chroma', 'mmap'], default='chroma')
+        parser.add_argument('--no-hybrid', action='store_true', help='Vector search only.')
+        parser.add_argument('--no-rerank', action='store_true', help='Skip the MMR rerank stage.')
+        parser.add_argument('--dim', type=int, default=768, help='Dimensions of the hashing embeddings.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        sizes = [_parse_size(size) for size in options['sizes'].split(',') if size.strip()]
+        if not sizes:
+            raise CommandError("No corpus sizes given.")
+        results = run_benchmark(
+            sizes,
+            queries=options['queries'],
+            k=options['k'],
+            concurrency=options['concurrency'],
+            backend=options['backend'],
+            hybrid=not options['no_hybrid'],
+            rerank=not options['no_rerank'],
+            seed=options['seed'],
+            dimensions=options['dim'],
+            log=(lambda message: None) if options['json'] else self.stderr.write,
+        )
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for result in results:
+            self.stdout.write(
+                f"{result['chunks']:>8} chunks: build {result['build_seconds']:.1f}s, "
+                f"p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, "
+                f"{result['qps']:.0f} q/s @{result['concurrency']}, recall@{result['k']} {result['recall_at_k']:.3f}, "
+                f"rss {result['rss_mb']:.0f}MB, disk {result['disk_mb']:.0f}MB"
+            )
+            stages = ", ".join(f"{stage} {ms:.2f}ms" for stage, ms in result['stages_mean_ms'].items())
+            self.stdout.write(f"{'':>16}{stages}")
+            if result['failed_jobs']:
+                self.stdout.write(self.style.WARNING(f"{'':>16}{result['failed_jobs']} ingestion jobs failed"))
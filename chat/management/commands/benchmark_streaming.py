@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from chat.streaming import TokenCoalescer
+
+
+class Command(BaseCommand):
+    help = "Compare per-token streaming with token coalescing over an in-memory channel layer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=100, help='Concurrent simulated sessions.')
+        parser.add_argument('--tokens', type=int, default=200, help='Tokens streamed per session.')
+        parser.add_argument('--rate', type=float, default=40.0, help='Tokens per second per session.')
+        parser.add_argument('--interval', type=float, default=0.03, help='Coalescing flush interval (s).')
+        parser.add_argument('--bytes', type=int, default=256, help='Coalescing flush size (bytes).')
+
+    def handle(self, *args, **options):
+        modes = [
+            ('per-token', 0, 0),
+            ('coalesced', options['interval'], options['bytes']),
+        ]
+        results = []
+        for name, interval, max_bytes in modes:
+            results.append((name, asyncio.run(self._run(options, interval, max_bytes))))
+
+        for name, result in results:
+            self.stdout.write(
+                f"{name:>10}: {result['messages']} messages, "
+                f"{result['messages'] / result['wall']:.0f} msg/s, "
+                f"wall {result['wall']:.2f}s, cpu {result['cpu']:.2f}s, "
+                f"tokens delivered {result['tokens']}"
+            )
+        base, coalesced = results[0][1], results[1][1]
+        saved = base['messages'] - coalesced['messages']
+        self.stdout.write(self.style.SUCCESS(
+            f"Coalescing saved {saved} messages "
+            f"({saved / max(base['messages'], 1):.1%}), "
+            f"{(base['messages'] - coalesced['messages']) / base['wall']:.0f} msg/s at this load."
+        ))
+
+    async def _run(self, options, interval, max_bytes):
+        layer = InMemoryChannelLayer(capacity=100000)
+        delay = 1.0 / options['rate']
+        delivered = {'messages': 0, 'tokens': 0}
+
+        async def session(index):
+            group = f"chat_bench_{index}"
+            channel = await layer.new_channel()
+            await layer.group_add(group, channel)
+
+            async def emit(text):
+                await layer.group_send(group, {'type': 'assistant_response_chunk', 'message': text})
+
+            async def receive(expected):
+                text = ""
+                while len(text) < expected:
+                    message = await layer.receive(channel)
+                    delivered['messages'] += 1
+                    text += message['message']
+
+            tokens = [f" tok{i}" for i in range(options['tokens'])]
+            receiver = asyncio.create_task(receive(sum(len(t) for t in tokens)))
+            coalescer = TokenCoalescer(emit, interval=interval, max_bytes=max_bytes)
+            for token in tokens:
+                await coalescer.add(token)
+                await asyncio.sleep(delay)
+            await coalescer.close()
+            await receiver
+            delivered['tokens'] += coalescer.tokens
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(session(i) for i in range(options['sessions'])))
+        return {
+            'messages': delivered['messages'],
+            'tokens': delivered['tokens'],
+            'wall': time.perf_counter() - wall,
+            'cpu': time.process_time() - cpu,
+        }
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from chat.llm_configurations.stub_server import StubOllamaServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stub of the Ollama chat API that streams canned tokens. "
+        "Set the OLLAMA_HOST environment variable to its URL (e.g. http://127.0.0.1:11435) "
+        "to exercise chat without a real model."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=11435)
+        parser.add_argument("--tokens", type=int, default=32, help="Tokens streamed per reply")
+        parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between tokens")
+        parser.add_argument("--think-time", type=float, default=0.0, help="Seconds before the first token")
+        parser.add_argument("--verbose", action="store_true", help="Log every request")
+
+    def handle(self, *args, **options):
+        server = StubOllamaServer(
+            host=options["host"], port=options["port"], tokens=options["tokens"],
+            token_delay=options["token_delay"], verbose=options["verbose"], think_time=options["think_time"],
+        )
+        self.stdout.write(f"Stub Ollama server listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.requests} requests over {server.connections} connections")
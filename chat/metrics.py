@@ -0,0 +1,280 @@
+# personaai/chat/metrics.py
+import bisect
+import logging
+import math
+import numbers
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Batas bucket histogram dalam detik, dari query cache sampai generasi panjang
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Hitungan per bucket (non-kumulatif) + satu untuk +Inf, lalu sum
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text format.
+
+    Besides the counters, gauges and histograms registered here, every
+    scrape reads the `stats()` of the subsystem singletons registered as
+    collectors, so their numbers do not have to be duplicated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = {}
+
+    def _register(self, cls, name, help_text, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, source, stats):
+        """`stats()` returns a (possibly nested) dict of numbers exported as personaai_<source>_<key>."""
+        self._collectors[source] = stats
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for source, stats in self._collectors.items():
+            try:
+                values = stats()
+            except Exception as e:
+                # Satu subsistem yang gagal tidak boleh menggagalkan seluruh scrape
+                logger.warning("Error collecting %s metrics: %s", source, e)
+                continue
+            samples = {}
+            _flatten(f"personaai_{source}", values, (), samples)
+            for name, series in samples.items():
+                lines.append(f"# TYPE {name} untyped")
+                for labels, value in series:
+                    lines.append(f"{name}{_format_labels([n for n, _ in labels], [v for _, v in labels])} "
+                                 f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Nama label untuk dict bersarang di stats(), mis. {"models": {"gemma3:1b": {...}}}
+_LABEL_NAMES = {"models": "model", "indexes": "index", "stages": "stage"}
+
+
+def _flatten(prefix, values, labels, samples):
+    """Numbers become samples; a dict of dicts (e.g. per model) becomes a label named after its key."""
+    for key, value in values.items():
+        if isinstance(value, numbers.Number):
+            samples.setdefault(f"{prefix}_{key}", []).append((labels, value))
+        elif isinstance(value, dict) and value and all(isinstance(item, dict) for item in value.values()):
+            label = _LABEL_NAMES.get(key, key)
+            for name, item in value.items():
+                _flatten(prefix, item, labels + ((label, name),), samples)
+        elif isinstance(value, dict):
+            _flatten(f"{prefix}_{key}", value, labels, samples)
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+# Metrik pipeline chat
+STAGE_SECONDS = _registry.histogram(
+    "personaai_chat_stage_seconds",
+    "Duration of each stage of a chat turn (message_save, retrieval, queue_wait, prompt_build, "
+    "llm_ttft, streaming, persistence).",
+    ["stage"],
+)
+RETRIEVAL_STAGE_SECONDS = _registry.histogram(
+    "personaai_retrieval_stage_seconds",
+    "Duration of each retrieval stage (embed, vector, lexical, fusion, rerank_embed, rerank).",
+    ["stage"],
+)
+TURNS = _registry.counter("personaai_chat_turns_total", "Chat turns by outcome.", ["outcome"])
+TOKENS_STREAMED = _registry.counter("personaai_chat_tokens_streamed_total", "Tokens streamed to clients.")
+ACTIVE_CONNECTIONS = _registry.gauge("personaai_chat_active_connections", "Open chat websocket connections.")
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block into the chat stage histogram (only when it finishes without error)."""
+    start = time.perf_counter()
+    yield
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def log_sampled(log, level, message, *args):
+    """Log a hot-path message only if `level` is enabled, and then only for a CHAT_LOG_SAMPLE_RATE share of calls.
+
+    Arguments are formatted lazily, so a disabled message (such as a whole
+    prompt) costs only the level check.
+    """
+    if not log.isEnabledFor(level):
+        return
+    if random.random() >= getattr(settings, "CHAT_LOG_SAMPLE_RATE", 0.1):
+        return
+    log.log(level, message, *args)
+
+
+def _subsystem_collectors():
+    def retriever_pool():
+        from chat.rag.retriever import get_retriever_pool
+        return get_retriever_pool().stats()
+
+    def embedding_cache():
+        if not getattr(settings, "EMBEDDING_CACHE_ENABLED", True):
+            return {}
+        from documents.embedding_cache import get_embedding_cache
+        return get_embedding_cache().stats()
+
+    def response_cache():
+        from chat.rag.response_cache import get_response_cache
+        return get_response_cache().stats()
+
+    def llm_registry():
+        from chat.llm_configurations.registry import get_llm_registry
+        return get_llm_registry().stats()
+
+    def scheduler():
+        from chat.scheduler import get_generation_scheduler
+        return get_generation_scheduler().stats()
+
+    def lexical_index():
+        from documents.lexical_index import get_lexical_index
+        return get_lexical_index().stats()
+
+    def vector_index():
+        from documents.vector_index import loaded_vector_indexes
+        return {"indexes": {name: index.stats() for name, index in loaded_vector_indexes().items()}}
+
+    return {
+        "retriever_pool": retriever_pool,
+        "embedding_cache": embedding_cache,
+        "response_cache": response_cache,
+        "llm_registry": llm_registry,
+        "scheduler": scheduler,
+        "lexical_index": lexical_index,
+        "vector_index": vector_index,
+    }
+
+
+for _source, _stats in _subsystem_collectors().items():
+    _registry.register_collector(_source, _stats)
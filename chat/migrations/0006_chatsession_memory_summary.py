@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chatsession_selected_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='memory_summarized_messages',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='memory_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
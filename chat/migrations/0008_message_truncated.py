@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_token_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='truncated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_message_truncated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=255)),
+                ('persona_key', models.CharField(blank=True, default='', max_length=64)),
+                ('context_hash', models.CharField(max_length=64)),
+                ('query_hash', models.CharField(max_length=64)),
+                ('query', models.TextField()),
+                ('query_embedding', models.BinaryField(blank=True, null=True)),
+                ('embedding_model', models.CharField(blank=True, default='', max_length=255)),
+                ('response', models.TextField()),
+                ('document_ids', models.CharField(blank=True, default='', max_length=1024)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['model_name', 'persona_key', 'context_hash'], name='chat_respon_model_n_5300c9_idx')],
+                'constraints': [models.UniqueConstraint(fields=('model_name', 'persona_key', 'context_hash', 'query_hash'), name='unique_response_cache_key')],
+            },
+        ),
+    ]
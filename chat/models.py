@@ -11,6 +11,9 @@ class ChatSession(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     use_persona = models.BooleanField(default=False)
     selected_model = models.CharField(max_length=255, default="gemma3:1b", blank=True, null=True)
+    # Ringkasan turn lama dan jumlah Message yang sudah diringkas (lihat chat.rag.memory)
+    memory_summary = models.TextField(blank=True, default="")
+    memory_summarized_messages = models.IntegerField(default=0)
     
     def __str__(self):
         return f"{self.title} - {self.user.username}"
@@ -25,10 +28,44 @@ class Message(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=Role.choices)
     content = models.TextField()
+    token_count = models.IntegerField(blank=True, null=True)
+    # True jika generasi dihentikan (tombol stop atau koneksi ditutup) sebelum selesai
+    truncated = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
     
     class Meta:
-        ordering = ['timestamp']
\ No newline at end of file
+        ordering = ['timestamp']
+
+class ResponseCacheEntry(models.Model):
+    """A generated answer reused when a session opens with the same question (see chat.rag.response_cache)."""
+    model_name = models.CharField(max_length=255)
+    # Hash persona (id + teks) atau kosong jika sesi tanpa persona
+    persona_key = models.CharField(max_length=64, blank=True, default="")
+    # Hash potongan dokumen yang diambil retriever untuk pertanyaan ini
+    context_hash = models.CharField(max_length=64)
+    query_hash = models.CharField(max_length=64)
+    query = models.TextField()
+    query_embedding = models.BinaryField(blank=True, null=True)
+    embedding_model = models.CharField(max_length=255, blank=True, default="")
+    response = models.TextField()
+    # Id dokumen dalam konteks, format ",1,5," agar bisa dicari dengan contains
+    document_ids = models.CharField(max_length=1024, blank=True, default="")
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.model_name}: {self.query[:50]}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['model_name', 'persona_key', 'context_hash'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model_name', 'persona_key', 'context_hash', 'query_hash'],
+                name='unique_response_cache_key',
+            )
+        ]
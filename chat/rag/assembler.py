@@ -0,0 +1,90 @@
+# personaai/chat/rag/assembler.py
+from django.conf import settings
+
+from .tokens import count_tokens, get_context_window, truncate_to_tokens
+
+
+def doc_tokens(doc):
+    """Token count of a retrieved chunk, using the count stored at ingestion when present."""
+    stored = doc.metadata.get("token_count")
+    return stored if stored is not None else count_tokens(doc.page_content)
+
+
+class FittedPrompt:
+    """The pieces of a prompt after they were trimmed to fit the model's context window."""
+
+    def __init__(self, query, persona, history, docs, stats):
+        self.query = query
+        self.persona = persona
+        self.history = history
+        self.docs = docs
+        self.stats = stats
+
+
+def fit_prompt(model, query, docs, history_units, persona=None, overhead=0):
+    """Allocate the context window of `model` across persona, history, context and query.
+
+    The query is always kept (truncated only if it alone would not fit)
+    and the persona is capped at PROMPT_PERSONA_SHARE of the budget.
+    Retrieved chunks are admitted in ranking order up to
+    PROMPT_CONTEXT_SHARE of what is left. History turns are then admitted
+    newest first, and leftover room goes back to any chunks that did not
+    fit. The lowest-ranked chunks and the oldest turns are dropped first.
+    """
+    budget = get_context_window(model) - getattr(settings, "LLM_RESPONSE_TOKENS", 1024) - overhead
+    budget = max(budget, 256)
+
+    query = truncate_to_tokens(query, budget // 2)
+    query_tokens = count_tokens(query)
+
+    persona_tokens = 0
+    if persona:
+        persona = truncate_to_tokens(persona, int(budget * getattr(settings, "PROMPT_PERSONA_SHARE", 0.2)))
+        persona_tokens = count_tokens(persona)
+
+    remaining = budget - query_tokens - persona_tokens
+
+    doc_costs = [doc_tokens(doc) for doc in docs]
+    selected = set()
+    context_budget = int(remaining * getattr(settings, "PROMPT_CONTEXT_SHARE", 0.6))
+    used = 0
+    for index, cost in enumerate(doc_costs):
+        if used + cost <= context_budget:
+            selected.add(index)
+            used += cost
+    remaining -= used
+
+    kept_units = []
+    history_tokens = 0
+    for messages, cost in reversed(history_units):
+        if cost > remaining:
+            break
+        kept_units.append(messages)
+        remaining -= cost
+        history_tokens += cost
+    kept_units.reverse()
+
+    # Sisa ruang dipakai untuk chunk yang tadi tidak muat
+    for index, cost in enumerate(doc_costs):
+        if index not in selected and cost <= remaining:
+            selected.add(index)
+            remaining -= cost
+            used += cost
+
+    return FittedPrompt(
+        query=query,
+        persona=persona,
+        history=[message for messages in kept_units for message in messages],
+        docs=[doc for index, doc in enumerate(docs) if index in selected],
+        stats={
+            "budget": budget,
+            "query_tokens": query_tokens,
+            "persona_tokens": persona_tokens,
+            "context_tokens": used,
+            "history_tokens": history_tokens,
+            # Seluruh prompt termasuk instruksi template, untuk menentukan num_ctx
+            "prompt_tokens": overhead + query_tokens + persona_tokens + used + history_tokens,
+            "dropped_docs": len(docs) - len(selected),
+            "dropped_turns": len(history_units) - len(kept_units),
+        },
+    )
@@ -0,0 +1,245 @@
+# personaai/chat/rag/benchmark.py
+import itertools
+import math
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import override_settings
+
+from documents.jobs import run_worker
+from documents.lexical_index import get_lexical_index
+from documents.models import Document, DocumentChunk, IngestionJob
+from documents.utils import CHUNK_OVERLAP, CHUNK_SIZE
+from .retriever import DocumentRetriever, get_retrieval_timings
+
+_SYLLABLES = ["ka", "ri", "to", "ma", "se", "lu", "na", "po", "di", "ge", "ba", "ne", "su", "ya", "wo", "te"]
+# Karakter teks baru per chunk: ukuran chunk splitter dikurangi overlap-nya
+_CHARS_PER_CHUNK = CHUNK_SIZE - CHUNK_OVERLAP
+
+
+class SyntheticCorpus:
+    """Deterministic text corpus for benchmarks; document `i` is the same for the same seed.
+
+    Every document belongs to one of `topics` topics and draws
+    Zipf-distributed words mostly from that topic's slice of a pseudo-word
+    vocabulary, so chunks of one topic are similar to each other and
+    dissimilar to the rest, like course material from different subjects.
+    """
+
+    def __init__(self, seed=0, vocabulary=20000, topics=64, chunks_per_document=50):
+        rng = np.random.default_rng(seed)
+        words = ["".join(parts) for length in (2, 3, 4) for parts in itertools.product(_SYLLABLES, repeat=length)]
+        self.words = np.asarray(words)[rng.permutation(len(words))[:vocabulary]]
+        self.seed = seed
+        self.topics = topics
+        self.chunks_per_document = chunks_per_document
+
+    def document(self, index):
+        """(title, text) of document `index`."""
+        rng = np.random.default_rng([self.seed, index])
+        topic = index % self.topics
+        vocabulary = len(self.words)
+        count = self.chunks_per_document * _CHARS_PER_CHUNK // 8
+        ranks = rng.zipf(1.3, size=count) - 1
+        # Sekitar sepertiga kata berasal dari kosakata umum, sisanya dari kosakata topik
+        offsets = np.where(rng.random(count) < 0.3, 0, topic * (vocabulary // self.topics))
+        words = self.words[(offsets + ranks % (vocabulary // 4)) % vocabulary]
+        lengths = rng.integers(8, 20, size=count // 8 + 1)
+        sentences, start = [], 0
+        for length in lengths:
+            if start >= count:
+                break
+            sentence = " ".join(words[start:start + length])
+            sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+            start += length
+        paragraphs = [
+            f"Bagian {index}.{number}. " + " ".join(sentences[offset:offset + 6])
+            for number, offset in enumerate(range(0, len(sentences), 6))
+        ]
+        return f"Synthetic document {index} (topic {topic})", "\n\n".join(paragraphs)
+
+
+def ingest_corpus(corpus, owner, target_chunks, first_index=0):
+    """Add corpus documents through the ingestion queue until `target_chunks` chunks are indexed.
+
+    Returns (next document index, seconds spent in the ingestion worker
+    and lexical index sync). Writing the upload files is not timed.
+    """
+    index = first_index
+    elapsed = 0.0
+    while True:
+        indexed = DocumentChunk.objects.count()
+        missing = target_chunks - indexed
+        if missing <= 0:
+            return index, elapsed
+        # Jumlah chunk per dokumen diperkirakan dari dokumen yang sudah diindeks
+        per_document = indexed / index if index else corpus.chunks_per_document
+        for _ in range(max(1, math.ceil(missing / per_document))):
+            title, text = corpus.document(index)
+            document = Document(title=title, uploaded_by=owner)
+            # Menyimpan file memicu signal yang memasukkan dokumen ke antrian ingestion
+            document.file.save(f"synthetic-{index}.txt", ContentFile(text.encode("utf-8")))
+            index += 1
+        start = time.perf_counter()
+        run_worker(worker_id="benchmark", once=True)
+        get_lexical_index().ensure_fresh()
+        elapsed += time.perf_counter() - start
+
+
+def sample_queries(count, rng, words=8):
+    """Queries made of a `words`-word span copied from random indexed chunks."""
+    ids = np.asarray(DocumentChunk.objects.values_list("id", flat=True))
+    picked = rng.choice(ids, size=min(count, len(ids)), replace=False)
+    contents = dict(DocumentChunk.objects.filter(id__in=picked.tolist()).values_list("id", "content"))
+    queries = []
+    for chunk_id in picked.tolist():
+        tokens = contents[chunk_id].split()
+        start = int(rng.integers(0, max(1, len(tokens) - words)))
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+def _resident_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Tanpa /proc hanya puncak RSS yang tersedia (KB di Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _disk_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total / (1024 * 1024)
+
+
+def measure(retriever, queries, concurrency=8):
+    """Latency percentiles, recall@k and throughput of `retriever` over `queries`.
+
+    A query counts as recalled when a returned chunk contains the span it
+    was made from. Latencies come from a sequential pass; QPS from a
+    second pass with `concurrency` threads.
+    """
+    timings = get_retrieval_timings()
+    timings.reset()
+    latencies, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.invoke(query)
+        latencies.append(time.perf_counter() - start)
+        hits += any(query in doc.page_content for doc in docs)
+    stages = timings.stats()["stages"]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(retriever.invoke, queries))
+        wall = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "queries": len(queries),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "recall_at_k": hits / len(queries),
+        "concurrency": concurrency,
+        "qps": len(queries) / wall,
+        "stages_mean_ms": {stage: values["mean_ms"] for stage, values in stages.items()},
+    }
+
+
+@contextmanager
+def benchmark_environment(database=True, **overrides):
+    """Offline sandbox for benchmarks: temporary media and vector store, hashing embeddings, a test database.
+
+    Yields the temporary directory; extra settings `overrides` apply on
+    top. The test database and the directory are removed afterwards.
+    Tests, which already run on a test database, pass `database=False`.
+    """
+    workdir = tempfile.mkdtemp(prefix="personaai-benchmark-")
+    settings_overrides = {
+        "MEDIA_ROOT": os.path.join(workdir, "media"),
+        "VECTOR_STORE_PATH": os.path.join(workdir, "vectors"),
+        "VECTOR_INDEX_PATH": os.path.join(workdir, "vectors", "mmap"),
+        "EMBEDDING_BACKEND": "hashing",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "INGESTION_USE_QUEUE": True,
+        # Perubahan index langsung terlihat oleh retriever dan index BM25
+        "RETRIEVER_POOL_REFRESH_INTERVAL": 0,
+    }
+    settings_overrides.update(overrides)
+    try:
+        with override_settings(**settings_overrides):
+            if not database:
+                yield workdir
+                return
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                yield workdir
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_benchmark(sizes, queries=200, k=4, concurrency=8, backend="chroma", hybrid=True, rerank=True,
+                  seed=0, dimensions=768, log=None):
+    """Index growing synthetic corpora of `sizes` chunks and measure retrieval at each size.
+
+    Everything runs offline inside `benchmark_environment`: hashing
+    embeddings, the configured vector `backend` and the real ingestion
+    queue. Sizes are built incrementally, so `build_seconds` is the total
+    ingestion time up to that size.
+    """
+    log = log or (lambda message: None)
+    results = []
+    with benchmark_environment(EMBEDDING_DIMENSIONS=dimensions, VECTOR_BACKEND=backend,
+                               HYBRID_RETRIEVAL_ENABLED=hybrid, RERANK_ENABLED=rerank) as workdir:
+        owner = User.objects.create_user("retrieval-benchmark")
+        corpus = SyntheticCorpus(seed=seed)
+        rng = np.random.default_rng(seed)
+        next_index, build_seconds = 0, 0.0
+        for size in sorted(sizes):
+            log(f"Indexing {size} chunks...")
+            next_index, elapsed = ingest_corpus(corpus, owner, size, next_index)
+            build_seconds += elapsed
+            retriever = DocumentRetriever(n_results=k)
+            batch = sample_queries(queries, rng)
+            # Pemanasan: koneksi, segmen vector store dan index BM25 dimuat sebelum diukur
+            for query in batch[:5]:
+                retriever.invoke(query)
+            log(f"Querying {size} chunks...")
+            result = {
+                "size": size,
+                "chunks": DocumentChunk.objects.count(),
+                "documents": next_index,
+                "failed_jobs": IngestionJob.objects.filter(state=IngestionJob.State.FAILED).count(),
+                "build_seconds": build_seconds,
+                "k": k,
+                "backend": backend,
+                "hybrid": hybrid,
+                "rerank": rerank,
+            }
+            result.update(measure(retriever, batch, concurrency))
+            result["rss_mb"] = _resident_mb()
+            result["disk_mb"] = _disk_mb(workdir)
+            results.append(result)
+    return results
@@ -1,11 +1,14 @@
 # personaai/chat/rag/llm.py
+import logging
+import time
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
-from chat.llm_configurations.ollama import get_ollama_instance
-from chat.llm_configurations.openai import get_openai_instance
-from .persona import get_persona, get_use_persona
-from channels.db import database_sync_to_async
-from chat.models import ChatSession
+from chat.llm_configurations.registry import aget_llm
+from chat import metrics
+from .assembler import fit_prompt
+from .prompt_cache import aget_user_persona, get_prompt_template
+from .tokens import get_num_ctx
+
+logger = logging.getLogger(__name__)
 
 def build_context(retrieved_docs):
     """Build context string from retrieved documents."""
@@ -40,10 +43,11 @@ def create_conversation_prompt(context: str):
     
     
 def create_conversation_prompt_with_persona(context, user_persona):
-    system_template = f"""
+    # Persona diisi sebagai partial variable agar kurung kurawal di teksnya tidak dianggap placeholder
+    system_template = """
     Kamu adalah asisten AI dengan persona berikut:
     
-    {user_persona}
+    {persona}
     """
     
     human_template_context = """
@@ -63,44 +67,51 @@ def create_conversation_prompt_with_persona(context, user_persona):
         MessagesPlaceholder(variable_name="history"),
         ("human", human_template_context.strip()),
         ("human", human_template_question.strip())
-    ])
-    
-@database_sync_to_async
-def get_session_model(session_id):
-    """Retrieve the selecttted model from session"""
-    session = ChatSession.objects.get(id=session_id)
-    return session.selected_model
-    
-async def generate_streaming_response(query, context, memory, token_callback, session_id, user):
-    selected_model= await get_session_model(session_id)
+    ]).partial(persona=str(user_persona))
     
-    llm = get_ollama_instance(model=selected_model)
-    print(f"Selected model: {selected_model}")
+async def generate_streaming_response(query, retrieved_docs, memory, token_callback, session_state, user):
+    # Model dan pengaturan persona diambil dari state koneksi, bukan query ulang ke DB
+    selected_model = session_state.selected_model
     
-    # llm = get_openai_instance()
-    use_persona = await get_use_persona(session_id)
+    metrics.log_sampled(logger, logging.INFO, "Selected model: %s", selected_model)
+    use_persona = session_state.use_persona
     
-    if use_persona and user:
-        user_persona = await get_persona(user)
-        prompt = create_conversation_prompt_with_persona(context, user_persona)
-    else:
-        prompt = create_conversation_prompt(context)
+    with metrics.span("prompt_build"):
+        # Template (beserta persona) diambil dari cache; hanya dibangun ulang jika persona berubah
+        persona_id, user_persona = None, None
+        if use_persona and user:
+            persona_id, user_persona = await aget_user_persona(user)
+        entry = get_prompt_template(persona_id, user_persona, bool(use_persona and user), selected_model)
 
+        # Potong riwayat dan konteks agar muat di context window model
+        fitted = fit_prompt(
+            selected_model, query, retrieved_docs, memory.history_with_tokens(),
+            overhead=entry.overhead
+        )
+        context = build_context(fitted.docs)
 
-    # Muat riwayat dari memory
-    history = memory.load_memory_variables({})["history"]
+        # Format prompt dengan riwayat, query, dan context
+        formatted_prompt = entry.template.format_messages(query=fitted.query, context=context, history=fitted.history)
+    metrics.log_sampled(logger, logging.DEBUG, "Formatted prompt: %s", formatted_prompt)
 
-    # Format prompt dengan riwayat, query, dan context
-    formatted_prompt = prompt.format_messages(query=query, context=context, history=history)
-    print(f"Formatted prompt: {formatted_prompt}")
+    # Klien LLM diambil dari registry agar koneksi ke server model dipakai ulang.
+    # num_ctx mengikuti prompt yang sudah dipotong, bukan seluruh anggaran model
+    llm = await aget_llm("ollama", selected_model, num_ctx=get_num_ctx(selected_model, fitted.stats["prompt_tokens"]))
+    # llm = await aget_llm("openai", "chatgpt-4o-latest")
 
     # Streaming respons
     full_response = ""
+    start = time.perf_counter()
+    first_token_at = None
     async for chunk in llm.astream(formatted_prompt):
         if hasattr(chunk, 'content'):
             token = chunk.content
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                metrics.STAGE_SECONDS.observe(first_token_at - start, stage="llm_ttft")
             full_response += token
             await token_callback(token)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - (first_token_at or start), stage="streaming")
 
     # Simpan query dan respons ke memory
     memory.save_context({"input": query}, {"output": full_response})
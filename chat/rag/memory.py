@@ -0,0 +1,100 @@
+# personaai/chat/rag/memory.py
+import re
+
+from django.conf import settings
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from .tokens import count_tokens
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _first_sentence(text, limit):
+    text = " ".join(text.split())
+    sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+
+class RollingSummaryMemory:
+    """Conversation memory with a bounded prompt footprint.
+
+    The most recent turns are kept verbatim as long as they fit in
+    `max_turns` and `max_tokens`. Older turns are folded into a running
+    extractive summary (the opening sentence of each side of the turn),
+    itself capped at `summary_max_tokens`. The summary and the number of
+    stored messages it covers are persisted on the ChatSession, so a
+    reconnect restores the same state without replaying the whole session.
+
+    Exposes the same `load_memory_variables` / `save_context` interface as
+    LangChain's ConversationBufferMemory.
+    """
+
+    def __init__(self, summary="", summarized_messages=0, max_turns=None, max_tokens=None,
+                 summary_max_tokens=None):
+        self.max_turns = max_turns or getattr(settings, "CHAT_MEMORY_MAX_TURNS", 6)
+        self.max_tokens = max_tokens or getattr(settings, "CHAT_MEMORY_MAX_TOKENS", 1500)
+        self.summary_max_tokens = summary_max_tokens or getattr(settings, "CHAT_MEMORY_SUMMARY_MAX_TOKENS", 300)
+        self.summary_lines = [line for line in summary.splitlines() if line.strip()]
+        self.summarized_messages = summarized_messages
+        # Setiap turn: (input, output, jumlah baris Message yang diwakilinya, (token input, token output))
+        self.turns = []
+        # Baris Message yang tersimpan tanpa turn (mis. pertanyaan yang dibatalkan sebelum ada jawaban)
+        self.pending_messages = 0
+        self.dirty = False
+
+    @property
+    def summary(self):
+        return "\n".join(self.summary_lines)
+
+    @property
+    def has_history(self):
+        return bool(self.turns or self.summary_lines)
+
+    def add_turn(self, user_input, output, message_count=2, tokens=None):
+        """Append a turn; `tokens` are the stored (input, output) token counts if already known."""
+        if tokens is None or None in tokens:
+            tokens = (count_tokens(user_input), count_tokens(output))
+        self.turns.append((user_input, output, message_count + self.pending_messages, tokens))
+        self.pending_messages = 0
+        self._compact()
+
+    def add_unpaired(self, message_count=1):
+        """Count stored messages that belong to no turn.
+
+        They are added to the next turn's message count, the same way
+        reloading the session from the Message rows attributes them, so the
+        summarised offset stays aligned with the stored messages.
+        """
+        self.pending_messages += message_count
+
+    def save_context(self, inputs, outputs):
+        self.add_turn(inputs.get("input", ""), outputs.get("output", ""))
+
+    def load_memory_variables(self, inputs=None):
+        history = [message for messages, _ in self.history_with_tokens() for message in messages]
+        return {"history": history}
+
+    def history_with_tokens(self):
+        """History as (messages, token_count) units, oldest first; a turn is one unit."""
+        units = []
+        if self.summary_lines:
+            summary = f"Ringkasan percakapan sebelumnya:\n{self.summary}"
+            units.append(([SystemMessage(content=summary)], count_tokens(summary)))
+        for user_input, output, _, tokens in self.turns:
+            units.append(([HumanMessage(content=user_input), AIMessage(content=output)], sum(tokens)))
+        return units
+
+    def _turn_tokens(self):
+        return sum(sum(tokens) for _, _, _, tokens in self.turns)
+
+    def _compact(self):
+        # Turn terbaru selalu dipertahankan walaupun sendirian melebihi anggaran
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self._turn_tokens() > self.max_tokens):
+            user_input, output, message_count, _ = self.turns.pop(0)
+            self.summary_lines.append(
+                f"- User: {_first_sentence(user_input, 200)} | Assistant: {_first_sentence(output, 300)}"
+            )
+            self.summarized_messages += message_count
+            self.dirty = True
+        while len(self.summary_lines) > 1 and count_tokens(self.summary) > self.summary_max_tokens:
+            self.summary_lines.pop(0)
@@ -0,0 +1,94 @@
+# personaai/chat/rag/prompt_cache.py
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from accounts.models import UserProfile
+from .tokens import count_tokens, get_context_window, truncate_to_tokens
+
+_lock = threading.Lock()
+# (persona_id, use_persona, model) -> PromptEntry
+_templates = {}
+# user_id -> (persona_id, persona_text, loaded_at)
+_user_personas = {}
+
+
+class PromptEntry:
+    """A compiled prompt template with the persona already bound and its fixed token cost."""
+
+    def __init__(self, template, persona_text, overhead):
+        self.template = template
+        self.persona_text = persona_text
+        self.overhead = overhead
+
+
+def _build_entry(persona_text, use_persona, model):
+    from .generation import create_conversation_prompt, create_conversation_prompt_with_persona
+
+    if use_persona:
+        # Persona dibatasi sesuai porsi anggaran model sekali saja, saat template dibangun
+        budget = get_context_window(model) - getattr(settings, "LLM_RESPONSE_TOKENS", 1024)
+        persona = truncate_to_tokens(str(persona_text), int(budget * getattr(settings, "PROMPT_PERSONA_SHARE", 0.2)))
+        template = create_conversation_prompt_with_persona("", persona)
+    else:
+        template = create_conversation_prompt("")
+    messages = template.format_messages(query="", context="", history=[])
+    # Sekitar 4 token tambahan per pesan untuk penanda peran
+    overhead = sum(count_tokens(message.content) + 4 for message in messages)
+    return PromptEntry(template, persona_text, overhead)
+
+
+def get_prompt_template(persona_id, persona_text, use_persona, model):
+    """Return the cached PromptEntry for (persona_id, use_persona, model), compiling it on a miss."""
+    key = (persona_id if use_persona else None, use_persona, model)
+    entry = _templates.get(key)
+    if entry is not None and entry.persona_text == persona_text:
+        return entry
+    entry = _build_entry(persona_text, use_persona, model)
+    with _lock:
+        _templates[key] = entry
+    return entry
+
+
+def _load_user_persona(user):
+    try:
+        persona = UserProfile.objects.select_related('persona').get(user=user).persona
+    except UserProfile.DoesNotExist:
+        return None, None
+    if persona is None:
+        return None, None
+    return persona.id, persona.description
+
+
+async def aget_user_persona(user):
+    """(persona_id, description) of a user, served from memory after the first lookup."""
+    cached = _user_personas.get(user.id)
+    ttl = getattr(settings, "PROMPT_CACHE_TTL", 300)
+    if cached is not None and time.monotonic() - cached[2] < ttl:
+        return cached[0], cached[1]
+    persona_id, description = await database_sync_to_async(_load_user_persona)(user)
+    with _lock:
+        _user_personas[user.id] = (persona_id, description, time.monotonic())
+    return persona_id, description
+
+
+def invalidate_persona(persona_id):
+    """Drop templates and user mappings that reference a persona."""
+    with _lock:
+        for key in [key for key in _templates if key[0] == persona_id]:
+            del _templates[key]
+        for user_id in [user_id for user_id, cached in _user_personas.items() if cached[0] == persona_id]:
+            del _user_personas[user_id]
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _user_personas.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _templates.clear()
+        _user_personas.clear()
@@ -0,0 +1,103 @@
+# personaai/chat/rag/rerank.py
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .assembler import doc_tokens
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def mmr_select(query_similarity, doc_matrix, relevance, k, lambda_mult=0.7,
+               duplicate_threshold=0.95, costs=None, budget=None):
+    """Maximal marginal relevance over normalised vectors; returns the chosen row indices in order.
+
+    Each step picks the row maximising
+    ``lambda * relevance - (1 - lambda) * max similarity to the rows already chosen``
+    from one vectorised score array. Rows at least `duplicate_threshold`
+    similar to a chosen row are dropped as near-duplicates, and a row
+    whose cost no longer fits the remaining `budget` is skipped.
+    """
+    n = len(query_similarity)
+    if not n or k <= 0:
+        return []
+    pairwise = doc_matrix @ doc_matrix.T
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    remaining = budget if budget is not None else float("inf")
+    chosen = []
+    while len(chosen) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores = np.where(available, scores, -np.inf)
+        index = int(np.argmax(scores))
+        available[index] = False
+        cost = costs[index] if costs is not None else 0
+        if cost > remaining:
+            continue
+        chosen.append(index)
+        remaining -= cost
+        redundancy = np.maximum(redundancy, pairwise[index])
+        available &= pairwise[index] < duplicate_threshold
+    return chosen
+
+
+def _chunk_key(doc):
+    return (doc.metadata.get("document_id"), doc.metadata.get("chunk_index"))
+
+
+def rerank_documents(query_embedding, docs, embeddings_model, k, timings=None, vectors=None):
+    """Shrink over-fetched candidates to a diverse set of at most `k` chunks within the token budget.
+
+    Candidates below RERANK_MIN_SIMILARITY cosine similarity to the query
+    are dropped, then MMR picks from the rest. Relevance for MMR is the
+    upstream ranking score (the RRF score after hybrid fusion, otherwise
+    the cosine similarity), so lexical matches keep the boost fusion gave
+    them. Candidate vectors are taken from `vectors` (the stored vectors
+    returned by the vector search, keyed by (document_id, chunk_index));
+    only candidates without a stored vector are embedded.
+    """
+    timings = timings if timings is not None else {}
+    if not docs:
+        return []
+
+    start = time.perf_counter()
+    vectors = vectors or {}
+    rows = [vectors.get(_chunk_key(doc)) for doc in docs]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        for i, vector in zip(missing, embeddings_model.embed_documents([docs[i].page_content for i in missing])):
+            rows[i] = vector
+    matrix = _normalize(np.asarray(rows, dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    timings["rerank_embed"] = timings.get("rerank_embed", 0.0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    similarity = matrix @ query
+    keep = np.flatnonzero(similarity >= getattr(settings, "RERANK_MIN_SIMILARITY", 0.2))
+    if not len(keep):
+        timings["rerank"] = time.perf_counter() - start
+        return []
+    if all("rrf_score" in docs[i].metadata for i in keep):
+        relevance = np.asarray([docs[i].metadata["rrf_score"] for i in keep], dtype=np.float32)
+        relevance /= relevance.max()
+    else:
+        relevance = similarity[keep]
+    chosen = mmr_select(
+        similarity[keep], matrix[keep], relevance, k,
+        lambda_mult=getattr(settings, "RERANK_MMR_LAMBDA", 0.7),
+        duplicate_threshold=getattr(settings, "RERANK_DUPLICATE_THRESHOLD", 0.95),
+        costs=[doc_tokens(docs[i]) for i in keep],
+        budget=getattr(settings, "RERANK_TOKEN_BUDGET", 1536),
+    )
+    result = []
+    for rank, position in enumerate(chosen):
+        doc = docs[keep[position]]
+        doc.metadata["query_similarity"] = float(similarity[keep[position]])
+        doc.metadata["mmr_rank"] = rank
+        result.append(doc)
+    timings["rerank"] = time.perf_counter() - start
+    return result
@@ -0,0 +1,275 @@
+# personaai/chat/rag/response_cache.py
+import hashlib
+import logging
+import re
+import threading
+from datetime import timedelta
+
+import numpy as np
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from chat.models import ResponseCacheEntry
+from documents.embedding_backends import get_embedding_model_name
+from documents.embedding_cache import normalize_text
+from documents.embedding_utils import get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_query(query):
+    """Whitespace, case and trailing punctuation do not change the question."""
+    return normalize_text(query).rstrip(" ?!.")
+
+
+# Token dengan angka atau pemisah di dalamnya: nomor tugas, kode mata kuliah, nama identifier
+_IDENTIFIER_RE = re.compile(r"[0-9a-z]+(?:[-_.][0-9a-z]+)*")
+_SEPARATOR_RE = re.compile(r"[-_.]")
+
+
+def identifier_terms(query):
+    """Numbers and identifiers in `query` ("assignment 2" -> {"2"}, "IF-2203" -> {"if2203"}).
+
+    Embeddings barely separate "assignment 2" from "assignment 3", so a
+    semantic hit also requires the same set of these terms.
+    """
+    return {
+        _SEPARATOR_RE.sub("", token) for token in _IDENTIFIER_RE.findall(query.casefold())
+        if _SEPARATOR_RE.search(token) or any(ch.isdigit() for ch in token)
+    }
+
+
+def _expiry_cutoff():
+    return timezone.now() - timedelta(seconds=getattr(settings, "RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+
+
+def make_persona_key(persona_id, persona_text):
+    if persona_id is None:
+        return ""
+    return _sha256(f"{persona_id}\x00{persona_text}")
+
+
+def make_context_hash(docs):
+    """Hash of the retrieved chunks, in ranking order."""
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(str(doc.metadata.get("document_id", "")).encode())
+        digest.update(b"\x00")
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+class CacheProbe:
+    """Key of one cacheable turn, computed once for the lookup and reused to store the answer."""
+
+    def __init__(self, model, persona_id, persona_text, docs, query):
+        self.model = model
+        self.persona_key = make_persona_key(persona_id, persona_text)
+        self.context_hash = make_context_hash(docs)
+        self.query = query
+        self.query_hash = _sha256(normalize_query(query))
+        self.identifiers = identifier_terms(query)
+        document_ids = sorted({doc.metadata["document_id"] for doc in docs if "document_id" in doc.metadata})
+        self.document_ids = "," + ",".join(str(i) for i in document_ids) + "," if document_ids else ""
+        self.embedding = None
+        self.embedding_model = ""
+
+
+class CachedResponse:
+    def __init__(self, response, kind):
+        self.response = response
+        self.kind = kind
+
+
+class ResponseCache:
+    """Answers to the opening question of a session, reused across users.
+
+    An entry matches on model, persona, the hash of the retrieved context
+    and the normalised query. With RESPONSE_CACHE_SEMANTIC enabled, a
+    query whose embedding has at least RESPONSE_CACHE_SEMANTIC_THRESHOLD
+    cosine similarity to a cached one (same model, persona and context)
+    and the same numbers and identifiers also counts as a hit. Turns with conversation history are never
+    cached because their answer depends on more than the question.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._lookups = 0
+        self._exact_hits = 0
+        self._semantic_hits = 0
+        self._stores = 0
+        self._skipped = 0
+
+    @property
+    def enabled(self):
+        return getattr(settings, "RESPONSE_CACHE_ENABLED", True)
+
+    @property
+    def semantic(self):
+        return getattr(settings, "RESPONSE_CACHE_SEMANTIC", False)
+
+    def skip(self):
+        """Count a turn that was not eligible for the cache (it has history)."""
+        with self._lock:
+            self._skipped += 1
+
+    def _embed(self, probe):
+        if self._embeddings is None:
+            # Embedding query biasanya sudah ada di cache embedding karena retriever baru saja memakainya
+            self._embeddings = get_embedding_model()
+        probe.embedding = np.asarray(self._embeddings.embed_query(probe.query), dtype=np.float32)
+        probe.embedding_model = get_embedding_model_name()
+
+    def _entries(self, probe):
+        return ResponseCacheEntry.objects.filter(
+            model_name=probe.model,
+            persona_key=probe.persona_key,
+            context_hash=probe.context_hash,
+            created_at__gte=_expiry_cutoff(),
+        )
+
+    def lookup(self, probe):
+        """Return a CachedResponse for `probe`, or None on a miss.
+
+        The exact key is looked up first (one row via the unique constraint);
+        candidate embeddings are only read for the semantic fallback.
+        """
+        with self._lock:
+            self._lookups += 1
+        match = self._entries(probe).filter(query_hash=probe.query_hash).only("id", "response").first()
+        kind = "exact"
+
+        if match is None and self.semantic:
+            try:
+                self._embed(probe)
+            except Exception as e:
+                logger.warning("Error embedding query for response cache: %s", e)
+            if probe.embedding is not None:
+                candidates = self._entries(probe).exclude(query_embedding=None).filter(
+                    embedding_model=probe.embedding_model
+                ).only("id", "query", "query_embedding")
+                match = self._nearest(probe, list(candidates[:getattr(settings, "RESPONSE_CACHE_MAX_CANDIDATES", 200)]))
+                kind = "semantic"
+
+        if match is None:
+            return None
+        ResponseCacheEntry.objects.filter(id=match.id).update(hits=F("hits") + 1, last_hit_at=timezone.now())
+        with self._lock:
+            if kind == "exact":
+                self._exact_hits += 1
+            else:
+                self._semantic_hits += 1
+        # Pada hit semantik kolom response baru dibaca untuk satu entri yang cocok
+        return CachedResponse(match.response, kind)
+
+    def _nearest(self, probe, candidates):
+        rows = [
+            entry for entry in candidates
+            if entry.query_embedding and identifier_terms(entry.query) == probe.identifiers
+        ]
+        if not rows:
+            return None
+        matrix = np.stack([np.frombuffer(bytes(entry.query_embedding), dtype=np.float32) for entry in rows])
+        if matrix.shape[1] != probe.embedding.shape[0]:
+            return None
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(probe.embedding)
+        scores = matrix @ probe.embedding / np.where(norms == 0, 1.0, norms)
+        best = int(np.argmax(scores))
+        if scores[best] >= getattr(settings, "RESPONSE_CACHE_SEMANTIC_THRESHOLD", 0.92):
+            return rows[best]
+        return None
+
+    def store(self, probe, response):
+        """Remember `response` as the answer for `probe`."""
+        if not response:
+            return
+        if self.semantic and probe.embedding is None:
+            try:
+                self._embed(probe)
+            except Exception as e:
+                logger.warning("Error embedding query for response cache: %s", e)
+        key = {
+            "model_name": probe.model,
+            "persona_key": probe.persona_key,
+            "context_hash": probe.context_hash,
+            "query_hash": probe.query_hash,
+        }
+        # Entri kedaluwarsa yang belum di-prune masih memegang unique key dan akan menolak jawaban baru
+        ResponseCacheEntry.objects.filter(**key, created_at__lt=_expiry_cutoff()).delete()
+        ResponseCacheEntry.objects.bulk_create(
+            [ResponseCacheEntry(
+                **key,
+                query=probe.query,
+                query_embedding=probe.embedding.tobytes() if probe.embedding is not None else None,
+                embedding_model=probe.embedding_model,
+                response=response,
+                document_ids=probe.document_ids,
+            )],
+            ignore_conflicts=True,
+        )
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % 100 == 0
+        if prune:
+            prune_expired()
+
+    async def alookup(self, probe):
+        return await database_sync_to_async(self.lookup)(probe)
+
+    async def astore(self, probe, response):
+        await database_sync_to_async(self.store)(probe, response)
+
+    def stats(self) -> dict:
+        """Counters of this process."""
+        with self._lock:
+            hits = self._exact_hits + self._semantic_hits
+            return {
+                "lookups": self._lookups,
+                "exact_hits": self._exact_hits,
+                "semantic_hits": self._semantic_hits,
+                "hit_rate": hits / self._lookups if self._lookups else 0.0,
+                "stores": self._stores,
+                "skipped_with_history": self._skipped,
+            }
+
+
+def stored_stats():
+    """Hit rate across all processes, from the counters kept on the entries.
+
+    Every stored entry stands for one miss that was answered by the model,
+    so the rate is hits / (hits + entries).
+    """
+    entries = ResponseCacheEntry.objects.count()
+    hits = ResponseCacheEntry.objects.aggregate(total=Sum("hits"))["total"] or 0
+    return {
+        "entries": entries,
+        "hits": hits,
+        "hit_rate": hits / (hits + entries) if hits + entries else 0.0,
+    }
+
+
+def invalidate_documents(document_ids):
+    """Drop cached answers whose context came from any of `document_ids`."""
+    deleted = 0
+    for document_id in document_ids:
+        deleted += ResponseCacheEntry.objects.filter(document_ids__contains=f",{document_id},").delete()[0]
+    return deleted
+
+
+def prune_expired():
+    return ResponseCacheEntry.objects.filter(created_at__lt=_expiry_cutoff()).delete()[0]
+
+
+_cache = ResponseCache()
+
+
+def get_response_cache() -> ResponseCache:
+    return _cache
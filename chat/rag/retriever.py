@@ -1,57 +1,536 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import uuid
 from typing import List, Optional, Any
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document as LangChainDocument
+from langchain_core.vectorstores import VectorStore
 from django.conf import settings
-from documents.utils import get_chroma_collection
-from documents.embedding_utils import get_embedding_model
+from django.db import close_old_connections
+from documents.embedding_utils import get_embedding_model, get_collection_name, get_vector_store_version, is_local_version
+from documents.lexical_index import get_lexical_index
+from documents.models import DocumentChunk
+from documents.partitions import SHARED_PARTITION, get_partition_directory
+from documents.vector_index import get_vector_index
 from pydantic import Field
 from langchain_community.vectorstores import Chroma
+from chat import metrics
+from .rerank import _chunk_key, rerank_documents
+
+logger = logging.getLogger(__name__)
+
+
+class MmapVectorStore(VectorStore):
+    """LangChain adapter over the memory-mapped MmapVectorIndex.
+
+    Scores are returned as squared L2 distances between normalised vectors
+    (2 - 2 * cosine), the same scale Chroma's default space reports, so the
+    `similarity_score` metadata means the same thing on both backends.
+    """
+
+    def __init__(self, index, embedding_function):
+        self.index = index
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.index.upsert(ids, self._embedding_function.embed_documents(texts), metadatas=metadatas, documents=texts)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, collection_name=None, **kwargs):
+        store = cls(get_vector_index(collection_name or get_collection_name()), embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        return [
+            (LangChainDocument(page_content=content, metadata=metadata), 2.0 - 2.0 * similarity)
+            for content, metadata, similarity in self.index.search(embedding, k=k)
+        ]
+
+    def similarity_search_with_vectors(self, embedding, k=4):
+        """(document, distance, stored vector) for the top `k` rows."""
+        return [
+            (LangChainDocument(page_content=content, metadata=metadata), 2.0 - 2.0 * similarity, vector)
+            for content, metadata, similarity, vector in self.index.search(embedding, k=k, include_vectors=True)
+        ]
+
+    def get_vectors(self, ids):
+        """Stored vectors by embedding ID; IDs not in this index are left out."""
+        result = self.index.get(ids=ids, include=("embeddings",))
+        return dict(zip(result["ids"], result["embeddings"]))
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(self._embedding_function.embed_query(query), k=k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+
+class ChromaVectorStore(Chroma):
+    """LangChain Chroma store that can also return the stored vectors of its hits."""
+
+    def similarity_search_with_vectors(self, embedding, k=4):
+        """(document, distance, stored vector) for the top `k` chunks, in one Chroma query."""
+        result = self._collection.query(
+            query_embeddings=[embedding], n_results=k,
+            include=["documents", "metadatas", "distances", "embeddings"],
+        )
+        return [
+            (LangChainDocument(page_content=content, metadata=metadata or {}), distance, vector)
+            for content, metadata, distance, vector in zip(
+                result["documents"][0], result["metadatas"][0], result["distances"][0], result["embeddings"][0]
+            )
+        ]
+
+    def get_vectors(self, ids):
+        """Stored vectors by embedding ID; IDs not in this collection are left out."""
+        result = self._collection.get(ids=ids, include=["embeddings"])
+        return dict(zip(result["ids"], result["embeddings"]))
+
+
+def search_with_vectors(store, embedding, k):
+    """(document, distance, stored vector or None) for the top `k` hits of any vector store.
+
+    Stores without `similarity_search_with_vectors` return None vectors;
+    the rerank stage embeds those texts itself.
+    """
+    search = getattr(store, "similarity_search_with_vectors", None)
+    if search is not None:
+        return search(embedding, k=k)
+    return [(doc, score, None) for doc, score in store.similarity_search_by_vector_with_relevance_scores(embedding, k=k)]
+
+
+def _build_chroma(embeddings_model, partition=None):
+    return ChromaVectorStore(
+        persist_directory=settings.VECTOR_STORE_PATH,
+        embedding_function=embeddings_model,
+        collection_name=get_collection_name(partition=partition)
+    )
+
+
+def _build_mmap(embeddings_model, partition=None):
+    return MmapVectorStore(get_vector_index(get_collection_name(partition=partition)), embeddings_model)
+
+
+# Backend vector store yang bisa dipilih lewat settings.VECTOR_BACKEND
+VECTOR_BACKENDS = {
+    "chroma": _build_chroma,
+    "mmap": _build_mmap,
+}
+
+
+def build_vectorstore(embeddings_model, backend=None, partition=None) -> VectorStore:
+    """LangChain vector store of the configured backend for the current embedding model and a partition."""
+    backend = backend or getattr(settings, "VECTOR_BACKEND", "chroma")
+    try:
+        factory = VECTOR_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown vector backend: {backend}")
+    return factory(embeddings_model, partition=partition)
+
+
+def reciprocal_rank_fusion(rankings, weights, k=60):
+    """Fuse ranked document lists: score(d) = sum(weight / (k + rank)) over the lists containing d.
+
+    Chunks are matched on (document_id, chunk_index); the first list that
+    contains a chunk supplies its Document. Returns (document, score)
+    pairs, best first.
+    """
+    scores = {}
+    documents = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            key = _chunk_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+            documents.setdefault(key, doc)
+    order = sorted(scores, key=scores.get, reverse=True)
+    return [(documents[key], scores[key]) for key in order]
+
+
+class RetrievalTimings:
+    """Process-wide latency totals per retrieval stage (embed, vector, lexical, fusion, rerank)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._queries = 0
+
+    def record(self, timings: dict):
+        for stage, seconds in timings.items():
+            metrics.RETRIEVAL_STAGE_SECONDS.observe(seconds, stage=stage)
+        with self._lock:
+            self._queries += 1
+            for stage, seconds in timings.items():
+                count, total, worst = self._stages.get(stage, (0, 0.0, 0.0))
+                self._stages[stage] = (count + 1, total + seconds, max(worst, seconds))
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._queries = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queries": self._queries,
+                "stages": {
+                    stage: {"count": count, "mean_ms": total / count * 1000, "max_ms": worst * 1000}
+                    for stage, (count, total, worst) in self._stages.items()
+                },
+            }
+
+
+_timings = RetrievalTimings()
+
+
+def get_retrieval_timings() -> RetrievalTimings:
+    return _timings
+
 
 class DocumentRetriever(BaseRetriever):
-    """Retriever that uses ChromaDB to retrieve document chunks based on embeddings."""
+    """Retriever that searches the configured vector backend for document chunks.
+
+    With hybrid retrieval on, the vector results are fused with BM25
+    results from the lexical index by reciprocal rank fusion, so exact
+    identifiers and course codes that embeddings blur still get found.
+
+    Every partition has its own collection. A query only searches the
+    `partitions` it is given (the session's entitlements) that hold
+    chunks; None searches all of them.
+
+    With reranking on, more candidates are fetched and `rerank_documents`
+    drops weak and near-duplicate chunks and picks a diverse set of at
+    most `n_results` that fits RERANK_TOKEN_BUDGET.
+    """
     n_results: int = Field(default=2, description="Number of results to return")
-    vectorstore: Chroma = None 
-    def __init__(self, n_results: int = 2):
+    hybrid: bool = Field(default=True, description="Fuse vector and BM25 results")
+    rerank: bool = Field(default=True, description="Threshold and MMR-select the candidates")
+    vectorstore: VectorStore = None 
+    def __init__(self, n_results: int = 2, embeddings_model=None, vectorstore=None, hybrid=None, rerank=None):
         super().__init__()
         self.n_results = n_results
-        self.tags = ["chroma", "document_retriever"]
-        self._embeddings_model = get_embedding_model()
+        self.hybrid = hybrid if hybrid is not None else getattr(settings, "HYBRID_RETRIEVAL_ENABLED", True)
+        self.rerank = rerank if rerank is not None else getattr(settings, "RERANK_ENABLED", True)
+        self.tags = [getattr(settings, "VECTOR_BACKEND", "chroma"), "document_retriever"]
+        self._embeddings_model = embeddings_model or get_embedding_model()
         
-        # Buat instance Chroma dari LangChain
-        self.vectorstore = Chroma(
-            persist_directory=settings.VECTOR_STORE_PATH,
-            embedding_function=self._embeddings_model,
-            collection_name="personaai"
-        )
+        self.vectorstore = vectorstore or build_vectorstore(self._embeddings_model)
+        self._stores = {SHARED_PARTITION: self.vectorstore}
+        self._stores_lock = threading.Lock()
     
     # Implementasi metode _invoke baru yang direkomendasikan LangChain
     def _invoke(self, query: str, **kwargs) -> List[LangChainDocument]:
         """New standard method to retrieve documents."""
-        print(f"Query received: {query}")
-        return self.get_relevant_documents(query, run_manager=kwargs.get("run_manager"))
+        metrics.log_sampled(logger, logging.DEBUG, "Query received: %s", query)
+        return self._get_relevant_documents(
+            query, run_manager=kwargs.get("run_manager"), partitions=kwargs.get("partitions")
+        )
+
+    def _vectorstore_for(self, partition: str) -> VectorStore:
+        store = self._stores.get(partition)
+        if store is None:
+            with self._stores_lock:
+                store = self._stores.get(partition)
+                if store is None:
+                    store = self._stores[partition] = build_vectorstore(self._embeddings_model, partition=partition)
+        return store
         
-    def get_relevant_documents(self, query: str, *, run_manager: Optional[Any] = None) -> List[LangChainDocument]:
-        """Retrieve relevant document chunks for a query with similarity search."""
+    def get_relevant_documents(self, query: str, *, run_manager: Optional[Any] = None,
+                               partitions: Optional[List[str]] = None) -> List[LangChainDocument]:
+        """Retrieve relevant document chunks for a query with similarity search over the searchable partitions."""
         try:
-            # Menggunakan similarity_search dari LangChain
-            documents = self.vectorstore.similarity_search_with_score(
-                query=query,
-                k=self.n_results
-            )
-            for doc, score in documents:
+            # Untuk fusi dan rerank diambil lebih banyak kandidat daripada yang dikembalikan
+            fetch_k = self.n_results
+            if self.hybrid:
+                fetch_k = max(fetch_k, getattr(settings, "HYBRID_CANDIDATES", 8))
+            if self.rerank:
+                fetch_k = max(fetch_k, getattr(settings, "RERANK_CANDIDATES", 20))
+            timings = {}
+            searchable = get_partition_directory().searchable(partitions)
+            documents = []
+            # Vektor tersimpan dari hasil pencarian dipakai ulang oleh rerank, tanpa embedding ulang
+            vectors = {}
+            embedding = None
+            if searchable:
+                # Query di-embed sekali lalu dicari di koleksi setiap partisi
+                start = time.perf_counter()
+                embedding = self._embeddings_model.embed_query(query)
+                timings["embed"] = time.perf_counter() - start
+                start = time.perf_counter()
+                for partition in searchable:
+                    for doc, score, vector in search_with_vectors(self._vectorstore_for(partition), embedding, fetch_k):
+                        documents.append((doc, score))
+                        if vector is not None:
+                            vectors[_chunk_key(doc)] = vector
+                documents.sort(key=lambda item: item[1])
+                timings["vector"] = time.perf_counter() - start
+            for doc, score in documents[:fetch_k]:
                 doc.metadata["similarity_score"] = score
             
-            result_docs = [doc for doc, _ in documents]
-            return result_docs
+            result_docs = [doc for doc, _ in documents[:fetch_k]]
+            if self.hybrid:
+                result_docs = self._fuse_lexical(query, result_docs, searchable, fetch_k, timings)
+            if self.rerank and embedding is not None:
+                start = time.perf_counter()
+                self._add_stored_vectors(result_docs, vectors, searchable)
+                timings["rerank_embed"] = time.perf_counter() - start
+                result_docs = rerank_documents(embedding, result_docs, self._embeddings_model, self.n_results, timings,
+                                               vectors=vectors)
+            get_retrieval_timings().record(timings)
+            return result_docs[:self.n_results]
         except Exception as e:
-            print(f"Error retrieving documents: {e}")
+            logger.exception("Error retrieving documents: %s", e)
             return []
+
+    def _add_stored_vectors(self, docs, vectors, partitions):
+        """Fill `vectors` for hits found only lexically from the stored vectors of their chunks."""
+        ids = {doc.metadata["embedding_id"]: _chunk_key(doc) for doc in docs
+               if _chunk_key(doc) not in vectors and doc.metadata.get("embedding_id")}
+        for partition in partitions:
+            if not ids:
+                return
+            get_vectors = getattr(self._vectorstore_for(partition), "get_vectors", None)
+            if get_vectors is None:
+                continue
+            for embedding_id, vector in get_vectors(list(ids)).items():
+                vectors[ids.pop(embedding_id)] = vector
+
+    def _fuse_lexical(self, query: str, vector_docs: List[LangChainDocument],
+                      partitions: Optional[List[str]] = None, k: Optional[int] = None,
+                      timings: Optional[dict] = None) -> List[LangChainDocument]:
+        timings = timings if timings is not None else {}
+        start = time.perf_counter()
+        try:
+            lexical_docs = self.lexical_search(query, k or getattr(settings, "HYBRID_CANDIDATES", 8), partitions)
+        except Exception as e:
+            # Pencarian leksikal hanya pelengkap; hasil vektor tetap dipakai
+            logger.warning("Error in lexical retrieval: %s", e)
+            return vector_docs
+        finally:
+            timings["lexical"] = time.perf_counter() - start
+        if not lexical_docs:
+            return vector_docs
+
+        start = time.perf_counter()
+        lexical_scores = {_chunk_key(doc): doc.metadata["lexical_score"] for doc in lexical_docs}
+        fused = reciprocal_rank_fusion(
+            [vector_docs, lexical_docs],
+            [getattr(settings, "HYBRID_VECTOR_WEIGHT", 1.0), getattr(settings, "HYBRID_LEXICAL_WEIGHT", 1.0)],
+            k=getattr(settings, "HYBRID_RRF_K", 60),
+        )
+        result_docs = []
+        for doc, score in fused:
+            key = _chunk_key(doc)
+            if key in lexical_scores:
+                doc.metadata["lexical_score"] = lexical_scores[key]
+            doc.metadata["rrf_score"] = score
+            result_docs.append(doc)
+        timings["fusion"] = time.perf_counter() - start
+        return result_docs[:k] if k else result_docs
+
+    def lexical_search(self, query: str, k: int, partitions: Optional[List[str]] = None) -> List[LangChainDocument]:
+        """BM25 top-`k` chunks as Documents with the same metadata as the vector results."""
+        index = get_lexical_index()
+        index.ensure_fresh()
+        hits = index.search(query, k=k, partitions=partitions)
+        if not hits:
+            return []
+        rows = {
+            chunk_id: (content, token_count, embedding_id)
+            for chunk_id, content, token_count, embedding_id in DocumentChunk.objects.filter(
+                id__in=[hit.chunk_id for hit in hits]
+            ).values_list("id", "content", "token_count", "embedding_id")
+        }
+        documents = []
+        for hit in hits:
+            if hit.chunk_id not in rows:
+                # Chunk sudah diganti sejak sinkronisasi terakhir
+                continue
+            content, token_count, embedding_id = rows[hit.chunk_id]
+            documents.append(LangChainDocument(
+                page_content=content,
+                metadata={
+                    "document_id": hit.document_id,
+                    "chunk_index": hit.chunk_index,
+                    "token_count": token_count,
+                    "embedding_id": embedding_id,
+                    "lexical_score": hit.score,
+                },
+            ))
+        return documents
             
-    async def aget_relevant_documents(self, query: str, *, run_manager: Optional[Any] = None) -> List[LangChainDocument]:
-        """Asynchronous version of get_relevant_documents."""
-        return self.get_relevant_documents(query, run_manager=run_manager)
+    async def aget_relevant_documents(self, query: str, *, run_manager: Optional[Any] = None,
+                                      partitions: Optional[List[str]] = None) -> List[LangChainDocument]:
+        """Asynchronous version of get_relevant_documents.
+
+        The embedding call and the vector search run on the bounded retrieval
+        executor so they never block the event loop; a search that exceeds
+        RETRIEVAL_TIMEOUT returns no documents.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            get_retrieval_executor(),
+            # BaseRetriever memindahkan implementasi get_relevant_documents ke _get_relevant_documents
+            functools.partial(_with_db_connection, self._get_relevant_documents, query,
+                              run_manager=run_manager, partitions=partitions),
+        )
+        timeout = getattr(settings, "RETRIEVAL_TIMEOUT", 10.0)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            # Isi query tidak dicatat: bisa berisi data pribadi dan timeout bisa terjadi untuk setiap query
+            logger.warning("Retrieval timed out after %.1fs", timeout)
+            return []
     
     # Implementasi metode _ainvoke untuk async (opsional)
     async def _ainvoke(self, query: str, **kwargs) -> List[LangChainDocument]:
         """New standard async method to retrieve documents."""
-        return await self.aget_relevant_documents(query, run_manager=kwargs.get("run_manager"))
\ No newline at end of file
+        return await self.aget_relevant_documents(
+            query, run_manager=kwargs.get("run_manager"), partitions=kwargs.get("partitions")
+        )
+
+
+class RetrieverPool:
+    """Process-wide registry of warm retrievers sharing one embedding client and vector store handle."""
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = (
+            refresh_interval if refresh_interval is not None
+            else getattr(settings, "RETRIEVER_POOL_REFRESH_INTERVAL", 5.0)
+        )
+        self._lock = threading.Lock()
+        self._retrievers = {}
+        self._embeddings_model = None
+        self._vectorstore = None
+        self._version = None
+        self._checked_at = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._init_time = 0.0
+
+    def get(self, n_results: int = 2) -> DocumentRetriever:
+        """Return a warm retriever for `n_results`, building it on first use."""
+        with self._lock:
+            self._refresh_if_changed()
+            retriever = self._retrievers.get(n_results)
+            if retriever is not None:
+                self._hits += 1
+                return retriever
+
+            self._misses += 1
+            start = time.perf_counter()
+            if self._vectorstore is None:
+                self._embeddings_model = get_embedding_model()
+                self._vectorstore = build_vectorstore(self._embeddings_model)
+            retriever = DocumentRetriever(
+                n_results=n_results,
+                embeddings_model=self._embeddings_model,
+                vectorstore=self._vectorstore,
+            )
+            self._init_time += time.perf_counter() - start
+            self._retrievers[n_results] = retriever
+            return retriever
+
+    def _refresh_if_changed(self):
+        # Cek marker vector store paling sering sekali per refresh_interval
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        version = get_vector_store_version()
+        if self._version is None:
+            self._version = version
+            return
+        if version == self._version:
+            return
+
+        self._version = version
+        if is_local_version(version):
+            # Ditulis oleh proses ini; client Chroma yang sama sudah melihat perubahannya
+            return
+        self._reset_handles()
+        self._refreshes += 1
+
+    def _reset_handles(self):
+        self._retrievers.clear()
+        self._vectorstore = None
+        self._embeddings_model = None
+        try:
+            # Chroma menyimpan system per path; buang agar segmen dimuat ulang dari disk
+            from chromadb.api.client import SharedSystemClient
+            SharedSystemClient.clear_system_cache()
+        except Exception as e:
+            logger.warning("Error clearing Chroma system cache: %s", e)
+
+    def clear(self):
+        """Drop all warm handles; the next `get` rebuilds them."""
+        with self._lock:
+            self._reset_handles()
+            self._version = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "refreshes": self._refreshes,
+                "init_time_seconds": self._init_time,
+                "warm_retrievers": len(self._retrievers),
+            }
+
+
+_pool = RetrieverPool()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _with_db_connection(func, *args, **kwargs):
+    """Run `func` on an executor thread, closing stale or broken DB connections before and after."""
+    # Thread executor tidak melewati request_started/request_finished, sama seperti database_sync_to_async
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    """Shared thread pool that bounds how many retrievals run at once."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "RETRIEVAL_MAX_WORKERS", 4),
+                    thread_name_prefix="retrieval",
+                )
+    return _executor
+
+
+def get_retriever_pool() -> RetrieverPool:
+    return _pool
+
+
+def get_retriever(n_results: int = 2) -> DocumentRetriever:
+    """Shortcut for `get_retriever_pool().get(n_results)`."""
+    return _pool.get(n_results)
+
+
+async def aget_retriever(n_results: int = 2) -> DocumentRetriever:
+    """Async variant of `get_retriever`; a cold pool is built off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_retrieval_executor(), _with_db_connection, _pool.get, n_results)
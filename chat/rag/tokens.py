@@ -0,0 +1,75 @@
+# personaai/chat/rag/tokens.py
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    # tiktoken hanya dipakai jika diaktifkan; pemuatan pertama bisa mengunduh file encoding
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if getattr(settings, "TOKEN_COUNTER", "estimate") == "tiktoken":
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning("Error loading tiktoken, falling back to estimates: %s", e)
+    return _encoding
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """Token count of `text`; results are memoised so repeated history and chunks are counted once."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Perkiraan murah: sekitar empat karakter per token untuk teks Latin
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` so it fits in roughly `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max(0, (max_tokens - 1) * 4)]
+
+
+def get_context_window(model):
+    windows = getattr(settings, "LLM_CONTEXT_WINDOWS", {})
+    return windows.get(model, getattr(settings, "LLM_DEFAULT_CONTEXT_WINDOW", 4096))
+
+
+# Ukuran num_ctx dibulatkan ke pangkat dua agar klien LLM dan model yang dimuat Ollama hanya punya sedikit variasi
+_MIN_NUM_CTX = 2048
+
+
+def get_num_ctx(model, prompt_tokens):
+    """Context size to request from the model server for a fitted prompt of `prompt_tokens`.
+
+    An LLM_NUM_CTX entry for `model` is used as is. Otherwise the prompt
+    plus LLM_RESPONSE_TOKENS is rounded up to a power of two (at least
+    2048) and capped at the model's LLM_CONTEXT_WINDOWS budget.
+    """
+    configured = getattr(settings, "LLM_NUM_CTX", {}).get(model)
+    if configured:
+        return configured
+    needed = prompt_tokens + getattr(settings, "LLM_RESPONSE_TOKENS", 1024)
+    size = _MIN_NUM_CTX
+    while size < needed:
+        size *= 2
+    return min(size, max(get_context_window(model), _MIN_NUM_CTX))
@@ -0,0 +1,204 @@
+# personaai/chat/scheduler.py
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+
+class GenerationRejected(Exception):
+    """Raised when a generation request cannot be queued or waited too long."""
+
+
+class GenerationTicket:
+    """A queued generation request of one user for one model."""
+
+    def __init__(self, model, user_id):
+        self.model = model
+        self.user_id = user_id
+        self.position = 0
+        self.admitted = False
+        self.queued = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.changed = asyncio.Event()
+
+
+class _ModelQueue:
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        # user_id -> deque tiket; urutan dict menentukan giliran round-robin
+        self.users = OrderedDict()
+        self.size = 0
+
+    def fair_order(self):
+        """Waiting tickets in the order they will be admitted: one per user per round."""
+        queues = [list(tickets) for tickets in self.users.values()]
+        return [
+            ticket
+            for round_tickets in itertools.zip_longest(*queues)
+            for ticket in round_tickets
+            if ticket is not None
+        ]
+
+
+class GenerationScheduler:
+    """Admission control between chat consumers and the LLM server.
+
+    Each model runs at most GENERATION_MODEL_CONCURRENCY (or
+    GENERATION_CONCURRENCY) generations at once in this process. Waiting
+    requests are admitted round-robin across users, so one user with many
+    queued messages cannot starve the others. When GENERATION_MAX_QUEUE
+    requests are already waiting, or a user already has
+    GENERATION_MAX_QUEUED_PER_USER waiting, new requests are rejected
+    immediately instead of slowing everyone down.
+    """
+
+    def __init__(self, concurrency=None, model_concurrency=None, max_queue=None,
+                 max_queued_per_user=None, queue_timeout=None):
+        self.concurrency = concurrency or getattr(settings, "GENERATION_CONCURRENCY", 2)
+        self.model_concurrency = (
+            model_concurrency if model_concurrency is not None
+            else getattr(settings, "GENERATION_MODEL_CONCURRENCY", {})
+        )
+        self.max_queue = max_queue if max_queue is not None else getattr(settings, "GENERATION_MAX_QUEUE", 20)
+        self.max_queued_per_user = (
+            max_queued_per_user if max_queued_per_user is not None
+            else getattr(settings, "GENERATION_MAX_QUEUED_PER_USER", 3)
+        )
+        self.queue_timeout = (
+            queue_timeout if queue_timeout is not None
+            else getattr(settings, "GENERATION_QUEUE_TIMEOUT", 120.0)
+        )
+        self._queues = {}
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._waited = 0
+        self._wait_time = 0.0
+
+    def _queue(self, model):
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = _ModelQueue(self.model_concurrency.get(model, self.concurrency))
+            self._queues[model] = queue
+        return queue
+
+    def enqueue(self, model, user_id):
+        """Reserve a place for a generation; raises GenerationRejected when the queue is full.
+
+        Runs without awaiting, so a busy server answers the client at once.
+        """
+        queue = self._queue(model)
+        ticket = GenerationTicket(model, user_id)
+        if queue.running < queue.limit and not queue.users:
+            ticket.admitted = True
+            queue.running += 1
+            self._admitted += 1
+            return ticket
+
+        if queue.size >= self.max_queue:
+            self._rejected += 1
+            raise GenerationRejected("The server is busy, please try again in a moment.")
+        if len(queue.users.get(user_id, ())) >= self.max_queued_per_user:
+            self._rejected += 1
+            raise GenerationRejected("Please wait for your previous messages to be answered.")
+
+        ticket.queued = True
+        queue.users.setdefault(user_id, deque()).append(ticket)
+        queue.size += 1
+        self._queued += 1
+        self._update_positions(queue)
+        return ticket
+
+    async def wait(self, ticket, on_position=None):
+        """Wait until `ticket` may generate, reporting each new queue position to `on_position`."""
+        deadline = ticket.enqueued_at + self.queue_timeout if self.queue_timeout else None
+        reported = 0
+        try:
+            while not ticket.admitted:
+                if on_position is not None and ticket.position != reported:
+                    reported = ticket.position
+                    await on_position(ticket.position)
+                    continue
+                ticket.changed.clear()
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                await asyncio.wait_for(ticket.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            self.release(ticket)
+            raise GenerationRejected("The server is busy, please try again in a moment.")
+        except BaseException:
+            # Koneksi ditutup atau task dibatalkan saat masih antre
+            self.release(ticket)
+            raise
+        if ticket.queued:
+            self._waited += 1
+            self._wait_time += time.monotonic() - ticket.enqueued_at
+
+    def release(self, ticket):
+        """Give the slot of `ticket` back (or leave the queue); safe to call more than once."""
+        if ticket.released:
+            return
+        ticket.released = True
+        queue = self._queue(ticket.model)
+        if ticket.admitted:
+            queue.running -= 1
+        else:
+            tickets = queue.users.get(ticket.user_id)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                queue.size -= 1
+                if not tickets:
+                    del queue.users[ticket.user_id]
+        self._dispatch(queue)
+
+    def _dispatch(self, queue):
+        while queue.running < queue.limit and queue.users:
+            user_id, tickets = next(iter(queue.users.items()))
+            ticket = tickets.popleft()
+            queue.size -= 1
+            if tickets:
+                # Pengguna ini kembali ke belakang antrean giliran
+                queue.users.move_to_end(user_id)
+            else:
+                del queue.users[user_id]
+            ticket.admitted = True
+            ticket.position = 0
+            queue.running += 1
+            self._admitted += 1
+            ticket.changed.set()
+        self._update_positions(queue)
+
+    def _update_positions(self, queue):
+        for position, ticket in enumerate(queue.fair_order(), start=1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket.changed.set()
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": self._rejected,
+            "timeouts": self._timeouts,
+            "avg_queue_wait_seconds": self._wait_time / self._waited if self._waited else 0.0,
+            "models": {
+                model: {"limit": queue.limit, "running": queue.running, "waiting": queue.size}
+                for model, queue in self._queues.items()
+            },
+        }
+
+
+_scheduler = None
+
+
+def get_generation_scheduler() -> GenerationScheduler:
+    """Scheduler shared by all consumers of this process."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = GenerationScheduler()
+    return _scheduler
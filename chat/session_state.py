@@ -0,0 +1,52 @@
+# personaai/chat/session_state.py
+from django.db.models import Exists, OuterRef
+
+from chat.models import ChatSession, Message
+from documents.partitions import entitled_partitions
+
+
+class SessionState:
+    """The ChatSession fields a websocket connection needs, loaded once per connection.
+
+    The consumer writes every change through to the database and to this
+    object, so nothing in a chat turn has to read the session row again.
+    """
+
+    def __init__(self, id, selected_model, use_persona, has_messages,
+                 memory_summary="", memory_summarized_messages=0, partitions=None):
+        self.id = id
+        self.selected_model = selected_model
+        self.use_persona = use_persona
+        self.has_messages = has_messages
+        self.memory_summary = memory_summary
+        self.memory_summarized_messages = memory_summarized_messages
+        # Partisi dokumen yang boleh dicari sesi ini (pemilik, program studi, persona)
+        self.partitions = partitions
+
+    def as_session_info(self):
+        return {
+            'type': 'session_info',
+            'use_persona': self.use_persona,
+            'disable_toggle': self.has_messages,
+            'disable_model_select': self.has_messages,
+            'session_id': self.id,
+            'selected_model': self.selected_model,
+        }
+
+
+def load_session_state(session_id, user):
+    """Load the state of a user's session in one query, or None if it is not theirs."""
+    row = (
+        ChatSession.objects.filter(id=session_id, user=user)
+        .annotate(has_messages=Exists(Message.objects.filter(session=OuterRef('pk'))))
+        .values('id', 'selected_model', 'use_persona', 'has_messages',
+                'memory_summary', 'memory_summarized_messages',
+                'user_id', 'user__userprofile__study_program', 'user__userprofile__persona_id')
+        .first()
+    )
+    if row is None:
+        return None
+    row['partitions'] = entitled_partitions(
+        row.pop('user_id'), row.pop('user__userprofile__study_program'), row.pop('user__userprofile__persona_id'),
+    )
+    return SessionState(**row)
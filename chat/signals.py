@@ -0,0 +1,40 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from persona.models import Persona
+from accounts.models import UserProfile
+from documents.models import Document
+from chat.rag.prompt_cache import invalidate_persona, invalidate_user
+from chat.rag.response_cache import invalidate_documents
+
+
+@receiver([post_save, post_delete], sender=Persona)
+def invalidate_persona_prompts(sender, instance, **kwargs):
+    """
+    Signal to drop cached prompt templates that embed an edited or deleted persona.
+    """
+    invalidate_persona(instance.id)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_user_persona(sender, instance, **kwargs):
+    """
+    Signal to forget the cached persona of a user whose profile changed.
+    """
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Document)
+def invalidate_reindexed_responses(sender, instance, **kwargs):
+    """
+    Signal to drop cached answers built from a document that got a new file and will be re-indexed.
+    """
+    if getattr(instance, '_file_changed', False):
+        invalidate_documents([instance.id])
+
+
+@receiver(post_delete, sender=Document)
+def invalidate_deleted_responses(sender, instance, **kwargs):
+    """
+    Signal to drop cached answers built from a deleted document.
+    """
+    invalidate_documents([instance.id])
@@ -0,0 +1,83 @@
+# personaai/chat/streaming.py
+import asyncio
+
+from django.conf import settings
+
+
+class TokenCoalescer:
+    """Buffers streamed LLM tokens and emits them as larger frames.
+
+    A frame is flushed when the buffered text reaches `max_bytes` or when
+    `interval` seconds have passed since the first buffered token, whichever
+    comes first. With `interval <= 0` every token is emitted immediately.
+    """
+
+    def __init__(self, emit, interval=0.03, max_bytes=256):
+        self.emit = emit
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.tokens = 0
+        self.frames = 0
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_settings(cls, emit):
+        if not getattr(settings, "CHAT_STREAM_COALESCE", True):
+            return cls(emit, interval=0, max_bytes=0)
+        return cls(
+            emit,
+            interval=getattr(settings, "CHAT_STREAM_FLUSH_INTERVAL", 0.03),
+            max_bytes=getattr(settings, "CHAT_STREAM_FLUSH_BYTES", 256),
+        )
+
+    async def add(self, token):
+        if not token:
+            return
+        self.tokens += 1
+        self._buffer.append(token)
+        self._size += len(token.encode("utf-8"))
+        if self.interval <= 0 or self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_interval())
+
+    async def _flush_after_interval(self):
+        await asyncio.sleep(self.interval)
+        # Lepas referensi dulu agar flush() lain tidak membatalkan task yang sedang mengirim
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self._buffer:
+                return
+            text = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.frames += 1
+            await self.emit(text)
+
+    async def close(self):
+        """Emit whatever is still buffered."""
+        await self.flush()
+
+
+async def replay_text(text, emit, chunk_chars=None, interval=None):
+    """Stream an already known answer through `emit` in pieces, like a live generation.
+
+    Pieces of `chunk_chars` characters are sent every `interval` seconds
+    (RESPONSE_CACHE_REPLAY_CHUNK_CHARS / RESPONSE_CACHE_REPLAY_INTERVAL).
+    """
+    chunk_chars = chunk_chars or getattr(settings, "RESPONSE_CACHE_REPLAY_CHUNK_CHARS", 16)
+    if interval is None:
+        interval = getattr(settings, "RESPONSE_CACHE_REPLAY_INTERVAL", 0.02)
+    for start in range(0, len(text), chunk_chars):
+        await emit(text[start:start + chunk_chars])
+        if interval > 0:
+            await asyncio.sleep(interval)
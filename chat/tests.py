@@ -1,3 +1,605 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from langchain_core.documents import Document as LangChainDocument
+
+from accounts.models import UserProfile
+from documents.embedding_utils import get_vector_store_version, touch_vector_store_version
+from documents.models import IngestionJob
+from persona.models import Persona
+from . import routing
+from .consumers import ChatConsumer
+from .loadtest import run_load_test
+from .llm_configurations.registry import LLMClientRegistry
+from .llm_configurations.stub_server import StubOllamaServer
+from .models import ChatSession, Message, ResponseCacheEntry
+from .rag.assembler import fit_prompt
+from .rag import prompt_cache
+from .rag.memory import RollingSummaryMemory
+from .rag.benchmark import SyntheticCorpus, benchmark_environment, ingest_corpus, measure, sample_queries
+from .rag.response_cache import CacheProbe, ResponseCache, identifier_terms
+from .rag.retriever import DocumentRetriever, RetrieverPool
+from .rag.tokens import count_tokens, get_num_ctx
+from .metrics import MetricsRegistry
+from .scheduler import GenerationRejected, GenerationScheduler
+from .session_state import load_session_state
+from .streaming import TokenCoalescer
+
+
+@override_settings(EMBEDDING_BACKEND="hashing", EMBEDDING_CACHE_ENABLED=False,
+                   RESPONSE_CACHE_SEMANTIC=True, RESPONSE_CACHE_SEMANTIC_THRESHOLD=0.5)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.docs = [LangChainDocument(page_content="Pengumpulan tugas lewat portal.", metadata={"document_id": 1})]
+        self.cache.store(CacheProbe("gemma3:1b", None, "", self.docs, "how do I submit assignment 2"), "answer 2")
+
+    def lookup(self, query):
+        return self.cache.lookup(CacheProbe("gemma3:1b", None, "", self.docs, query))
+
+    def test_exact_and_semantic_hits(self):
+        self.assertEqual(self.lookup("How do I submit assignment 2?").kind, "exact")
+        hit = self.lookup("how do i submit my assignment 2")
+        self.assertEqual((hit.kind, hit.response), ("semantic", "answer 2"))
+
+    def test_semantic_hit_requires_same_numbers(self):
+        self.assertIsNone(self.lookup("how do I submit assignment 3"))
+
+    def test_expired_entry_is_replaced_on_store(self):
+        ResponseCacheEntry.objects.update(created_at=timezone.now() - timedelta(days=30))
+        with override_settings(RESPONSE_CACHE_TTL=3600):
+            self.assertIsNone(self.lookup("how do I submit assignment 2"))
+            self.cache.store(CacheProbe("gemma3:1b", None, "", self.docs, "how do I submit assignment 2"), "new answer")
+            self.assertEqual(self.lookup("how do I submit assignment 2").response, "new answer")
+        self.assertEqual(ResponseCacheEntry.objects.count(), 1)
+
+    def test_identifier_terms(self):
+        self.assertEqual(identifier_terms("Tugas 2 untuk IF-2203 dan data_frame"), {"2", "if2203", "dataframe"})
+
+
+class AsyncRetrievalTests(SimpleTestCase):
+    def retrieve(self, search):
+        with benchmark_environment(database=False, VECTOR_BACKEND="mmap", RETRIEVAL_TIMEOUT=0.1):
+            retriever = DocumentRetriever(n_results=2)
+            with mock.patch.object(DocumentRetriever, "_get_relevant_documents", side_effect=search), \
+                    mock.patch("chat.rag.retriever.close_old_connections") as close:
+                return asyncio.run(retriever.aget_relevant_documents("jadwal ujian")), close
+
+    def test_slow_search_times_out_with_no_documents(self):
+        with self.assertLogs("chat.rag.retriever", level="WARNING") as logs:
+            docs, _ = self.retrieve(lambda *args, **kwargs: time.sleep(0.5) or ["late"])
+        self.assertEqual(docs, [])
+        self.assertIn("Retrieval timed out after 0.1s", logs.output[0])
+
+    def test_executor_thread_closes_old_connections(self):
+        docs, close = self.retrieve(lambda *args, **kwargs: ["chunk"])
+        self.assertEqual(docs, ["chunk"])
+        self.assertEqual(close.call_count, 2)
+
+
+class RetrieverPoolTests(SimpleTestCase):
+    def test_warm_retriever_is_reused_until_another_process_writes(self):
+        with benchmark_environment(database=False, VECTOR_BACKEND="mmap") as workdir:
+            pool = RetrieverPool(refresh_interval=0)
+            first = pool.get(2)
+            self.assertIs(pool.get(2), first)
+
+            # Tulisan dari proses ini sudah terlihat oleh handle yang sama
+            touch_vector_store_version()
+            self.assertIs(pool.get(2), first)
+
+            # Marker dengan stempel lain berarti proses lain menulis ke vector store
+            stamp = get_vector_store_version() + 10 ** 9
+            os.utime(os.path.join(workdir, "vectors", ".version"), ns=(stamp, stamp))
+            refreshed = pool.get(2)
+            self.assertIsNot(refreshed, first)
+            self.assertEqual(pool.stats()["refreshes"], 1)
+            self.assertEqual((pool.stats()["hits"], pool.stats()["misses"]), (2, 2))
+
+
+class RetrievalBenchmarkTests(TransactionTestCase):
+    """Recall and latency of the full retrieval pipeline on a ~1k-chunk synthetic corpus, offline."""
+
+    size = 1000
+    queries = 100
+
+    def run_backend(self, backend):
+        with benchmark_environment(database=False, VECTOR_BACKEND=backend, EMBEDDING_DIMENSIONS=256,
+                                   HYBRID_RETRIEVAL_ENABLED=True, RERANK_ENABLED=True):
+            owner = User.objects.create_user(f"benchmark-{backend}")
+            ingest_corpus(SyntheticCorpus(seed=0), owner, self.size)
+            self.assertFalse(IngestionJob.objects.filter(state=IngestionJob.State.FAILED).exists())
+            retriever = DocumentRetriever(n_results=4)
+            batch = sample_queries(self.queries, np.random.default_rng(0))
+            for query in batch[:5]:
+                retriever.invoke(query)
+            return measure(retriever, batch, concurrency=4)
+
+    def assert_result(self, result):
+        self.assertGreaterEqual(result["recall_at_k"], 0.95)
+        # Batas longgar agar tidak rapuh di mesin CI yang lambat; nilai biasanya di bawah 20ms
+        self.assertLess(result["p50_ms"], 100)
+        self.assertLess(result["p95_ms"], 250)
+        # Rerank memakai vektor tersimpan, jadi hampir tidak ada yang di-embed ulang
+        self.assertLess(result["stages_mean_ms"]["rerank_embed"], result["p50_ms"] / 2)
+
+    def test_chroma_backend(self):
+        self.assert_result(self.run_backend("chroma"))
+
+    def test_mmap_backend(self):
+        self.assert_result(self.run_backend("mmap"))
+
+
+class GenerationSchedulerTests(SimpleTestCase):
+    def scheduler(self, **kwargs):
+        options = {"concurrency": 1, "max_queue": 10, "max_queued_per_user": 3, "queue_timeout": 5.0}
+        options.update(kwargs)
+        return GenerationScheduler(**options)
+
+    def test_waiting_users_are_admitted_round_robin(self):
+        scheduler = self.scheduler()
+        running = scheduler.enqueue("m", user_id=1)
+        self.assertTrue(running.admitted)
+        heavy = [scheduler.enqueue("m", user_id=1) for _ in range(3)]
+        light = scheduler.enqueue("m", user_id=2)
+        # Pengguna 2 mendapat giliran kedua meskipun pengguna 1 lebih dulu mengantre tiga kali
+        self.assertEqual([ticket.position for ticket in heavy + [light]], [1, 3, 4, 2])
+
+        order = []
+        ticket = running
+        for _ in range(4):
+            scheduler.release(ticket)
+            ticket = next(t for t in heavy + [light] if t.admitted and not t.released)
+            order.append(ticket.user_id)
+        self.assertEqual(order, [1, 2, 1, 1])
+
+    def test_full_queues_reject_immediately(self):
+        scheduler = self.scheduler(max_queue=3, max_queued_per_user=2)
+        scheduler.enqueue("m", user_id=1)
+        scheduler.enqueue("m", user_id=1)
+        scheduler.enqueue("m", user_id=1)
+        with self.assertRaises(GenerationRejected):
+            scheduler.enqueue("m", user_id=1)
+        scheduler.enqueue("m", user_id=2)
+        with self.assertRaises(GenerationRejected):
+            scheduler.enqueue("m", user_id=3)
+        self.assertEqual(scheduler.stats()["rejected"], 2)
+        # Model lain punya antrean sendiri
+        self.assertTrue(scheduler.enqueue("other", user_id=3).admitted)
+
+    def test_wait_times_out_and_leaves_the_queue(self):
+        scheduler = self.scheduler(queue_timeout=0.05)
+        scheduler.enqueue("m", user_id=1)
+        ticket = scheduler.enqueue("m", user_id=2)
+        with self.assertRaises(GenerationRejected):
+            asyncio.run(scheduler.wait(ticket))
+        stats = scheduler.stats()
+        self.assertEqual((stats["timeouts"], stats["models"]["m"]["waiting"]), (1, 0))
+
+    def test_wait_reports_positions_until_admitted(self):
+        scheduler = self.scheduler()
+
+        async def run():
+            running = scheduler.enqueue("m", user_id=1)
+            first = scheduler.enqueue("m", user_id=2)
+            second = scheduler.enqueue("m", user_id=3)
+            positions = []
+
+            async def on_position(position):
+                positions.append(position)
+
+            waiter = asyncio.create_task(scheduler.wait(second, on_position))
+            await asyncio.sleep(0.01)
+            scheduler.release(running)
+            await asyncio.sleep(0.01)
+            scheduler.release(first)
+            await waiter
+            return positions
+
+        self.assertEqual(asyncio.run(run()), [2, 1])
+
+
+class TokenCoalescerTests(SimpleTestCase):
+    def stream(self, tokens, pause=0.0, **kwargs):
+        frames = []
+
+        async def emit(text):
+            frames.append(text)
+
+        async def run():
+            coalescer = TokenCoalescer(emit, **kwargs)
+            for token in tokens:
+                await coalescer.add(token)
+                if pause:
+                    await asyncio.sleep(pause)
+            await coalescer.close()
+            return coalescer
+
+        coalescer = asyncio.run(run())
+        self.assertEqual("".join(frames), "".join(tokens))
+        self.assertEqual(coalescer.frames, len(frames))
+        return frames
+
+    def test_fast_tokens_are_merged_into_one_frame(self):
+        self.assertEqual(self.stream(["a", "b", "c"], interval=1.0, max_bytes=256), ["abc"])
+
+    def test_frame_is_flushed_at_max_bytes(self):
+        self.assertEqual(self.stream(["ab", "cd", "e"], interval=1.0, max_bytes=4), ["abcd", "e"])
+
+    def test_slow_tokens_are_flushed_after_the_interval(self):
+        self.assertEqual(self.stream(["a", "b"], pause=0.05, interval=0.01), ["a", "b"])
+
+    def test_zero_interval_sends_every_token(self):
+        self.assertEqual(self.stream(["a", "", "b"], interval=0), ["a", "b"])
+
+
+@override_settings(LLM_CONTEXT_WINDOWS={"tiny": 2048}, LLM_RESPONSE_TOKENS=512, TOKEN_COUNTER="estimate",
+                   PROMPT_CONTEXT_SHARE=0.6, PROMPT_PERSONA_SHARE=0.2)
+class FitPromptTests(SimpleTestCase):
+    def docs(self, count, tokens=400):
+        return [LangChainDocument(page_content=f"chunk {i}", metadata={"document_id": i, "token_count": tokens})
+                for i in range(count)]
+
+    def turns(self, count, tokens=300):
+        return [([f"question {i}", f"answer {i}"], tokens) for i in range(count)]
+
+    def test_lowest_ranked_chunks_and_oldest_turns_are_dropped(self):
+        fitted = fit_prompt("tiny", "apa itu graf?", self.docs(4), self.turns(3))
+        self.assertEqual([doc.metadata["document_id"] for doc in fitted.docs], [0, 1])
+        self.assertEqual(fitted.history, ["question 1", "answer 1", "question 2", "answer 2"])
+        self.assertEqual((fitted.stats["budget"], fitted.stats["dropped_docs"], fitted.stats["dropped_turns"]),
+                         (1536, 2, 1))
+        used = sum(fitted.stats[key] for key in ("query_tokens", "persona_tokens", "context_tokens", "history_tokens"))
+        self.assertLessEqual(used, fitted.stats["budget"])
+
+    def test_room_left_by_history_goes_back_to_chunks(self):
+        fitted = fit_prompt("tiny", "apa itu graf?", self.docs(4), [])
+        self.assertEqual([doc.metadata["document_id"] for doc in fitted.docs], [0, 1, 2])
+
+    def test_num_ctx_follows_the_fitted_prompt(self):
+        fitted = fit_prompt("tiny", "apa itu graf?", self.docs(1), [], overhead=100)
+        self.assertEqual(fitted.stats["prompt_tokens"], 100 + fitted.stats["query_tokens"] + 400)
+        self.assertEqual(get_num_ctx("tiny", fitted.stats["prompt_tokens"]), 2048)
+        with override_settings(LLM_CONTEXT_WINDOWS={"big": 32768}):
+            self.assertEqual(get_num_ctx("big", 300), 2048)
+            self.assertEqual(get_num_ctx("big", 3000), 4096)
+            self.assertEqual(get_num_ctx("big", 100000), 32768)
+        with override_settings(LLM_NUM_CTX={"tiny": 1024}):
+            self.assertEqual(get_num_ctx("tiny", 1500), 1024)
+
+    def test_long_query_and_persona_are_truncated(self):
+        fitted = fit_prompt("tiny", "kata " * 5000, [], [], persona="persona " * 5000)
+        self.assertLessEqual(fitted.stats["query_tokens"], 1536 // 2)
+        self.assertLessEqual(fitted.stats["persona_tokens"], int(1536 * 0.2))
+
+
+class PromptTemplateCacheTests(TransactionTestCase):
+    def setUp(self):
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+        self.persona = Persona.objects.create(name="Mentor", description="Ramah dan sabar.")
+        self.user = User.objects.create_user("mahasiswa")
+        self.profile = UserProfile.objects.create(user=self.user, persona=self.persona, nim="13520001")
+
+    def test_template_is_compiled_once_per_persona_text(self):
+        entry = prompt_cache.get_prompt_template(self.persona.id, "Ramah dan sabar.", True, "gemma3:1b")
+        self.assertIs(prompt_cache.get_prompt_template(self.persona.id, "Ramah dan sabar.", True, "gemma3:1b"), entry)
+        self.assertIn("Ramah dan sabar.", entry.template.format_messages(query="q", context="c", history=[])[0].content)
+        self.assertIsNot(prompt_cache.get_prompt_template(self.persona.id, "Tegas.", True, "gemma3:1b"), entry)
+
+    def test_persona_and_profile_edits_invalidate_the_cache(self):
+        prompt_cache.get_prompt_template(self.persona.id, self.persona.description, True, "gemma3:1b")
+        self.assertEqual(asyncio.run(prompt_cache.aget_user_persona(self.user)), (self.persona.id, "Ramah dan sabar."))
+
+        self.persona.description = "Tegas dan ringkas."
+        self.persona.save()
+        self.assertNotIn((self.persona.id, True, "gemma3:1b"), prompt_cache._templates)
+        self.assertEqual(asyncio.run(prompt_cache.aget_user_persona(self.user)), (self.persona.id, "Tegas dan ringkas."))
+        entry = prompt_cache.get_prompt_template(self.persona.id, self.persona.description, True, "gemma3:1b")
+        self.assertIn("Tegas dan ringkas.", entry.template.format_messages(query="q", context="c", history=[])[0].content)
+
+        self.profile.persona = None
+        self.profile.save()
+        self.assertEqual(asyncio.run(prompt_cache.aget_user_persona(self.user)), (None, None))
+
+
+@override_settings(TOKEN_COUNTER="estimate")
+class RollingSummaryMemoryTests(SimpleTestCase):
+    def test_old_turns_are_folded_into_the_summary(self):
+        memory = RollingSummaryMemory(max_turns=2, max_tokens=10000, summary_max_tokens=1000)
+        for i in range(4):
+            memory.add_turn(f"Question {i}. More detail.", f"Answer {i}. More detail.")
+        self.assertEqual([turn[0] for turn in memory.turns], ["Question 2. More detail.", "Question 3. More detail."])
+        self.assertEqual(memory.summary_lines, [
+            "- User: Question 0. | Assistant: Answer 0.",
+            "- User: Question 1. | Assistant: Answer 1.",
+        ])
+        self.assertEqual(memory.summarized_messages, 4)
+        self.assertTrue(memory.dirty)
+        history = memory.load_memory_variables()["history"]
+        self.assertEqual(len(history), 1 + 2 * 2)
+        self.assertIn("Question 1.", history[0].content)
+
+    def test_token_budget_keeps_at_least_the_newest_turn(self):
+        memory = RollingSummaryMemory(max_turns=10, max_tokens=50, summary_max_tokens=1000)
+        memory.add_turn("short", "short")
+        memory.add_turn("long " * 100, "long " * 100)
+        self.assertEqual(len(memory.turns), 1)
+        self.assertEqual(memory.summarized_messages, 2)
+
+    def test_summary_is_capped(self):
+        memory = RollingSummaryMemory(max_turns=1, max_tokens=10000, summary_max_tokens=20)
+        for i in range(10):
+            memory.add_turn(f"Question number {i}.", f"Answer number {i}.")
+        self.assertLessEqual(count_tokens(memory.summary), 20)
+        self.assertIn("Question number 8.", memory.summary)
+        self.assertNotIn("Question number 0.", memory.summary)
+
+    def test_unpaired_messages_count_towards_the_next_turn(self):
+        memory = RollingSummaryMemory(max_turns=1, max_tokens=10000, summary_max_tokens=1000)
+        memory.add_turn("first", "answer")
+        # Pertanyaan yang dibatalkan sebelum ada jawaban: hanya baris pengguna yang tersimpan
+        memory.add_unpaired()
+        memory.add_turn("second", "answer")
+        memory.add_turn("third", "answer")
+        # Baris: first, answer, (dibatalkan), second, answer
+        self.assertEqual(memory.summarized_messages, 5)
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_ALLOWED_IPS=["127.0.0.1"])
+class MetricsViewTests(TestCase):
+    def scrape(self, **headers):
+        return self.client.get("/metrics/", **headers)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        response = self.scrape(HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn("# TYPE personaai_chat_turns_total counter", body)
+        self.assertIn("personaai_scheduler_admitted", body)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=False)
+    def test_loopback_without_token_is_refused_outside_debug(self):
+        # Di balik reverse proxy lokal setiap request datang dari 127.0.0.1
+        self.assertEqual(self.scrape(REMOTE_ADDR="127.0.0.1").status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=True)
+    def test_allowed_addresses_may_scrape_under_debug(self):
+        self.assertEqual(self.scrape(REMOTE_ADDR="127.0.0.1").status_code, 200)
+        self.assertEqual(self.scrape(REMOTE_ADDR="10.0.0.5").status_code, 403)
+
+    @override_settings(METRICS_ENABLED=False, METRICS_TOKEN="secret")
+    def test_disabled_endpoint_is_not_found(self):
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer secret").status_code, 404)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def test_render_histogram_counter_and_collectors(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_seconds", "Test durations.", ["stage"], buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage="a")
+        histogram.observe(0.5, stage="a")
+        registry.counter("test_total", "Test events.", ["outcome"]).inc(outcome='say "hi"')
+        registry.register_collector("pool", lambda: {"hits": 3, "models": {"gemma3:1b": {"running": np.int64(2)}}})
+
+        def broken():
+            raise RuntimeError("collector down")
+
+        registry.register_collector("broken", broken)
+        with self.assertLogs("chat.metrics", level="WARNING"):
+            lines = registry.render().splitlines()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count{stage="a"} 2', lines)
+        self.assertIn('test_total{outcome="say \\"hi\\""} 1.0', lines)
+        self.assertIn("personaai_pool_hits 3.0", lines)
+        self.assertIn('personaai_pool_running{model="gemma3:1b"} 2.0', lines)
+        self.assertFalse(any(line.startswith("personaai_broken") for line in lines))
+
+    def test_registering_twice_returns_the_same_metric(self):
+        registry = MetricsRegistry()
+        self.assertIs(registry.counter("c_total", "C."), registry.counter("c_total", "C."))
+
+
+class SessionStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("pemilik")
+        UserProfile.objects.create(user=self.user, nim="13520002", study_program="Informatika")
+        self.session = ChatSession.objects.create(user=self.user, use_persona=True, memory_summary="ringkasan")
+
+    def test_state_is_loaded_in_one_query(self):
+        with self.assertNumQueries(1):
+            state = load_session_state(self.session.id, self.user)
+        self.assertEqual((state.id, state.selected_model, state.use_persona, state.has_messages, state.memory_summary),
+                         (self.session.id, "gemma3:1b", True, False, "ringkasan"))
+        self.assertIn("owner-%d.course-informatika" % self.user.id, state.partitions)
+        self.assertIn("shared", state.partitions)
+
+        Message.objects.create(session=self.session, role=Message.Role.USER, content="halo")
+        self.assertTrue(load_session_state(self.session.id, self.user).has_messages)
+
+    def test_other_users_session_is_not_loaded(self):
+        self.assertIsNone(load_session_state(self.session.id, User.objects.create_user("orang lain")))
+        self.assertIsNone(load_session_state(self.session.id + 1, self.user))
+
+
+class DirectSendTests(SimpleTestCase):
+    def consumer(self):
+        consumer = ChatConsumer()
+        consumer.channel_name = "me"
+        consumer.room_group_name = "chat_1"
+        consumer.peers = set()
+        consumer.channel_layer = mock.AsyncMock()
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    def test_single_listener_is_sent_to_directly(self):
+        consumer = self.consumer()
+        asyncio.run(consumer.broadcast({"type": "assistant_response_chunk", "message": "hai"}))
+        consumer.channel_layer.group_send.assert_not_called()
+        consumer.send.assert_awaited_once_with(text_data=json.dumps({"type": "assistant_response_chunk", "message": "hai"}))
+
+    def test_group_is_used_while_another_tab_listens(self):
+        consumer = self.consumer()
+
+        async def run():
+            await consumer.session_presence({"action": "join", "channel": "other"})
+            await consumer.broadcast({"type": "assistant_response_end"})
+            await consumer.session_presence({"action": "leave", "channel": "other"})
+            await consumer.broadcast({"type": "assistant_response_end"})
+
+        asyncio.run(run())
+        consumer.channel_layer.send.assert_awaited_once_with(
+            "other", {"type": "session_presence", "action": "here", "channel": "me"}
+        )
+        consumer.channel_layer.group_send.assert_awaited_once_with("chat_1", {"type": "assistant_response_end"})
+        consumer.send.assert_awaited_once_with(text_data=json.dumps({"type": "assistant_response_end"}))
+
+
+class LLMClientRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.server = StubOllamaServer(tokens=3).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        overrides = override_settings(OLLAMA_BASE_URL=self.server.url, OLLAMA_KEEP_ALIVE=None)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.registry = LLMClientRegistry(max_clients=2, health_check_interval=0)
+
+    def test_clients_are_reused_and_the_least_recent_is_evicted(self):
+        async def run():
+            first = await self.registry.aget("ollama", "gemma3:1b")
+            self.assertIs(await self.registry.aget("ollama", "gemma3:1b"), first)
+            await self.registry.aget("ollama", "qwen2.5-coder:0.5b")
+            await self.registry.aget("ollama", "gemma3:1b")
+            await self.registry.aget("ollama", "deepseek-r1:1.5b")
+            return [client["model"] for client in self.registry.stats()["clients"]]
+
+        self.assertEqual(asyncio.run(run()), ["gemma3:1b", "deepseek-r1:1.5b"])
+        stats = self.registry.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (2, 3, 1))
+
+    def test_client_is_rebuilt_for_another_event_loop(self):
+        first = asyncio.run(self.registry.aget("ollama", "gemma3:1b"))
+        self.assertIsNot(asyncio.run(self.registry.aget("ollama", "gemma3:1b")), first)
+        self.assertEqual(self.registry.stats()["rebuilds"], 1)
+
+    def test_turns_share_one_keep_alive_connection(self):
+        async def run():
+            for _ in range(3):
+                llm = await self.registry.aget("ollama", "gemma3:1b")
+                async for _chunk in llm.astream("halo"):
+                    pass
+            await self.registry.aclose()
+
+        asyncio.run(run())
+        stats = self.registry.stats()
+        self.assertEqual((stats["requests"], stats["connections_opened"]), (3, 1))
+        self.assertEqual(self.server.connections, 1)
+
+
+class _AuthenticatedApp:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        return await self.app(dict(scope, user=self.user), receive, send)
+
+
+class _Retriever:
+    async def ainvoke(self, query, **kwargs):
+        return []
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                   RESPONSE_CACHE_ENABLED=False, TOKEN_COUNTER="estimate")
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("consumer")
+        self.session = ChatSession.objects.create(user=self.user)
+        patcher = mock.patch("chat.consumers.aget_retriever", mock.AsyncMock(return_value=_Retriever()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def converse(self, generate, stop=False):
+        """Send one message with `generate` as the model; returns the event types the client received."""
+        async def run():
+            app = _AuthenticatedApp(URLRouter(routing.websocket_urlpatterns), self.user)
+            communicator = WebsocketCommunicator(app, f"/ws/chat/{self.session.id}/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_from()
+            await communicator.send_to(text_data=json.dumps({"message": "kapan ujian?"}))
+            if stop:
+                await asyncio.sleep(0.1)
+                await communicator.send_to(text_data=json.dumps({"type": "stop"}))
+            events = []
+            while not events or events[-1]["type"] != "assistant_response_end":
+                events.append(json.loads(await communicator.receive_from(timeout=5)))
+            while not await communicator.receive_nothing(timeout=0.2):
+                events.append(json.loads(await communicator.receive_from()))
+            await communicator.disconnect()
+            return events
+
+        with mock.patch("chat.consumers.generate_streaming_response", side_effect=generate):
+            return asyncio.run(run())
+
+    def assistant_messages(self):
+        return list(Message.objects.filter(session=self.session, role=Message.Role.ASSISTANT)
+                    .values_list("content", "truncated"))
+
+    def test_stop_saves_the_partial_answer_as_truncated(self):
+        async def generate(query, docs, memory, token_callback, state, user):
+            for token in ("Ujian ", "dimulai "):
+                await token_callback(token)
+            await asyncio.Event().wait()
+
+        self.converse(generate, stop=True)
+        self.assertEqual(self.assistant_messages(), [("Ujian dimulai ", True)])
+
+    def test_stop_before_any_token_keeps_memory_aligned(self):
+        async def generate(query, docs, memory, token_callback, state, user):
+            await asyncio.Event().wait()
+
+        with mock.patch.object(RollingSummaryMemory, "add_unpaired", autospec=True) as add_unpaired:
+            self.converse(generate, stop=True)
+        self.assertEqual(self.assistant_messages(), [])
+        add_unpaired.assert_called_once()
+
+    def test_failure_after_a_finished_answer_is_only_logged(self):
+        async def generate(query, docs, memory, token_callback, state, user):
+            await token_callback("Senin pagi")
+            memory.save_context({"input": query}, {"output": "Senin pagi"})
+            return "Senin pagi"
+
+        with mock.patch.object(ChatConsumer, "save_memory_summary", side_effect=RuntimeError("db gone")), \
+                self.assertLogs("chat.consumers", level="ERROR"):
+            events = self.converse(generate)
+        self.assertEqual([event["type"] for event in events].count("assistant_response_end"), 1)
+        self.assertNotIn("An error occurred", "".join(event.get("message", "") for event in events))
+        self.assertEqual(self.assistant_messages(), [("Senin pagi", False)])
+
+
+class LoadTestHarnessTests(TransactionTestCase):
+    def test_every_turn_streams_through_the_asgi_stack(self):
+        result = run_load_test(clients=2, turns=2, tokens=8, token_rate=0, think_time=0, chunks=20,
+                               timeout=10.0, database=False)
+        self.assertEqual((result["turns"], result["errors"], result["stub_requests"]), (4, 0, 4))
+        self.assertEqual(result["ttft_ms"]["count"], 4)
+        self.assertGreater(result["frames_per_turn"], 0)
+        # Query per giliran tetap kecil karena state sesi dimuat sekali per koneksi
+        self.assertLess(result["db_queries_per_turn"], 10)
@@ -3,10 +3,13 @@ from django.contrib.auth.decorators import login_required
 from .models import ChatSession, Message
 import uuid
 import json
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from .models import ChatSession
+from .metrics import get_metrics_registry
 
 # Create your views here.
 @login_required
@@ -39,3 +42,26 @@ def chat_detail(request, session_id):
         'chat_sessions': chat_sessions
     })
     
+
+
+def prometheus_metrics(request):
+    """Metrics of the chat pipeline and its caches, pools and indexes in the Prometheus text format.
+
+    Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`.
+    Without a token the endpoint is closed, except under DEBUG where
+    METRICS_ALLOWED_IPS may scrape: behind a reverse proxy on the same host
+    every request comes from 127.0.0.1, so an address check is not enough
+    in production.
+    """
+    if not getattr(settings, "METRICS_ENABLED", True):
+        raise Http404
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        allowed = constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+    elif settings.DEBUG:
+        allowed = request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", [])
+    else:
+        allowed = False
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(get_metrics_registry().render(), content_type="text/plain; version=0.0.4; charset=utf-8")
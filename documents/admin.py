@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DocumentChunk, Document
+from .models import DocumentChunk, Document, IngestionJob
 
 # Register your models here.
 admin.site.register(Document)
@@ -18,3 +18,18 @@ class DocumentChunkAdmin(admin.ModelAdmin):
         return obj.embedding_id
 
 admin.site.register(DocumentChunk, DocumentChunkAdmin)
+
+
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['document', 'state', 'chunks_done', 'chunks_total', 'attempts', 'next_attempt_at', 'worker']
+    list_filter = ['state']
+    readonly_fields = ['last_error', 'started_at', 'finished_at', 'created_at', 'updated_at']
+    actions = ['requeue']
+
+    @admin.action(description='Queue selected documents again')
+    def requeue(self, request, queryset):
+        from .jobs import enqueue_document
+        for job in queryset.select_related('document'):
+            enqueue_document(job.document)
+
+admin.site.register(IngestionJob, IngestionJobAdmin)
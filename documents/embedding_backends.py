@@ -0,0 +1,119 @@
+# personaai/documents/embedding_backends.py
+import re
+import zlib
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+@lru_cache(maxsize=200000)
+def _hash_feature(feature):
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbeddings(Embeddings):
+    """Offline CPU embeddings built from signed feature hashing.
+
+    Word unigrams, word bigrams and character trigrams are hashed into a fixed
+    number of buckets, weighted with sublinear term frequency and
+    L2-normalised. Texts are encoded in batches into one NumPy matrix, so
+    the result is deterministic and needs no network or model download.
+    """
+
+    def __init__(self, dimensions=768, batch_size=256):
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+
+    @property
+    def model_name(self):
+        return f"hashing-{self.dimensions}"
+
+    def _features(self, text):
+        words = _TOKEN_RE.findall(text.lower())
+        features = list(words)
+        features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def _encode_batch(self, texts):
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            rows.extend([row] * len(features))
+            hashes.extend(_hash_feature(feature) for feature in features)
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        if hashes:
+            hashes = np.asarray(hashes, dtype=np.uint32)
+            columns = (hashes % self.dimensions).astype(np.intp)
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix, (np.asarray(rows, dtype=np.intp), columns), signs)
+
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._encode_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode_batch([text])[0].tolist()
+
+
+def _build_openai(model):
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY, model=model)
+
+
+def _build_ollama(model):
+    from langchain_ollama import OllamaEmbeddings
+    return OllamaEmbeddings(model=model)
+
+
+def _build_hashing(model):
+    return HashingEmbeddings(
+        dimensions=getattr(settings, "EMBEDDING_DIMENSIONS", 768),
+        batch_size=getattr(settings, "EMBEDDING_BATCH_SIZE", 256),
+    )
+
+
+# Backend embedding yang bisa dipilih lewat settings.EMBEDDING_BACKEND
+EMBEDDING_BACKENDS = {
+    "openai": {"factory": _build_openai, "default_model": "text-embedding-3-small", "cache": True},
+    "ollama": {"factory": _build_ollama, "default_model": "nomic-embed-text", "cache": True},
+    "hashing": {"factory": _build_hashing, "default_model": None, "cache": False},
+}
+
+
+def get_backend_config():
+    name = getattr(settings, "EMBEDDING_BACKEND", "openai")
+    try:
+        return name, EMBEDDING_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend: {name}")
+
+
+def get_embedding_model_name():
+    """Identifier of the configured embedding model, used for cache keys and collection names."""
+    name, config = get_backend_config()
+    if name == "hashing":
+        return f"hashing-{getattr(settings, 'EMBEDDING_DIMENSIONS', 768)}"
+    return getattr(settings, "EMBEDDING_MODEL", None) or config["default_model"]
+
+
+def build_embeddings():
+    """Instantiate the configured backend; returns (embeddings, model_name, cacheable)."""
+    _, config = get_backend_config()
+    model_name = get_embedding_model_name()
+    return config["factory"](model_name), model_name, config["cache"]
@@ -0,0 +1,214 @@
+# personaai/documents/embedding_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List
+
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different inputs share a cache entry."""
+    return " ".join(text.split()).casefold()
+
+
+def make_cache_key(model_name, text):
+    raw = f"{model_name}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _encode_vector(vector):
+    return array("f", vector).tobytes()
+
+
+def _decode_vector(blob):
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: an in-process LRU in front of a SQLite file shared by all workers."""
+
+    def __init__(self, path, memory_size=2048, max_entries=200000, ttl=30 * 24 * 3600):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, vector, created_at):
+        with self._lock:
+            self._memory[key] = (vector, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Return {key: vector} for every key that is cached and not expired."""
+        now = time.time()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None and now - entry[1] < self.ttl:
+                    self._memory.move_to_end(key)
+                    found[key] = entry[0]
+                    self.memory_hits += 1
+                else:
+                    if entry is not None:
+                        del self._memory[key]
+                    missing.append(key)
+
+        if missing:
+            try:
+                conn = self._connection()
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = conn.execute(
+                        f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({placeholders}) AND created_at > ?",
+                        (*batch, now - self.ttl),
+                    ).fetchall()
+                    for key, blob, created_at in rows:
+                        vector = _decode_vector(blob)
+                        found[key] = vector
+                        self._remember(key, vector, created_at)
+            except sqlite3.Error as e:
+                logger.warning("Error reading embedding cache: %s", e)
+
+        with self._lock:
+            disk_hits = sum(1 for key in missing if key in found)
+            self.disk_hits += disk_hits
+            self.misses += len(missing) - disk_hits
+        return found
+
+    def set_many(self, items):
+        """Store (key, vector) pairs in both tiers."""
+        now = time.time()
+        for key, vector in items:
+            self._remember(key, vector, now)
+        try:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, _encode_vector(vector), now) for key, vector in items],
+            )
+            self._writes_since_prune += len(items)
+            if self._writes_since_prune >= 1000:
+                self._writes_since_prune = 0
+                self.prune()
+        except sqlite3.Error as e:
+            logger.warning("Error writing embedding cache: %s", e)
+
+    def prune(self):
+        """Drop expired rows, then the oldest rows beyond `max_entries`."""
+        conn = self._connection()
+        conn.execute("DELETE FROM embeddings WHERE created_at <= ?", (time.time() - self.ttl,))
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY created_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self._connection().execute("DELETE FROM embeddings")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the underlying model for texts it has not seen."""
+
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [make_cache_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed setiap teks yang belum ada di cache satu kali saja
+        pending = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        if pending:
+            vectors = self.embeddings.embed_documents(list(pending.values()))
+            new_items = list(zip(pending.keys(), vectors))
+            self.cache.set_many(new_items)
+            found.update(new_items)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = make_cache_key(self.model_name, text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.set_many([(key, vector)])
+        return vector
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Process-wide EmbeddingCache configured from settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    path=getattr(settings, "EMBEDDING_CACHE_PATH",
+                                 os.path.join(settings.BASE_DIR, "cache", "embeddings.sqlite3")),
+                    memory_size=getattr(settings, "EMBEDDING_CACHE_MEMORY_SIZE", 2048),
+                    max_entries=getattr(settings, "EMBEDDING_CACHE_MAX_ENTRIES", 200000),
+                    ttl=getattr(settings, "EMBEDDING_CACHE_TTL", 30 * 24 * 3600),
+                )
+    return _cache
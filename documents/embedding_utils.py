@@ -1,16 +1,91 @@
 # personaai/documents/embedding_utils.py
-from langchain_openai import OpenAIEmbeddings
+import hashlib
+import os
+import re
 from django.conf import settings
 import chromadb
+from .embedding_backends import build_embeddings, get_embedding_model_name
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+
+# Koleksi lama berisi vektor text-embedding-3-small dan tetap memakai nama aslinya
+BASE_COLLECTION_NAME = "personaai"
+LEGACY_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Versi vector store terakhir yang ditulis oleh proses ini
+_local_version = None
 
 
 def get_embedding_model():
-    """Returns a configured OpenAIEmbeddings instance."""
-    return OpenAIEmbeddings(
-        openai_api_key=settings.OPENAI_API_KEY,
-        model="text-embedding-3-small"
-    )
-     
-def get_chroma_collection():
+    """Returns the configured embedding backend, wrapped in the shared embedding cache."""
+    embeddings, model_name, cacheable = build_embeddings()
+    if not cacheable or not getattr(settings, "EMBEDDING_CACHE_ENABLED", True):
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name, get_embedding_cache())
+
+
+def get_collection_name(model_name=None, partition=None):
+    """Chroma collection for an embedding model and partition.
+
+    Vectors from different models never share a collection. The shared
+    partition keeps the plain per-model name, so existing collections stay
+    valid; every other partition gets its own collection next to it.
+    """
+    model_name = model_name or get_embedding_model_name()
+    if model_name == LEGACY_EMBEDDING_MODEL:
+        name = BASE_COLLECTION_NAME
+    else:
+        slug = re.sub(r"[^a-zA-Z0-9._-]+", "-", model_name).strip("-._")
+        name = f"{BASE_COLLECTION_NAME}__{slug}"[:512]
+    if not partition or partition == "shared":
+        return name
+    partitioned = f"{name}--{partition}"
+    if len(partitioned) > 63:
+        # Batas nama koleksi Chroma 63 karakter; nama panjang diganti hash yang stabil
+        partitioned = f"{BASE_COLLECTION_NAME}--{hashlib.sha256(partitioned.encode()).hexdigest()[:40]}"
+    return partitioned
+
+def get_chroma_collection(partition=None):
     chroma_client = chromadb.PersistentClient(path=settings.VECTOR_STORE_PATH)
-    return chroma_client.get_or_create_collection(name="personaai")
+    return chroma_client.get_or_create_collection(name=get_collection_name(partition=partition))
+
+
+def get_vector_collection(partition=None):
+    """Collection of the configured VECTOR_BACKEND: a Chroma collection or an MmapVectorIndex.
+
+    Both expose the get/upsert/update/delete calls used by the ingestion path.
+    """
+    backend = getattr(settings, "VECTOR_BACKEND", "chroma")
+    if backend == "chroma":
+        return get_chroma_collection(partition)
+    if backend == "mmap":
+        from .vector_index import get_vector_index
+        return get_vector_index(get_collection_name(partition=partition))
+    raise ValueError(f"Unknown vector backend: {backend}")
+
+
+def _version_marker_path():
+    return os.path.join(settings.VECTOR_STORE_PATH, ".version")
+
+
+def get_vector_store_version():
+    """Return the modification stamp of the vector store marker (0 if absent)."""
+    try:
+        return os.stat(_version_marker_path()).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def touch_vector_store_version():
+    """Mark the vector store as changed so warm readers in other processes reload."""
+    global _local_version
+    os.makedirs(settings.VECTOR_STORE_PATH, exist_ok=True)
+    with open(_version_marker_path(), "a"):
+        pass
+    os.utime(_version_marker_path())
+    _local_version = get_vector_store_version()
+    return _local_version
+
+
+def is_local_version(version):
+    """True if `version` was produced by a write from this process."""
+    return version == _local_version
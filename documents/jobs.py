@@ -0,0 +1,165 @@
+# personaai/documents/jobs.py
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Document, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = [IngestionJob.State.EXTRACTING, IngestionJob.State.EMBEDDING]
+
+
+def enqueue_document(document):
+    """Queue a document for (re)ingestion and return its job."""
+    job, created = IngestionJob.objects.get_or_create(document=document)
+    if not created:
+        IngestionJob.objects.filter(pk=job.pk).update(
+            state=IngestionJob.State.QUEUED,
+            attempts=0,
+            chunks_total=0,
+            chunks_done=0,
+            last_error='',
+            worker='',
+            next_attempt_at=timezone.now(),
+            started_at=None,
+            finished_at=None,
+        )
+        job.refresh_from_db()
+    return job
+
+
+def requeue_stale_jobs():
+    """Put back jobs whose worker stopped updating them (e.g. it was killed mid-document).
+
+    Running jobs refresh `updated_at` through their heartbeat, so only a
+    job without one for INGESTION_STALE_AFTER seconds counts as stale. The
+    attempt was already counted when the job was claimed; a job that has
+    used up INGESTION_MAX_ATTEMPTS (a document that keeps killing the
+    worker) is marked FAILED instead of being queued again.
+    """
+    stale_after = getattr(settings, "INGESTION_STALE_AFTER", 15 * 60)
+    max_attempts = getattr(settings, "INGESTION_MAX_ATTEMPTS", 3)
+    now = timezone.now()
+    stale = IngestionJob.objects.filter(state__in=ACTIVE_STATES, updated_at__lt=now - timedelta(seconds=stale_after))
+    error = f"Worker stopped responding for more than {stale_after} seconds"
+    stale.filter(attempts__gte=max_attempts).update(
+        state=IngestionJob.State.FAILED,
+        last_error=error,
+        worker='',
+        finished_at=now,
+        updated_at=now,
+    )
+    return stale.filter(attempts__lt=max_attempts).update(
+        state=IngestionJob.State.QUEUED,
+        last_error=error,
+        worker='',
+        next_attempt_at=now,
+        updated_at=now,
+    )
+
+
+def claim_next_job(worker_id, document=None):
+    """Atomically move the oldest due job to EXTRACTING for this worker; None if the queue is empty."""
+    candidates = IngestionJob.objects.filter(
+        state=IngestionJob.State.QUEUED,
+        next_attempt_at__lte=timezone.now(),
+    )
+    if document is not None:
+        candidates = candidates.filter(document=document)
+    candidates = candidates.values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        # UPDATE bersyarat: hanya satu worker yang berhasil mengklaim job ini
+        claimed = IngestionJob.objects.filter(pk=pk, state=IngestionJob.State.QUEUED).update(
+            state=IngestionJob.State.EXTRACTING,
+            worker=worker_id,
+            attempts=F('attempts') + 1,
+            started_at=timezone.now(),
+            finished_at=None,
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            return IngestionJob.objects.select_related('document').get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Process one claimed job, recording progress, retries and the final state."""
+    from .utils import process_document
+
+    interval = getattr(settings, "INGESTION_HEARTBEAT_INTERVAL", 30)
+    last_beat = time.monotonic()
+
+    def progress(state, done, total):
+        nonlocal last_beat
+        last_beat = time.monotonic()
+        IngestionJob.objects.filter(pk=job.pk).update(
+            state=state, chunks_done=done, chunks_total=total, updated_at=timezone.now()
+        )
+
+    def heartbeat():
+        # Dipanggil per halaman/slide; ditulis paling sering sekali per interval
+        nonlocal last_beat
+        if time.monotonic() - last_beat < interval:
+            return
+        last_beat = time.monotonic()
+        IngestionJob.objects.filter(pk=job.pk).update(updated_at=timezone.now())
+
+    try:
+        process_document(job.document, progress=progress, heartbeat=heartbeat)
+    except Exception as e:
+        job.refresh_from_db()
+        max_attempts = getattr(settings, "INGESTION_MAX_ATTEMPTS", 3)
+        error = f"{e}\n{traceback.format_exc()}"
+        if job.attempts < max_attempts:
+            backoff = getattr(settings, "INGESTION_RETRY_BACKOFF", 30) * (2 ** (job.attempts - 1))
+            IngestionJob.objects.filter(pk=job.pk).update(
+                state=IngestionJob.State.QUEUED,
+                last_error=error,
+                worker='',
+                next_attempt_at=timezone.now() + timedelta(seconds=backoff),
+            )
+        else:
+            IngestionJob.objects.filter(pk=job.pk).update(
+                state=IngestionJob.State.FAILED,
+                last_error=error,
+                finished_at=timezone.now(),
+            )
+        logger.exception("Error processing document %s (attempt %s): %s", job.document_id, job.attempts, e)
+        return False
+
+    IngestionJob.objects.filter(pk=job.pk).update(
+        state=IngestionJob.State.INDEXED,
+        last_error='',
+        finished_at=timezone.now(),
+    )
+    # update() tidak memicu post_save, jadi dokumen tidak di-enqueue ulang
+    Document.objects.filter(pk=job.document_id).update(processed=True)
+    return True
+
+
+def run_worker(worker_id=None, once=False, poll_interval=None):
+    """Drain the queue until it is empty (`once`) or forever, sleeping between polls."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = poll_interval if poll_interval is not None else getattr(settings, "INGESTION_POLL_INTERVAL", 2.0)
+    processed = 0
+    while True:
+        close_old_connections()
+        requeue_stale_jobs()
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+
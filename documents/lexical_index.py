@@ -0,0 +1,344 @@
+# personaai/documents/lexical_index.py
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .embedding_utils import get_vector_store_version
+from .models import DocumentChunk
+from .partitions import SHARED_PARTITION, partition_key
+
+# Kode mata kuliah dan identifier seperti "IF-2203" atau "data_frame" disimpan utuh dan per bagian
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:[-_.][0-9a-z]+)*")
+_SPLIT_RE = re.compile(r"[-_.]")
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.casefold()):
+        tokens.append(token)
+        if _SPLIT_RE.search(token):
+            tokens.extend(part for part in _SPLIT_RE.split(token) if part)
+    return tokens
+
+
+def tokenize_query(query):
+    """Query terms normalised the way chunk content is indexed.
+
+    Chunk content goes through preprocess_text, which drops punctuation, so
+    "IF-2203" is stored as "if2203". The query gets the same treatment, plus
+    the joined form and the parts of every hyphenated or underscored token.
+    """
+    from .utils import preprocess_text
+
+    tokens = tokenize(preprocess_text(query))
+    seen = set(tokens)
+    for token in _TOKEN_RE.findall(query.casefold()):
+        if not _SPLIT_RE.search(token):
+            continue
+        for term in [_SPLIT_RE.sub("", token)] + [part for part in _SPLIT_RE.split(token) if part]:
+            if term not in seen:
+                seen.add(term)
+                tokens.append(term)
+    return tokens
+
+
+class LexicalHit:
+    def __init__(self, chunk_id, document_id, chunk_index, score):
+        self.chunk_id = chunk_id
+        self.document_id = document_id
+        self.chunk_index = chunk_index
+        self.score = score
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over DocumentChunk.content.
+
+    Every chunk gets a slot; each term keeps its postings as two int32
+    arrays (slots and term frequencies) that are scored with NumPy. A
+    re-indexed or deleted document only tombstones its slots and appends
+    new ones, and the postings are compacted once too many slots are dead.
+    The index follows the database incrementally: when the vector store
+    version marker changes, documents whose chunk count or newest chunk id
+    differ are re-read, the others are left alone.
+    """
+
+    def __init__(self, k1=None, b=None):
+        self.k1 = k1 if k1 is not None else getattr(settings, "LEXICAL_BM25_K1", 1.2)
+        self.b = b if b is not None else getattr(settings, "LEXICAL_BM25_B", 0.75)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._vocabulary = {}
+        self._slots = {}  # term_id -> array('i') slot
+        self._freqs = {}  # term_id -> array('i') frekuensi term di slot itu
+        self._df = array("i")
+        self._slot_chunk = array("q")
+        self._slot_document = array("i")
+        self._slot_index = array("i")
+        self._slot_length = array("i")
+        self._slot_partition = array("i")
+        self._partition_ids = {}
+        self._alive = bytearray()
+        self._alive_count = 0
+        self._alive_length = 0
+        # document_id -> (slot pertama, slot terakhir + 1, Counter term_id -> jumlah slot)
+        self._documents = {}
+        self._signatures = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._searches = 0
+        self._budget_exhausted = 0
+        self._syncs = 0
+        self._search_time = 0.0
+
+    # --- pembaruan ---
+
+    def _prepare(self, rows):
+        """Tokenise (chunk_id, chunk_index, content) rows outside the lock."""
+        return [(chunk_id, chunk_index, Counter(tokenize(content))) for chunk_id, chunk_index, content in rows]
+
+    def _term_id(self, term):
+        term_id = self._vocabulary.get(term)
+        if term_id is None:
+            term_id = len(self._vocabulary)
+            self._vocabulary[term] = term_id
+            self._slots[term_id] = array("i")
+            self._freqs[term_id] = array("i")
+            self._df.append(0)
+        return term_id
+
+    def _remove(self, document_id):
+        entry = self._documents.pop(document_id, None)
+        if entry is None:
+            return
+        start, end, term_counts = entry
+        for slot in range(start, end):
+            if self._alive[slot]:
+                self._alive[slot] = 0
+                self._alive_count -= 1
+                self._alive_length -= self._slot_length[slot]
+        for term_id, count in term_counts.items():
+            self._df[term_id] -= count
+
+    def _add(self, document_id, prepared, partition):
+        start = len(self._slot_chunk)
+        partition_id = self._partition_ids.setdefault(partition, len(self._partition_ids))
+        # Postings satu dokumen dikumpulkan per term dulu, lalu ditambahkan sekaligus
+        postings = {}
+        for slot, (chunk_id, chunk_index, counts) in enumerate(prepared, start=start):
+            length = sum(counts.values())
+            self._slot_chunk.append(chunk_id)
+            self._slot_document.append(document_id)
+            self._slot_index.append(chunk_index)
+            self._slot_length.append(length)
+            self._alive_length += length
+            for term, freq in counts.items():
+                entry = postings.get(term)
+                if entry is None:
+                    postings[term] = entry = ([], [])
+                entry[0].append(slot)
+                entry[1].append(freq)
+        added = len(self._slot_chunk) - start
+        self._slot_partition.extend([partition_id] * added)
+        self._alive.extend(b"\x01" * added)
+        self._alive_count += added
+        term_counts = {}
+        for term, (slots, freqs) in postings.items():
+            term_id = self._term_id(term)
+            self._slots[term_id].extend(slots)
+            self._freqs[term_id].extend(freqs)
+            self._df[term_id] += len(slots)
+            term_counts[term_id] = len(slots)
+        self._documents[document_id] = (start, len(self._slot_chunk), term_counts)
+
+    def replace_document(self, document_id, rows, partition=SHARED_PARTITION):
+        """Index the chunks of a document, replacing what was indexed for it before."""
+        prepared = self._prepare(rows)
+        with self._lock:
+            self._remove(document_id)
+            self._add(document_id, prepared, partition)
+            self._maybe_compact()
+
+    def update_document(self, document_id, rows, partition=SHARED_PARTITION):
+        """Ingestion hook: re-index a freshly written document if this process has an index loaded.
+
+        `rows` are (chunk_id, chunk_index, content) of the rows just committed.
+        Processes that never search (e.g. the ingestion worker) skip the work;
+        they still bump the version marker that other processes sync on.
+        """
+        if self._version is None:
+            return
+        rows = list(rows)
+        self.replace_document(document_id, rows, partition)
+        self._signatures[document_id] = (len(rows), max((row[0] for row in rows), default=None), partition)
+
+    def remove_document(self, document_id):
+        with self._lock:
+            self._remove(document_id)
+            self._signatures.pop(document_id, None)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        total = len(self._alive)
+        ratio = getattr(settings, "LEXICAL_COMPACT_RATIO", 0.3)
+        if not total or (total - self._alive_count) / total < ratio:
+            return
+        alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+        # before[i] = jumlah slot hidup sebelum slot i, sekaligus posisi barunya
+        before = np.concatenate(([0], np.cumsum(alive, dtype=np.int64)))
+        for term_id in list(self._slots):
+            slots = np.frombuffer(self._slots[term_id], dtype=np.int32)
+            freqs = np.frombuffer(self._freqs[term_id], dtype=np.int32)
+            keep = alive[slots]
+            new_slots = array("i", before[slots[keep]].astype(np.int32).tobytes())
+            new_freqs = array("i", freqs[keep].tobytes())
+            del slots, freqs
+            self._slots[term_id] = new_slots
+            self._freqs[term_id] = new_freqs
+        for name in ("_slot_chunk", "_slot_document", "_slot_index", "_slot_length", "_slot_partition"):
+            values = getattr(self, name)
+            setattr(self, name, array(values.typecode, (value for value, keep in zip(values, alive) if keep)))
+        for document_id, (start, end, term_counts) in list(self._documents.items()):
+            self._documents[document_id] = (int(before[start]), int(before[end]), term_counts)
+        self._alive = bytearray(b"\x01" * self._alive_count)
+
+    # --- sinkronisasi dengan database ---
+
+    def sync(self):
+        """Bring the index up to date with DocumentChunk, re-reading only changed documents."""
+        with self._sync_lock:
+            rows = DocumentChunk.objects.values(
+                "document_id", "document__uploaded_by_id", "document__private", "document__course",
+                "document__persona_id",
+            ).annotate(count=Count("id"), last=Max("id"))
+            current = {
+                row["document_id"]: (row["count"], row["last"], partition_key(
+                    row["document__uploaded_by_id"] if row["document__private"] else None,
+                    row["document__course"], row["document__persona_id"],
+                ))
+                for row in rows
+            }
+            for document_id in [d for d in self._signatures if d not in current]:
+                self.remove_document(document_id)
+            changed = [d for d, signature in current.items() if self._signatures.get(d) != signature]
+            for document_id in changed:
+                rows = DocumentChunk.objects.filter(document_id=document_id).order_by("chunk_index").values_list(
+                    "id", "chunk_index", "content"
+                )
+                self.replace_document(document_id, rows.iterator(chunk_size=500), current[document_id][2])
+                self._signatures[document_id] = current[document_id]
+            self._syncs += 1
+            return len(changed)
+
+    def ensure_fresh(self):
+        """Sync when the vector store version changed; checked at most once per refresh interval."""
+        interval = getattr(settings, "RETRIEVER_POOL_REFRESH_INTERVAL", 5.0)
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        version = get_vector_store_version()
+        if version == self._version and self._version is not None:
+            return
+        self.sync()
+        self._version = version
+
+    # --- pencarian ---
+
+    def search(self, query, k=8, budget_ms=None, partitions=None):
+        """Top `k` chunks for `query` by BM25, restricted to `partitions` unless it is None.
+
+        Terms are scored rarest first; once `budget_ms` is spent the
+        remaining (more common, less informative) terms are skipped.
+        """
+        budget = (budget_ms if budget_ms is not None else getattr(settings, "LEXICAL_QUERY_BUDGET_MS", 5.0)) / 1000
+        start = time.perf_counter()
+        with self._lock:
+            hits, exhausted = self._search(tokenize_query(query), k, start, budget, partitions)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._searches += 1
+            self._search_time += elapsed
+            if exhausted:
+                self._budget_exhausted += 1
+        return hits
+
+    def _search(self, tokens, k, start, budget, partitions=None):
+        n = self._alive_count
+        if not n or not tokens:
+            return [], False
+        avgdl = self._alive_length / n or 1.0
+        max_df = getattr(settings, "LEXICAL_MAX_DF_RATIO", 0.5) * n
+        terms = []
+        for term, query_freq in Counter(tokens).items():
+            term_id = self._vocabulary.get(term)
+            if term_id is not None and self._df[term_id] > 0:
+                terms.append((self._df[term_id], term_id, query_freq))
+        terms.sort()
+        # Term yang muncul di lebih dari separuh chunk hampir tidak membedakan apa pun
+        if len(terms) > 1:
+            terms = [term for term in terms if term[0] <= max_df] or terms[:1]
+        if not terms:
+            return [], False
+
+        lengths = np.frombuffer(self._slot_length, dtype=np.int32)
+        scores = np.zeros(len(lengths), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths / avgdl)
+        exhausted = False
+        for i, (df, term_id, query_freq) in enumerate(terms):
+            if i and time.perf_counter() - start > budget:
+                exhausted = True
+                break
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            slots = np.frombuffer(self._slots[term_id], dtype=np.int32)
+            freqs = np.frombuffer(self._freqs[term_id], dtype=np.int32).astype(np.float32)
+            np.add.at(scores, slots, query_freq * idf * freqs * (self.k1 + 1) / (freqs + norm[slots]))
+            del slots, freqs
+        del lengths
+
+        scores *= np.frombuffer(bytes(self._alive), dtype=np.uint8)
+        if partitions is not None:
+            allowed = [self._partition_ids[p] for p in partitions if p in self._partition_ids]
+            scores *= np.isin(np.frombuffer(self._slot_partition, dtype=np.int32), allowed)
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        hits = [
+            LexicalHit(self._slot_chunk[slot], self._slot_document[slot], self._slot_index[slot], float(scores[slot]))
+            for slot in candidates.tolist()
+        ]
+        return hits, exhausted
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = len(self._alive)
+            stats = {
+                "documents": len(self._documents),
+                "chunks": self._alive_count,
+                "tombstoned": total - self._alive_count,
+                "terms": len(self._vocabulary),
+                "postings": sum(len(slots) for slots in self._slots.values()),
+            }
+        with self._stats_lock:
+            stats.update({
+                "syncs": self._syncs,
+                "searches": self._searches,
+                "budget_exhausted": self._budget_exhausted,
+                "avg_search_ms": self._search_time / self._searches * 1000 if self._searches else 0.0,
+            })
+        return stats
+
+
+_index = LexicalIndex()
+
+
+def get_lexical_index() -> LexicalIndex:
+    return _index
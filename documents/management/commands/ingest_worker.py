@@ -0,0 +1,72 @@
+import multiprocessing
+import os
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _worker_process(worker_id, once, poll_interval):
+    # Entry point proses anak; pada start method 'spawn' Django perlu di-setup ulang
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from documents.jobs import run_worker
+    run_worker(worker_id=worker_id, once=once, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Process queued document ingestion jobs with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of worker processes (default: settings.INGESTION_WORKERS).',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of polling forever.',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help='Seconds to sleep when the queue is empty.',
+        )
+
+    def handle(self, *args, **options):
+        from django.db import connections
+
+        workers = options['workers'] or getattr(settings, 'INGESTION_WORKERS', 1)
+        once = options['once']
+        poll_interval = options['poll_interval']
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        if workers == 1:
+            from documents.jobs import run_worker
+            processed = run_worker(worker_id=f"{prefix}/0", once=once, poll_interval=poll_interval)
+            if once:
+                self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)."))
+            return
+
+        # Koneksi DB tidak boleh diwariskan ke proses anak
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=_worker_process,
+                args=(f"{prefix}/{i}", once, poll_interval),
+                name=f"ingest-worker-{i}",
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {workers} ingestion worker(s).")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+        self.stdout.write(self.style.SUCCESS("Ingestion workers stopped."))
@@ -0,0 +1,159 @@
+import math
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.embedding_utils import get_chroma_collection, get_collection_name
+from documents.partitions import SHARED_PARTITION, get_partition_directory
+from documents.vector_index import MmapVectorIndex, get_vector_index
+
+
+def _chroma_rows(collection, batch_size=1000):
+    """Yield (ids, embeddings, metadatas, documents) batches of a whole Chroma collection."""
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        data = collection.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas", "documents"])
+        yield data["ids"], data["embeddings"], data["metadatas"], data["documents"]
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the memory-mapped vector index (import from Chroma, train IVF lists, compact) "
+        "and compare its recall and latency with Chroma."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['import', 'train-ivf', 'compact', 'stats', 'compare'])
+        parser.add_argument('--partition', default=None,
+                            help='Partition to work on (default: every partition that has chunks).')
+        parser.add_argument('--lists', type=int, default=None,
+                            help='IVF lists (default: sqrt of the number of vectors; 0 disables IVF in compare).')
+        parser.add_argument('--nprobe', type=int, default=None, help='IVF lists searched per query.')
+        parser.add_argument('--queries', type=int, default=200, help='Queries for compare.')
+        parser.add_argument('--k', type=int, default=10, help='Results per query for compare.')
+        parser.add_argument('--noise', type=float, default=0.05,
+                            help='Gaussian noise added to stored vectors to make compare queries.')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Compare on N synthetic vectors instead of the configured Chroma collection.')
+        parser.add_argument('--dim', type=int, default=768, help='Dimensions of synthetic vectors.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'compare':
+            self._compare(options)
+            return
+
+        if options['partition']:
+            partitions = [options['partition']]
+        else:
+            partitions = sorted(get_partition_directory().existing() | {SHARED_PARTITION})
+        for partition in partitions:
+            self.stdout.write(f"[{partition}]")
+            self._maintain(action, partition, options)
+
+    def _maintain(self, action, partition, options):
+        index = get_vector_index(get_collection_name(partition=partition))
+        if action == 'import':
+            start = time.perf_counter()
+            imported = 0
+            for ids, embeddings, metadatas, documents in _chroma_rows(get_chroma_collection(partition)):
+                index.upsert(ids, embeddings, metadatas=metadatas, documents=documents)
+                imported += len(ids)
+            self.stdout.write(self.style.SUCCESS(
+                f"Imported {imported} vectors into {index.path} in {time.perf_counter() - start:.2f}s."
+            ))
+        elif action == 'train-ivf':
+            live = index.stats()['live']
+            lists = options['lists'] or max(1, int(math.sqrt(live)))
+            start = time.perf_counter()
+            index.train_ivf(lists, seed=options['seed'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Trained {lists} IVF lists over {live} vectors in {time.perf_counter() - start:.2f}s."
+            ))
+        elif action == 'compact':
+            dropped = index.compact()
+            self.stdout.write(self.style.SUCCESS(f"Dropped {dropped} tombstoned rows."))
+        for key, value in index.stats().items():
+            self.stdout.write(f"{key:>14}: {value}")
+
+    def _compare(self, options):
+        import chromadb
+
+        rng = np.random.default_rng(options['seed'])
+        workdir = tempfile.mkdtemp(prefix="vector-compare-")
+        try:
+            if options['synthetic']:
+                # Vektor sintetis berkelompok, mirip embedding chunk dari beberapa dokumen
+                n, dim = options['synthetic'], options['dim']
+                centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+                vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                ids = [f"v{i}" for i in range(n)]
+                collection = chromadb.PersistentClient(path=f"{workdir}/chroma").get_or_create_collection("compare")
+                for start in range(0, n, 5000):
+                    collection.add(ids=ids[start:start + 5000], embeddings=vectors[start:start + 5000].tolist(),
+                                   metadatas=[{"document_id": i // 100} for i in range(start, min(n, start + 5000))])
+            else:
+                collection = get_chroma_collection(options['partition'])
+                ids, vectors = [], []
+                for batch_ids, embeddings, _, _ in _chroma_rows(collection):
+                    ids.extend(batch_ids)
+                    vectors.extend(embeddings)
+                vectors = np.asarray(vectors, dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            if not len(ids):
+                raise CommandError("No vectors to compare; ingest documents or use --synthetic N.")
+
+            index = MmapVectorIndex(f"{workdir}/mmap", nprobe=options['nprobe'])
+            start = time.perf_counter()
+            for offset in range(0, len(ids), 5000):
+                index.upsert(ids[offset:offset + 5000], vectors[offset:offset + 5000],
+                             metadatas=[{"embedding_id": i} for i in ids[offset:offset + 5000]])
+            build_time = time.perf_counter() - start
+
+            k = min(options['k'], len(ids))
+            picks = rng.integers(0, len(ids), options['queries'])
+            queries = vectors[picks] + options['noise'] * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            exact = [set(np.argsort(-(vectors @ q))[:k].tolist()) for q in queries]
+            position = {embedding_id: i for i, embedding_id in enumerate(ids)}
+
+            def run(search):
+                latencies, recall = [], []
+                for q, truth in zip(queries, exact):
+                    start = time.perf_counter()
+                    found = search(q)
+                    latencies.append(time.perf_counter() - start)
+                    recall.append(len(truth & {position[i] for i in found}) / k)
+                return float(np.mean(recall)), latencies
+
+            results = [
+                ('chroma', *run(lambda q: collection.query(query_embeddings=[q.tolist()], n_results=k,
+                                                           include=[])["ids"][0])),
+                ('mmap flat', *run(lambda q: [m["embedding_id"] for _, m, _ in index.search(q, k=k, nprobe=0)])),
+            ]
+            lists = options['lists'] if options['lists'] is not None else (
+                int(math.sqrt(len(ids))) if len(ids) >= 1000 else 0)
+            if lists:
+                index.train_ivf(lists, seed=options['seed'])
+                nprobe = options['nprobe'] or index.nprobe
+                results.append((f'mmap ivf {nprobe}/{lists}',
+                                *run(lambda q: [m["embedding_id"] for _, m, _ in index.search(q, k=k)])))
+
+            self.stdout.write(f"{len(ids)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={k}; "
+                              f"mmap build {build_time:.2f}s")
+            for name, recall, latencies in results:
+                self.stdout.write(
+                    f"{name:>16}: recall@{k} {recall:.3f}, p50 {_percentile(latencies, 50):.2f}ms, "
+                    f"p95 {_percentile(latencies, 95):.2f}ms, {len(latencies) / sum(latencies):.0f} q/s"
+                )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_documentchunk_token_count'),
+        ('persona', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='course',
+            field=models.CharField(blank=True, default='', help_text='Study program this document belongs to; empty = every program.', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='persona',
+            field=models.ForeignKey(blank=True, help_text='Only searched for users with this persona.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='documents', to='persona.persona'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='private',
+            field=models.BooleanField(default=False, help_text='Only searched for the uploader.'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 # personaai/documents/models.py
 from django.db import models
 from django.contrib.auth.models import User
-from .embedding_utils import get_chroma_collection
+from django.utils import timezone
+from .embedding_utils import get_vector_collection
+from .partitions import document_partition
 
 
 class Document(models.Model):
@@ -9,6 +11,12 @@ class Document(models.Model):
     description = models.TextField(blank=True, null=True)
     file = models.FileField(upload_to='documents/')
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_documents')
+    # Partisi retrieval: dokumen hanya dicari untuk pengguna yang cocok dengan semua field yang diisi
+    course = models.CharField(max_length=100, blank=True, default='',
+                              help_text="Study program this document belongs to; empty = every program.")
+    persona = models.ForeignKey('persona.Persona', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='documents', help_text="Only searched for users with this persona.")
+    private = models.BooleanField(default=False, help_text="Only searched for the uploader.")
     processed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -20,6 +28,7 @@ class DocumentChunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     content = models.TextField()
     chunk_index = models.IntegerField()
+    token_count = models.IntegerField(blank=True, null=True)
     embedding_id = models.CharField(max_length=255, blank=True, null=True)
     
     def __str__(self):
@@ -27,11 +36,45 @@ class DocumentChunk(models.Model):
     
     def get_embedding_vector(self):
         try:
-            collection = get_chroma_collection()
+            collection = get_vector_collection(document_partition(self.document))
             data = collection.get(ids=[self.embedding_id], include=["embeddings"])
             return data["embeddings"][0] if data["embeddings"] else None
         except Exception as e:
             return None
     
     class Meta:
-        ordering = ['chunk_index']
\ No newline at end of file
+        ordering = ['chunk_index']
+
+
+class IngestionJob(models.Model):
+    class State(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        EXTRACTING = 'extracting', 'Extracting'
+        EMBEDDING = 'embedding', 'Embedding'
+        INDEXED = 'indexed', 'Indexed'
+        FAILED = 'failed', 'Failed'
+
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='ingestion_job')
+    state = models.CharField(max_length=20, choices=State.choices, default=State.QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    chunks_total = models.IntegerField(default=0)
+    chunks_done = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=255, blank=True, default='')
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.document.title} - {self.state}"
+
+    @property
+    def progress(self):
+        if not self.chunks_total:
+            return 0.0
+        return self.chunks_done / self.chunks_total
+
+    class Meta:
+        ordering = ['next_attempt_at']
@@ -0,0 +1,105 @@
+# personaai/documents/partitions.py
+import threading
+import time
+from itertools import product
+
+from django.conf import settings
+from django.utils.text import slugify
+
+from .embedding_utils import get_vector_store_version
+
+# Dokumen tanpa pemilik privat, course atau persona; memakai koleksi lama tanpa akhiran
+SHARED_PARTITION = "shared"
+
+
+def partition_key(owner_id=None, course="", persona_id=None):
+    """Partition of a document: every dimension that restricts who may see it, or 'shared'."""
+    parts = []
+    if owner_id:
+        parts.append(f"owner-{owner_id}")
+    course = slugify(course or "")
+    if course:
+        parts.append(f"course-{course}")
+    if persona_id:
+        parts.append(f"persona-{persona_id}")
+    return ".".join(parts) or SHARED_PARTITION
+
+
+def document_partition(document):
+    return partition_key(
+        document.uploaded_by_id if document.private else None,
+        document.course,
+        document.persona_id,
+    )
+
+
+def partition_metadata(document):
+    """Metadata written with every chunk of `document` (Chroma does not accept None values)."""
+    return {
+        "owner_id": document.uploaded_by_id or 0,
+        "course": document.course or "",
+        "persona_id": document.persona_id or 0,
+        "partition": document_partition(document),
+    }
+
+
+def entitled_partitions(user_id, course="", persona_id=None):
+    """Every partition a user may search: each dimension either unrestricted or matching the user."""
+    return sorted({
+        partition_key(owner, course_value, persona)
+        for owner, course_value, persona in product((None, user_id), ("", course or ""), (None, persona_id))
+    })
+
+
+class PartitionDirectory:
+    """Partitions that currently hold indexed chunks, re-read when the vector store version changes.
+
+    Retrieval only searches entitled partitions that exist, so the number
+    of collections queried per turn stays small however many departments
+    have documents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions = frozenset()
+        self._version = None
+        self._checked_at = 0.0
+
+    def existing(self):
+        interval = getattr(settings, "RETRIEVER_POOL_REFRESH_INTERVAL", 5.0)
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < interval:
+            return self._partitions
+        with self._lock:
+            self._checked_at = now
+            version = get_vector_store_version()
+            if version != self._version:
+                self._partitions = self._load()
+                self._version = version
+            return self._partitions
+
+    def _load(self):
+        from .models import Document
+        rows = (
+            Document.objects.filter(chunks__isnull=False)
+            .values_list("uploaded_by_id", "private", "course", "persona_id")
+            .distinct()
+        )
+        return frozenset(
+            partition_key(owner_id if private else None, course, persona_id)
+            for owner_id, private, course, persona_id in rows
+        )
+
+    def searchable(self, partitions):
+        """The subset of `partitions` that exist; None (no restriction) means all of them."""
+        existing = self.existing()
+        if partitions is None:
+            return sorted(existing)
+        return [partition for partition in partitions if partition in existing]
+
+
+_directory = PartitionDirectory()
+
+
+def get_partition_directory() -> PartitionDirectory:
+    return _directory
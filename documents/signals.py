@@ -1,15 +1,102 @@
-from django.db.models.signals import post_save, pre_save
+import logging
+
+from django.db.models.signals import post_delete, post_save, pre_save, pre_delete
 from django.dispatch import receiver
 from .models import Document, DocumentChunk
-from .utils import process_document
+from django.conf import settings
+from .jobs import enqueue_document, run_job, claim_next_job
+from .partitions import document_partition, partition_key
+from .utils import purge_document_vectors
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_save, sender=Document)
+def detect_document_file_change(sender, instance, **kwargs):
+    """
+    Signal to remember whether an existing document got a new file or moved to another partition.
+    """
+    instance._file_changed = False
+    instance._previous_partition = None
+    if instance.pk:
+        previous = Document.objects.filter(pk=instance.pk).values_list(
+            'file', 'uploaded_by_id', 'private', 'course', 'persona_id'
+        ).first()
+        if previous is not None:
+            file_name, owner_id, private, course, persona_id = previous
+            instance._file_changed = file_name != instance.file.name
+            partition = partition_key(owner_id if private else None, course, persona_id)
+            if partition != document_partition(instance):
+                instance._previous_partition = partition
 
 
 @receiver(post_save, sender=Document)
 def process_document_after_save(sender, instance, created, **kwargs):
     """
-    Signal to process the document after it is saved.
+    Signal to queue the document for ingestion after it is saved.
+    The ingest_worker management command processes the queue; re-uploads
+    are re-indexed incrementally.
+    """
+    file_changed = getattr(instance, '_file_changed', False)
+    previous_partition = getattr(instance, '_previous_partition', None)
+    if previous_partition is not None:
+        # Vektor di koleksi partisi lama dihapus; dokumen diindeks ulang ke partisi baru
+        try:
+            purge_document_vectors(instance.id, partition=previous_partition)
+        except Exception as e:
+            logger.warning("Error removing vectors of document %s from partition %s: %s",
+                           instance.id, previous_partition, e)
+    if (created and not instance.processed) or file_changed or previous_partition is not None:
+        if file_changed or previous_partition is not None:
+            Document.objects.filter(pk=instance.pk).update(processed=False)
+        queue_ingestion(instance)
+
+
+def queue_ingestion(document):
+    enqueue_document(document)
+    if not getattr(settings, "INGESTION_USE_QUEUE", True):
+        # Mode sinkron (tanpa worker): proses langsung di request ini
+        job = claim_next_job("inline", document=document)
+        if job is not None:
+            run_job(job)
+
+
+@receiver(pre_delete, sender=Document)
+def purge_vectors_before_delete(sender, instance, **kwargs):
+    """
+    Signal to remove the document's vectors before its chunks are cascaded away.
+    """
+    try:
+        purge_document_vectors(instance.id, partition=document_partition(instance))
+    except Exception as e:
+        logger.warning("Error removing vectors of document %s: %s", instance.id, e)
+
+
+@receiver(pre_delete, sender='persona.Persona')
+def purge_persona_documents(sender, instance, **kwargs):
+    """
+    Signal to remove the vectors of a persona's documents before the persona is deleted.
+    Document.persona is set to NULL by the delete, so the documents move to
+    the partition without a persona and are re-indexed there afterwards.
+    """
+    instance._document_ids = []
+    for document in Document.objects.filter(persona=instance):
+        try:
+            purge_document_vectors(document.id, partition=document_partition(document))
+        except Exception as e:
+            logger.warning("Error removing vectors of document %s of deleted persona %s: %s",
+                           document.id, instance.pk, e)
+        instance._document_ids.append(document.id)
+
+
+@receiver(post_delete, sender='persona.Persona')
+def reindex_persona_documents(sender, instance, **kwargs):
+    """
+    Signal to queue the documents of a deleted persona for ingestion into their new partition.
     """
-    if created and not instance.processed:
-        process_document(instance)
-        instance.processed = True
-        instance.save()
\ No newline at end of file
+    document_ids = getattr(instance, '_document_ids', [])
+    if not document_ids:
+        return
+    Document.objects.filter(pk__in=document_ids).update(processed=False)
+    for document in Document.objects.filter(pk__in=document_ids):
+        queue_ingestion(document)
@@ -1,3 +1,374 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from chat.rag.benchmark import benchmark_environment
+from persona.models import Persona
+
+from .embedding_cache import CachedEmbeddings, EmbeddingCache, make_cache_key, normalize_text
+from .embedding_utils import get_vector_collection
+from .jobs import claim_next_job, requeue_stale_jobs, run_job
+from .lexical_index import LexicalIndex, tokenize_query
+from .models import Document, DocumentChunk, IngestionJob
+from .partitions import SHARED_PARTITION, partition_key
+from .utils import ChunkWriter, chunk_text, iter_batches, iter_chunks, preprocess_text
+from .vector_index import MmapVectorIndex
+
+
+class LexicalQueryTests(SimpleTestCase):
+    def test_course_code_query_matches_preprocessed_content(self):
+        index = LexicalIndex()
+        texts = [
+            "The course IF-2203 covers algorithms and data structures.",
+            "Kuliah MA1101 adalah kalkulus dasar.",
+            "General advice about studying well and sleeping.",
+        ]
+        index.replace_document(1, [(10 + i, i, preprocess_text(text)) for i, text in enumerate(texts)])
+
+        self.assertEqual([hit.chunk_index for hit in index.search("IF-2203", k=2)], [0])
+        self.assertEqual([hit.chunk_index for hit in index.search("what is if_2203?", k=2)], [0])
+
+    def test_query_emits_joined_form(self):
+        tokens = tokenize_query("IF-2203 data_frame")
+        self.assertIn("if2203", tokens)
+        self.assertIn("dataframe", tokens)
+        self.assertIn("2203", tokens)
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def chunks(self, first_id, *texts):
+        return [(first_id + i, i, preprocess_text(text)) for i, text in enumerate(texts)]
+
+    def test_bm25_ranks_rarer_and_denser_matches_first(self):
+        index = LexicalIndex()
+        index.replace_document(1, self.chunks(
+            10,
+            "graf berarah dan algoritma dijkstra untuk jalur terpendek dijkstra",
+            "algoritma pengurutan quicksort",
+            "algoritma pencarian biner",
+            "kalkulus integral tentu",
+            "statistika dan peluang",
+            "jaringan komputer dasar",
+        ))
+        hits = index.search("algoritma dijkstra", k=3)
+        self.assertEqual(hits[0].chunk_id, 10)
+        self.assertEqual(len(hits), 3)
+        self.assertTrue(all(hits[i].score >= hits[i + 1].score for i in range(len(hits) - 1)))
+
+    def test_terms_in_most_chunks_are_skipped(self):
+        index = LexicalIndex()
+        index.replace_document(1, self.chunks(10, "materi graf", "materi pohon", "materi heap", "ringkasan"))
+        self.assertEqual([hit.chunk_id for hit in index.search("materi heap")], [12])
+
+    def test_replace_and_remove_document(self):
+        index = LexicalIndex()
+        index.replace_document(1, self.chunks(10, "kuliah MA1101 kalkulus dasar", "topik lain"))
+        index.replace_document(1, self.chunks(20, "kuliah MA1102 kalkulus lanjut", "topik lain"))
+        self.assertEqual(index.search("MA1101"), [])
+        self.assertEqual([hit.chunk_id for hit in index.search("MA1102")], [20])
+        index.remove_document(1)
+        self.assertEqual(index.search("kalkulus"), [])
+        self.assertEqual(index.stats()["chunks"], 0)
+
+    @override_settings(LEXICAL_COMPACT_RATIO=0.3)
+    def test_compaction_keeps_results(self):
+        index = LexicalIndex()
+        index.replace_document(1, self.chunks(10, "struktur data pohon", "struktur data graf"))
+        index.replace_document(2, self.chunks(20, "basis data relasional"))
+        index.replace_document(1, self.chunks(30, "struktur data heap", "struktur data graf"))
+        stats = index.stats()
+        self.assertEqual((stats["chunks"], stats["tombstoned"]), (3, 0))
+        self.assertEqual([hit.chunk_id for hit in index.search("heap")], [30])
+        self.assertEqual([hit.chunk_id for hit in index.search("relasional")], [20])
+
+    def test_search_is_restricted_to_partitions(self):
+        index = LexicalIndex()
+        index.replace_document(1, self.chunks(10, "jadwal ujian umum"), partition="shared")
+        index.replace_document(2, self.chunks(20, "jadwal ujian privat"), partition="owner-7")
+        self.assertEqual({hit.chunk_id for hit in index.search("jadwal ujian")}, {10, 20})
+        self.assertEqual([hit.chunk_id for hit in index.search("jadwal ujian", partitions=["shared"])], [10])
+        self.assertEqual(index.search("jadwal ujian", partitions=["owner-8"]), [])
+
+
+class _CountingEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = os.path.join(workdir.name, "embeddings.sqlite3")
+
+    def test_normalized_texts_share_a_key(self):
+        self.assertEqual(normalize_text("  Kapan   UJIAN\n"), "kapan ujian")
+        self.assertEqual(make_cache_key("m", "Kapan ujian"), make_cache_key("m", " kapan\tUJIAN "))
+        self.assertNotEqual(make_cache_key("m", "kapan ujian"), make_cache_key("other", "kapan ujian"))
+
+    def test_evicted_entries_are_read_back_from_disk(self):
+        cache = EmbeddingCache(self.path, memory_size=2)
+        cache.set_many([("a", [1.0]), ("b", [2.0]), ("c", [3.0])])
+        self.assertEqual(cache.stats()["memory_entries"], 2)
+        self.assertEqual(cache.get_many(["a", "c"]), {"a": [1.0], "c": [3.0]})
+        self.assertEqual((cache.memory_hits, cache.disk_hits, cache.misses), (1, 1, 0))
+
+    def test_expired_entries_miss_in_both_tiers(self):
+        cache = EmbeddingCache(self.path, ttl=60)
+        cache.set_many([("a", [1.0])])
+        with mock.patch("documents.embedding_cache.time.time", return_value=time.time() + 120):
+            self.assertEqual(cache.get_many(["a"]), {})
+        self.assertEqual(cache.misses, 1)
+
+    def test_each_text_is_embedded_once_across_workers(self):
+        model = _CountingEmbeddings()
+        embeddings = CachedEmbeddings(model, "m", EmbeddingCache(self.path))
+        vectors = embeddings.embed_documents(["Graf", "graf ", "pohon"])
+        self.assertEqual(vectors[0], vectors[1])
+        self.assertEqual(embeddings.embed_query("POHON"), vectors[2])
+
+        # Worker lain dengan cache memori kosong membaca dari file SQLite yang sama
+        other = CachedEmbeddings(model, "m", EmbeddingCache(self.path))
+        self.assertEqual(other.embed_query("graf"), vectors[0])
+        self.assertEqual(model.embedded, ["Graf", "pohon"])
+
+
+class MmapVectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = MmapVectorIndex(directory.name)
+        self.vectors = np.random.default_rng(0).normal(size=(400, 32)).astype(np.float32)
+        self.ids = [f"chunk-{i}" for i in range(len(self.vectors))]
+        self.index.upsert(
+            self.ids, self.vectors,
+            metadatas=[{"document_id": i // 10, "chunk_index": i % 10} for i in range(len(self.vectors))],
+            documents=[f"text {i}" for i in range(len(self.vectors))],
+        )
+
+    def top(self, vector, k=1, **kwargs):
+        return [content for content, _, _ in self.index.search(vector, k=k, **kwargs)]
+
+    def test_search_finds_the_nearest_vector(self):
+        content, metadata, similarity, vector = self.index.search(self.vectors[7], k=1, include_vectors=True)[0]
+        self.assertEqual((content, metadata["chunk_index"]), ("text 7", 7))
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+        np.testing.assert_allclose(vector, self.vectors[7] / np.linalg.norm(self.vectors[7]), rtol=1e-5)
+
+    def test_upsert_replaces_and_delete_tombstones(self):
+        self.index.upsert(["chunk-7"], self.vectors[8:9], metadatas=[{"document_id": 0}], documents=["moved"])
+        self.assertEqual(set(self.top(self.vectors[8], k=2)), {"text 8", "moved"})
+        self.assertNotIn("text 7", self.top(self.vectors[7], k=5))
+        self.index.delete(where={"document_id": 1})
+        self.assertEqual(self.index.count(), 390)
+        self.assertEqual(self.index.get(ids=["chunk-12"])["ids"], [])
+        self.assertEqual(self.index.stats()["tombstoned"], 11)
+
+    def test_compact_drops_dead_rows_and_keeps_results(self):
+        self.index.delete(ids=self.ids[:100])
+        self.assertEqual(self.index.compact(), 100)
+        stats = self.index.stats()
+        self.assertEqual((stats["rows"], stats["tombstoned"], stats["generation"]), (300, 0, 1))
+        self.assertEqual(self.top(self.vectors[250]), ["text 250"])
+        self.assertEqual(self.index.get(ids=["chunk-250"], include=("documents",))["documents"], ["text 250"])
+
+    def test_ivf_search_matches_exact_search(self):
+        queries = self.vectors[:50]
+        exact = [self.top(vector, k=5) for vector in queries]
+        self.index.train_ivf(8)
+        self.assertEqual(self.index.stats()["ivf_lists"], 8)
+        # Semua list diperiksa: hasil sama dengan pencarian eksak
+        self.assertEqual([self.top(vector, k=5, nprobe=8) for vector in queries], exact)
+        # Sedikit list: vektor yang tersimpan tetap ditemukan di list-nya sendiri
+        self.assertEqual([self.top(vector, nprobe=1) for vector in queries], [result[:1] for result in exact])
+        self.index.upsert(["late"], self.vectors[:1] * -1, documents=["late"])
+        self.assertEqual(self.top(-self.vectors[0], nprobe=1), ["late"])
+
+
+class IterChunksTests(SimpleTestCase):
+    def segments(self, count, seed=0):
+        rng = np.random.default_rng(seed)
+        words = [f"kata{i}" for i in range(300)]
+        return [" ".join(rng.choice(words, size=int(rng.integers(5, 400)))) for _ in range(count)]
+
+    def test_streamed_chunks_match_chunking_the_full_text(self):
+        for seed in range(3):
+            segments = self.segments(60, seed)
+            full = " ".join(segment.strip() for segment in segments)
+            for window in (1500, 4096):
+                with self.subTest(seed=seed, window=window):
+                    self.assertEqual(list(iter_chunks(segments, window=window)), chunk_text(full))
+
+    def test_empty_segments_are_skipped(self):
+        self.assertEqual(list(iter_chunks(["", "   ", "satu dua", "\n"])), ["satu dua"])
+        self.assertEqual(list(iter_chunks([])), [])
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+class PersonaDeleteTests(TestCase):
+    def test_documents_of_a_deleted_persona_move_to_the_shared_partition(self):
+        with benchmark_environment(database=False, INGESTION_USE_QUEUE=False):
+            owner = User.objects.create_user("uploader")
+            persona = Persona.objects.create(name="Dosen", description="Dosen algoritma")
+            document = Document(title="Silabus", uploaded_by=owner, persona=persona)
+            document.file.save("silabus.txt", ContentFile("Silabus algoritma dan struktur data. " * 50))
+            persona_partition = partition_key(None, "", persona.id)
+            self.assertTrue(get_vector_collection(persona_partition).get(where={"document_id": document.id})["ids"])
+
+            persona.delete()
+
+            document.refresh_from_db()
+            self.assertIsNone(document.persona_id)
+            self.assertTrue(document.processed)
+            self.assertEqual(document.ingestion_job.state, IngestionJob.State.INDEXED)
+            self.assertFalse(get_vector_collection(persona_partition).get(where={"document_id": document.id})["ids"])
+            shared = get_vector_collection(SHARED_PARTITION).get(where={"document_id": document.id})["ids"]
+            self.assertEqual(sorted(shared), sorted(DocumentChunk.objects.filter(document=document)
+                                                    .values_list("embedding_id", flat=True)))
+
+
+class ChunkWriterTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Index mmap meniru API koleksi Chroma yang dipakai ChunkWriter
+        self.collection = MmapVectorIndex(directory.name)
+        owner = User.objects.create_user("writer")
+        self.document = Document.objects.create(title="Modul", uploaded_by=owner, file="documents/modul.txt",
+                                                processed=True)
+        self.write(["bab satu", "bab dua"])
+
+    def vector(self, text):
+        rng = np.random.default_rng(zlib.crc32(text.encode()))
+        return rng.normal(size=8).astype(np.float32)
+
+    def write(self, texts):
+        embedded = []
+        with ChunkWriter(self.document, self.collection, batch_size=2, model_name="test") as writer:
+            for index, text in enumerate(texts):
+                embedding_id = writer.chunk_id(text)
+                vector = None
+                if not writer.has_vector(embedding_id):
+                    vector = self.vector(text)
+                    embedded.append(text)
+                writer.add(index, text, embedding_id, vector)
+        return embedded
+
+    def stored(self):
+        rows = list(DocumentChunk.objects.filter(document=self.document).values_list("content", "embedding_id"))
+        vectors = self.collection.get(where={"document_id": self.document.id}, include=("documents",))
+        return rows, sorted(vectors["documents"])
+
+    def test_reindex_only_embeds_new_chunks_and_removes_stale_ones(self):
+        self.assertEqual(self.write(["bab dua", "bab tiga"]), ["bab tiga"])
+        rows, vectors = self.stored()
+        self.assertEqual([content for content, _ in rows], ["bab dua", "bab tiga"])
+        self.assertEqual(vectors, ["bab dua", "bab tiga"])
+        # Posisi chunk yang dipertahankan ikut diperbarui
+        metadata = self.collection.get(ids=[rows[0][1]])["metadatas"][0]
+        self.assertEqual(metadata["chunk_index"], 0)
+
+    def test_failure_before_commit_rolls_back_new_vectors(self):
+        with mock.patch.object(DocumentChunk.objects, "bulk_create", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.write(["bab satu", "bab tiga"])
+        rows, vectors = self.stored()
+        self.assertEqual([content for content, _ in rows], ["bab satu", "bab dua"])
+        self.assertEqual(vectors, ["bab dua", "bab satu"])
+
+    def test_failure_after_commit_keeps_the_new_vectors(self):
+        with mock.patch.object(self.collection, "delete", side_effect=RuntimeError("store down")):
+            with self.assertLogs("documents.utils", level="WARNING"):
+                self.write(["bab satu", "bab tiga"])
+        rows, vectors = self.stored()
+        self.assertEqual([content for content, _ in rows], ["bab satu", "bab tiga"])
+        # Vektor chunk yang hilang tertinggal, tetapi setiap baris tetap punya vektornya
+        self.assertEqual(vectors, ["bab dua", "bab satu", "bab tiga"])
+        self.assertEqual(self.write(["bab satu", "bab tiga"]), [])
+        self.assertEqual(self.stored()[1], ["bab satu", "bab tiga"])
+
+
+@override_settings(INGESTION_USE_QUEUE=True, INGESTION_MAX_ATTEMPTS=3, INGESTION_RETRY_BACKOFF=30,
+                   INGESTION_STALE_AFTER=600)
+class IngestionQueueTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user("queue")
+        # Menyimpan dokumen baru memasukkannya ke antrean lewat signal post_save
+        self.document = Document.objects.create(title="Modul", uploaded_by=owner, file="documents/modul.txt")
+        self.job = self.document.ingestion_job
+
+    def test_claim_is_exclusive_and_respects_next_attempt(self):
+        IngestionJob.objects.filter(pk=self.job.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertIsNone(claim_next_job("w1"))
+        IngestionJob.objects.filter(pk=self.job.pk).update(next_attempt_at=timezone.now())
+        job = claim_next_job("w1")
+        self.assertEqual((job.pk, job.state, job.worker, job.attempts), (self.job.pk, IngestionJob.State.EXTRACTING, "w1", 1))
+        self.assertIsNone(claim_next_job("w2"))
+
+    def test_failures_back_off_then_fail(self):
+        with mock.patch("documents.utils.process_document", side_effect=RuntimeError("corrupt file")):
+            with self.assertLogs("documents.jobs", level="ERROR"):
+                self.assertFalse(run_job(claim_next_job("w1")))
+            job = IngestionJob.objects.get(pk=self.job.pk)
+            self.assertEqual(job.state, IngestionJob.State.QUEUED)
+            self.assertIn("corrupt file", job.last_error)
+            delay = (job.next_attempt_at - timezone.now()).total_seconds()
+            self.assertTrue(25 < delay <= 30, delay)
+
+            # Percobaan kedua menunggu dua kali lebih lama, percobaan ketiga adalah yang terakhir
+            for expected in (60, None):
+                IngestionJob.objects.filter(pk=self.job.pk).update(next_attempt_at=timezone.now())
+                with self.assertLogs("documents.jobs", level="ERROR"):
+                    run_job(claim_next_job("w1"))
+                job = IngestionJob.objects.get(pk=self.job.pk)
+                if expected is not None:
+                    self.assertTrue(expected - 5 < (job.next_attempt_at - timezone.now()).total_seconds() <= expected)
+        self.assertEqual((job.state, job.attempts), (IngestionJob.State.FAILED, 3))
+
+    def test_stale_jobs_are_requeued_until_the_attempt_cap(self):
+        claim_next_job("w1")
+        long_ago = timezone.now() - timedelta(hours=1)
+        IngestionJob.objects.filter(pk=self.job.pk).update(updated_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job = IngestionJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.state, job.worker, job.attempts), (IngestionJob.State.QUEUED, "", 1))
+
+        # Job yang masih mengirim heartbeat tidak disentuh
+        claim_next_job("w1")
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        IngestionJob.objects.filter(pk=self.job.pk).update(attempts=3, updated_at=long_ago)
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.assertEqual(IngestionJob.objects.get(pk=self.job.pk).state, IngestionJob.State.FAILED)
+
+    @override_settings(INGESTION_HEARTBEAT_INTERVAL=0)
+    def test_heartbeat_keeps_a_long_extraction_alive(self):
+        job = claim_next_job("w1")
+        long_ago = timezone.now() - timedelta(hours=1)
+
+        def slow_extraction(document, progress, heartbeat):
+            IngestionJob.objects.filter(pk=job.pk).update(updated_at=long_ago)
+            heartbeat()
+            self.assertEqual(requeue_stale_jobs(), 0)
+
+        with mock.patch("documents.utils.process_document", side_effect=slow_extraction):
+            self.assertTrue(run_job(job))
+        self.assertEqual(IngestionJob.objects.get(pk=job.pk).state, IngestionJob.State.INDEXED)
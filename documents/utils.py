@@ -1,90 +1,358 @@
 # personaai/documents/utils.py
+import os
+import logging
 import pdfplumber
 import openai
-import uuid
+import hashlib
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from docx import Document
 from pptx import Presentation
 from django.conf import settings
-from documents.models import DocumentChunk
+from django.db import transaction
+from documents.models import DocumentChunk, IngestionJob
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from .embedding_utils import get_embedding_model, get_chroma_collection
+from chat.rag.tokens import count_tokens
+from .embedding_backends import get_embedding_model_name
+from .embedding_cache import normalize_text
+from .embedding_utils import get_embedding_model, get_vector_collection, touch_vector_store_version
+from .lexical_index import get_lexical_index
+from .partitions import document_partition, partition_metadata
+
+logger = logging.getLogger(__name__)
 
 openai.api_key = settings.OPENAI_API_KEY
 
-def process_document(document_instance):
-    collection = get_chroma_collection()
+def process_document(document_instance, progress=None, heartbeat=None):
+    """Extract, chunk, embed and index a document.
+
+    Chunk IDs are content-addressed, so re-processing a document only embeds
+    chunks that are new or changed and deletes the vectors of removed ones.
+    `progress(state, done, total)` is called as the document moves through
+    the IngestionJob states so the queue can report per-document progress.
+    Chunks are streamed, so their number is only known at the end: `total`
+    stays 0 (progress unknown) until the last batch has been embedded.
+    `heartbeat()` is called for every extracted page, slide or block so a
+    long extraction still shows that the job is alive.
+    """
+    progress = progress or (lambda state, done, total: None)
+    collection = get_vector_collection(document_partition(document_instance))
     embedding_model = get_embedding_model()
     doc_path = document_instance.file.path
-    text = extract_text(doc_path)
-    text = preprocess_text(text)
-    chunks = chunk_text(text)
-    
-    
-    embeddings = embedding_model.embed_documents(chunks)
-    
-    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        embedding_id = f"{document_instance.id}_chunk_{i}_{uuid.uuid4().hex[:8]}"
-        collection.add(
-            documents=[chunk],
-            embeddings=[embedding],
-            ids=[embedding_id],
-            metadatas=[{"document_id": document_instance.id, "chunk_index": i}]
-        )
-        DocumentChunk.objects.create(
-            document=document_instance,
-            chunk_index=i,
-            content=chunk,
+    progress(IngestionJob.State.EXTRACTING, 0, 0)
+    chunks = iter_document_chunks(doc_path, heartbeat=heartbeat)
+
+    batch_size = getattr(settings, "INGESTION_BATCH_SIZE", 64)
+    done = 0
+    with ChunkWriter(document_instance, collection, batch_size=batch_size) as writer:
+        # Ekstraksi, embedding dan penulisan berjalan per batch tanpa menahan seluruh teks
+        for batch in iter_batches(chunks, batch_size):
+            ids = [writer.chunk_id(chunk) for chunk in batch]
+            new = [(embedding_id, chunk) for embedding_id, chunk in zip(ids, batch)
+                   if not writer.has_vector(embedding_id)]
+            vectors = {}
+            if new:
+                embeddings = embedding_model.embed_documents([chunk for _, chunk in new])
+                vectors = dict(zip((embedding_id for embedding_id, _ in new), embeddings))
+
+            for i, (chunk, embedding_id) in enumerate(zip(batch, ids), start=done):
+                writer.add(i, chunk, embedding_id, vectors.get(embedding_id))
+            done += len(batch)
+            progress(IngestionJob.State.EMBEDDING, done, 0)
+        progress(IngestionJob.State.EMBEDDING, done, done)
+    touch_vector_store_version()
+
+
+def make_chunk_id(document_id, content, model_name):
+    """Content-addressed vector ID: the same text embedded by the same model always gets the same ID."""
+    digest = hashlib.sha256(f"{model_name}\x00{normalize_text(content)}".encode("utf-8")).hexdigest()
+    return f"{document_id}_{digest[:32]}"
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ChunkWriter:
+    """Batched writer that keeps Chroma and DocumentChunk rows for one document consistent.
+
+    Vectors are upserted into Chroma every `batch_size` chunks. Chunks whose
+    content-addressed ID already has a vector are not written again; only
+    their position metadata is refreshed. The DocumentChunk rows are
+    replaced with one bulk_create inside a single short transaction when
+    the writer closes. Vectors of chunks that disappeared are removed only
+    after that transaction commits. If anything fails before the commit,
+    the vectors written by this run are deleted again, so neither store
+    ends up with chunks the other does not know about. Once the rows are
+    committed they reference the new vectors, so the remaining steps
+    (BM25 update, moved metadata, stale vectors) are best effort and only
+    logged when they fail.
+    """
+
+    def __init__(self, document_instance, collection, batch_size=64, model_name=None):
+        self.document = document_instance
+        self.collection = collection
+        self.batch_size = batch_size
+        self.model_name = model_name or get_embedding_model_name()
+        # Metadata partisi ikut ditulis di setiap chunk
+        self.base_metadata = partition_metadata(document_instance)
+        existing = collection.get(where={"document_id": document_instance.id}, include=["metadatas"])
+        self.previous = {
+            embedding_id: (metadata or {}).get("chunk_index")
+            for embedding_id, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+        self.written_ids = []
+        self.kept_ids = set()
+        self.rows = []
+        self._moved = {}
+        self._occurrences = {}
+        self._pending = []
+        self.committed = False
+
+    def chunk_id(self, content):
+        """ID for the next chunk with this content; repeated chunks get an occurrence suffix."""
+        base = make_chunk_id(self.document.id, content, self.model_name)
+        occurrence = self._occurrences.get(base, 0)
+        self._occurrences[base] = occurrence + 1
+        return base if occurrence == 0 else f"{base}_{occurrence}"
+
+    def has_vector(self, embedding_id):
+        return embedding_id in self.previous
+
+    def add(self, chunk_index, content, embedding_id, embedding=None, metadata=None):
+        token_count = count_tokens(content)
+        metadata = dict(self.base_metadata, **(metadata or {}), document_id=self.document.id,
+                        chunk_index=chunk_index, token_count=token_count)
+        if embedding is None:
+            # Vektor sudah ada; cukup perbarui posisinya jika berubah
+            self.kept_ids.add(embedding_id)
+            if self.previous.get(embedding_id) != chunk_index:
+                self._moved[embedding_id] = metadata
+        else:
+            self._pending.append((embedding_id, content, embedding, metadata))
+        self.rows.append(DocumentChunk(
+            document=self.document,
+            chunk_index=chunk_index,
+            content=content,
+            token_count=token_count,
             embedding_id=embedding_id
+        ))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        ids, documents, embeddings, metadatas = zip(*self._pending)
+        self.collection.upsert(
+            ids=list(ids),
+            documents=list(documents),
+            embeddings=list(embeddings),
+            metadatas=list(metadatas),
         )
+        self.written_ids.extend(ids)
+        self._pending = []
 
-def chunk_text(text):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1024,
-        chunk_overlap=200,
+    def commit(self):
+        self.flush()
+        with transaction.atomic():
+            DocumentChunk.objects.filter(document=self.document).delete()
+            DocumentChunk.objects.bulk_create(self.rows, batch_size=500)
+        self.committed = True
+
+        if all(row.id is not None for row in self.rows):
+            try:
+                # Index BM25 proses ini ikut diperbarui tanpa menunggu sinkronisasi berikutnya
+                get_lexical_index().update_document(
+                    self.document.id, [(row.id, row.chunk_index, row.content) for row in self.rows],
+                    partition=self.base_metadata["partition"],
+                )
+            except Exception as e:
+                # Sinkronisasi berikutnya membaca ulang dokumen ini karena signature-nya belum diperbarui
+                logger.warning("Error updating lexical index for document %s: %s", self.document.id, e)
+        if self._moved:
+            try:
+                self.collection.update(ids=list(self._moved), metadatas=list(self._moved.values()))
+            except Exception as e:
+                logger.warning("Error updating moved chunk metadata of document %s: %s", self.document.id, e)
+        stale_ids = list(set(self.previous) - set(self.written_ids) - self.kept_ids)
+        if stale_ids:
+            try:
+                self.collection.delete(ids=stale_ids)
+            except Exception as e:
+                # Vektor lama tetap ada sampai dokumen diindeks ulang, yang akan menghapusnya lagi
+                logger.warning("Error removing %d stale vectors of document %s: %s",
+                               len(stale_ids), self.document.id, e)
+
+    def rollback(self):
+        # Hanya hapus vektor yang baru ditulis run ini; vektor lama masih dirujuk DocumentChunk
+        new_ids = list(set(self.written_ids) - set(self.previous))
+        if new_ids:
+            try:
+                self.collection.delete(ids=new_ids)
+            except Exception as e:
+                logger.warning("Error removing vectors of failed ingestion for document %s: %s", self.document.id, e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.commit()
+            except Exception:
+                # Setelah commit baris DocumentChunk merujuk vektor baru; vektor itu tidak boleh dihapus
+                if not self.committed:
+                    self.rollback()
+                raise
+        else:
+            self.rollback()
+        return False
+
+def purge_document_vectors(document_id, collection=None, partition=None):
+    """Delete every vector of a document from the vector store (of its partition) in one call."""
+    collection = collection or get_vector_collection(partition)
+    collection.delete(where={"document_id": document_id})
+    get_lexical_index().remove_document(document_id)
+    touch_vector_store_version()
+
+# Ukuran chunk dan overlap dalam karakter
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 200
+
+def _text_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         add_start_index=True,
     )
-    return text_splitter.split_text(text)
 
-def extract_text_from_pdf(file_path):
+def chunk_text(text):
+    return _text_splitter().split_text(text)
+
+def iter_chunks(segments, window=4096):
+    """Chunk a stream of text segments while holding only about `window` characters.
+
+    Whenever the buffer passes `window` it is split and every chunk except
+    the last is emitted. The last chunk seeds the next buffer, so chunk
+    boundaries and overlap match what `chunk_text` does on the full text.
+    """
+    text_splitter = _text_splitter()
+    buffer = ""
+    for segment in segments:
+        segment = segment.strip()
+        if not segment:
+            continue
+        buffer = f"{buffer} {segment}" if buffer.strip() else segment
+        if len(buffer) >= window:
+            chunks = text_splitter.create_documents([buffer])
+            for chunk in chunks[:-1]:
+                yield chunk.page_content
+            # Sertakan separator di depan chunk terakhir agar panjang split-nya sama seperti di teks penuh
+            start = chunks[-1].metadata["start_index"] if chunks else len(buffer)
+            buffer = buffer[max(start - 1, 0):]
+    if buffer:
+        yield from text_splitter.split_text(buffer)
+
+def iter_document_chunks(file_path, heartbeat=None):
+    """Streaming pipeline: extract pages/slides -> normalise -> chunk."""
+    def segments():
+        for segment in iter_text_segments(file_path):
+            if heartbeat is not None:
+                heartbeat()
+            yield preprocess_text(segment)
+    return iter_chunks(segments())
+
+def _ordered_parallel(func, tasks, max_workers):
+    """Yield func(*task) for every task in order, with at most 2 * max_workers tasks in flight."""
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(func, *task))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _extract_pdf_page_range(file_path, start, stop):
     with pdfplumber.open(file_path) as pdf:
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        return [page.extract_text() or "" for page in pdf.pages[start:stop]]
 
-def extract_text_from_docx(file_path):
+def iter_pdf_pages(file_path):
+    """Yield the text of each PDF page in order, extracting page ranges in parallel for large files."""
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+
+    pages_per_task = getattr(settings, "EXTRACTION_PAGES_PER_TASK", 8)
+    workers = getattr(settings, "EXTRACTION_WORKERS", os.cpu_count() or 1)
+    ranges = [(file_path, start, min(start + pages_per_task, page_count))
+              for start in range(0, page_count, pages_per_task)]
+
+    if workers <= 1 or page_count < getattr(settings, "EXTRACTION_PARALLEL_MIN_PAGES", 32):
+        results = (_extract_pdf_page_range(*task) for task in ranges)
+    else:
+        results = _ordered_parallel(_extract_pdf_page_range, ranges, workers)
+    for pages in results:
+        yield from pages
+
+def iter_docx_paragraphs(file_path):
     doc = Document(file_path)
-    full_text = []
     for para in doc.paragraphs:
-        full_text.append(para.text)
-    return '\n'.join(full_text).strip()
+        yield para.text
 
-def extract_text_from_txt(file_path):
+def iter_txt_blocks(file_path, block_size=65536):
     with open(file_path, 'r', encoding='utf-8') as file:
-        return file.read().strip()
-    
-def extract_text_from_pptx(file_path):
+        while True:
+            block = file.read(block_size)
+            if not block:
+                return
+            # Jangan memotong kata di batas blok
+            if not block[-1].isspace():
+                block += file.readline()
+            yield block
+
+def iter_pptx_slides(file_path):
+    # python-pptx memuat seluruh paket sekaligus, jadi slide dibaca berurutan
     presentation = Presentation(file_path)
-    text = ""
     for slide in presentation.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                text += shape.text + "\n"
-    return text.strip()
+        yield "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
 
-def extract_text(file_path):
+def iter_text_segments(file_path):
     if file_path.endswith('.pdf'):
-        return extract_text_from_pdf(file_path)
+        return iter_pdf_pages(file_path)
     elif file_path.endswith('.docx'):
-        return extract_text_from_docx(file_path)
+        return iter_docx_paragraphs(file_path)
     elif file_path.endswith('.txt'):
-        return extract_text_from_txt(file_path)
+        return iter_txt_blocks(file_path)
     elif file_path.endswith('.pptx'):
-        return extract_text_from_pptx(file_path)
+        return iter_pptx_slides(file_path)
     else:
         raise ValueError("Unsupported file type")
 
+def extract_text_from_pdf(file_path):
+    return "\n".join(iter_pdf_pages(file_path)).strip()
+
+def extract_text_from_docx(file_path):
+    return '\n'.join(iter_docx_paragraphs(file_path)).strip()
+
+def extract_text_from_txt(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read().strip()
+    
+def extract_text_from_pptx(file_path):
+    return "\n".join(iter_pptx_slides(file_path)).strip()
+
+def extract_text(file_path):
+    return "\n".join(iter_text_segments(file_path)).strip()
+
 def preprocess_text(text):
     text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
     text = text.lower()
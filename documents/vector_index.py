@@ -0,0 +1,401 @@
+# personaai/documents/vector_index.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_INCLUDE_DEFAULT = ("metadatas", "documents")
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class _Snapshot:
+    """Read-only view of the index at one version; searches never see a half-applied write."""
+
+    def __init__(self, version, generation, vectors, alive, list_ids, centroids):
+        self.version = version
+        self.generation = generation
+        self.vectors = vectors
+        self.alive = alive
+        self.centroids = centroids
+        self.lists = None
+        if centroids is not None and len(list_ids):
+            # Baris per list IVF, sekali dihitung per snapshot; list -1 = belum pernah di-assign
+            order = np.argsort(list_ids, kind="stable")
+            bounds = np.searchsorted(list_ids[order], np.arange(-1, len(centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids) + 1)]
+
+
+class MmapVectorIndex:
+    """Flat vector index in a memory-mapped float32 file with SQLite metadata.
+
+    Vectors are L2-normalised on write and appended to
+    ``vectors.<generation>.f32``; every process maps the same file, so the
+    OS page cache holds one copy for all workers. Row metadata, chunk text
+    and a tombstone flag live in ``meta.sqlite3``. Upserts tombstone the
+    previous row of an ID and append a new one; deletes only tombstone.
+    ``compact`` rewrites the file without dead rows under a new generation.
+
+    Search is an exact dot product over all live rows. After ``train_ivf``
+    rows are also assigned to k-means lists and a search only scores the
+    ``nprobe`` lists closest to the query.
+
+    The write methods mirror the subset of the Chroma collection API used
+    by the ingestion path (``get``, ``upsert``, ``update``, ``delete``,
+    ``count``), so ChunkWriter works on either backend.
+    """
+
+    def __init__(self, path, nprobe=None):
+        self.path = path
+        self.nprobe = nprobe if nprobe is not None else getattr(settings, "VECTOR_INDEX_IVF_NPROBE", 8)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._searches = 0
+        self._ivf_searches = 0
+        self._reloads = 0
+        self._search_time = 0.0
+
+    # --- penyimpanan ---
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.path, "meta.sqlite3"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                "row INTEGER PRIMARY KEY, embedding_id TEXT NOT NULL, document_id INTEGER, "
+                "metadata TEXT NOT NULL, content TEXT NOT NULL, "
+                "alive INTEGER NOT NULL DEFAULT 1, list_id INTEGER NOT NULL DEFAULT -1)"
+            )
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS rows_live_id ON rows (embedding_id) WHERE alive = 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS rows_document ON rows (document_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, conn, key, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _vectors_path(self, generation):
+        return os.path.join(self.path, f"vectors.{generation}.f32")
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE: satu penulis sekaligus antar proses; pembaca tetap jalan (WAL)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            self._set_meta(conn, "version", int(self._meta(conn, "version", 0)) + 1)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _load(self):
+        """Return the current snapshot, re-reading metadata only when another write happened."""
+        conn = self._connection()
+        version = int(self._meta(conn, "version", 0))
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            conn.execute("BEGIN")
+            try:
+                version = int(self._meta(conn, "version", 0))
+                generation = int(self._meta(conn, "generation", 0))
+                dim = int(self._meta(conn, "dim", 0))
+                centroids = self._meta(conn, "centroids")
+                rows = conn.execute("SELECT row, alive, list_id FROM rows ORDER BY row").fetchall()
+            finally:
+                conn.execute("COMMIT")
+            n = rows[-1][0] + 1 if rows else 0
+            alive = np.zeros(n, dtype=bool)
+            list_ids = np.full(n, -1, dtype=np.int32)
+            if rows:
+                data = np.asarray(rows, dtype=np.int64)
+                alive[data[:, 0]] = data[:, 1].astype(bool)
+                list_ids[data[:, 0]] = data[:, 2]
+            vectors = np.zeros((0, dim), dtype=np.float32)
+            if n and dim:
+                vectors = np.memmap(self._vectors_path(generation), dtype=np.float32, mode="r", shape=(n, dim))
+            if centroids is not None:
+                centroids = np.frombuffer(centroids, dtype=np.float32).reshape(-1, dim)
+            self._snapshot = _Snapshot(version, generation, vectors, alive, list_ids, centroids)
+            self._reloads += 1
+            return self._snapshot
+
+    # --- API mirip koleksi Chroma ---
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        if not ids:
+            return
+        vectors = _normalize(embeddings)
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or ["" for _ in ids]
+        with self._write() as conn:
+            dim = int(self._meta(conn, "dim", 0))
+            if not dim:
+                dim = vectors.shape[1]
+                self._set_meta(conn, "dim", dim)
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {dim}")
+            generation = int(self._meta(conn, "generation", 0))
+            self._tombstone(conn, ids)
+            start = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+            list_ids = np.full(len(ids), -1, dtype=np.int32)
+            centroids = self._meta(conn, "centroids")
+            if centroids is not None:
+                list_ids = np.argmax(vectors @ np.frombuffer(centroids, dtype=np.float32).reshape(-1, dim).T, axis=1)
+            # Vektor ditulis sebelum barisnya di-commit, jadi pembaca tidak pernah memetakan baris kosong
+            path = self._vectors_path(generation)
+            with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+                f.seek(start * dim * 4)
+                f.write(vectors.tobytes())
+            conn.executemany(
+                "INSERT INTO rows (row, embedding_id, document_id, metadata, content, list_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (start + i, embedding_id, (metadata or {}).get("document_id"), json.dumps(metadata or {}),
+                     content or "", int(list_id))
+                    for i, (embedding_id, metadata, content, list_id) in enumerate(zip(ids, metadatas, documents, list_ids))
+                ],
+            )
+
+    def update(self, ids, metadatas):
+        with self._write() as conn:
+            conn.executemany(
+                "UPDATE rows SET metadata = ?, document_id = ? WHERE embedding_id = ? AND alive = 1",
+                [(json.dumps(metadata), metadata.get("document_id"), embedding_id)
+                 for embedding_id, metadata in zip(ids, metadatas)],
+            )
+
+    def delete(self, ids=None, where=None):
+        with self._write() as conn:
+            if ids is not None:
+                self._tombstone(conn, ids)
+            if where:
+                clause, params = self._where(where)
+                conn.execute(f"UPDATE rows SET alive = 0 WHERE alive = 1 AND {clause}", params)
+
+    def _tombstone(self, conn, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            conn.execute(
+                f"UPDATE rows SET alive = 0 WHERE alive = 1 AND embedding_id IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+
+    def _where(self, where):
+        clauses, params = [], []
+        for key, value in where.items():
+            if key == "document_id":
+                clauses.append("document_id = ?")
+            else:
+                clauses.append(f"json_extract(metadata, '$.{key}') = ?")
+            params.append(value)
+        return " AND ".join(clauses), params
+
+    def get(self, ids=None, where=None, include=_INCLUDE_DEFAULT):
+        """Live rows by ID and/or metadata equality, shaped like Chroma's get() result."""
+        clauses, params = ["alive = 1"], []
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return {"ids": [], "metadatas": [], "documents": [], "embeddings": []}
+            clauses.append(f"embedding_id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        if where:
+            clause, where_params = self._where(where)
+            clauses.append(clause)
+            params.extend(where_params)
+        rows = self._connection().execute(
+            f"SELECT row, embedding_id, metadata, content FROM rows WHERE {' AND '.join(clauses)} ORDER BY row", params
+        ).fetchall()
+        result = {"ids": [row[1] for row in rows]}
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[2]) for row in rows]
+        if "documents" in include:
+            result["documents"] = [row[3] for row in rows]
+        if "embeddings" in include:
+            snapshot = self._load()
+            result["embeddings"] = [np.array(snapshot.vectors[row[0]]) for row in rows]
+        return result
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM rows WHERE alive = 1").fetchone()[0]
+
+    # --- pencarian ---
+
+    def search(self, vector, k=4, nprobe=None, include_vectors=False):
+        """Top `k` live rows by cosine similarity; returns (content, metadata, similarity) tuples.
+
+        With `include_vectors` each tuple also carries the stored (normalised) vector.
+        """
+        start = time.perf_counter()
+        snapshot = self._load()
+        if not len(snapshot.vectors):
+            return []
+        query = _normalize(vector)[0]
+        nprobe = self.nprobe if nprobe is None else nprobe
+        if snapshot.lists is not None and nprobe and nprobe < len(snapshot.centroids):
+            probes = np.argpartition(-(snapshot.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.concatenate([snapshot.lists[0]] + [snapshot.lists[i + 1] for i in probes])
+            candidates = candidates[snapshot.alive[candidates]]
+            scores = snapshot.vectors[candidates] @ query
+            ivf = True
+        else:
+            candidates = None
+            scores = np.asarray(snapshot.vectors @ query)
+            scores[~snapshot.alive] = -np.inf
+            ivf = False
+
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[np.isfinite(scores[top])]
+        rows = (candidates[top] if candidates is not None else top).tolist()
+        similarities = dict(zip(rows, scores[top].tolist()))
+
+        found = {}
+        if rows:
+            for row, metadata, content in self._connection().execute(
+                f"SELECT row, metadata, content FROM rows WHERE row IN ({','.join('?' * len(rows))})", rows
+            ):
+                found[row] = (content, json.loads(metadata))
+        with self._lock:
+            self._searches += 1
+            self._ivf_searches += ivf
+            self._search_time += time.perf_counter() - start
+        if include_vectors:
+            return [(found[row][0], found[row][1], similarities[row], np.asarray(snapshot.vectors[row]))
+                    for row in rows if row in found]
+        return [(found[row][0], found[row][1], similarities[row]) for row in rows if row in found]
+
+    # --- pemeliharaan ---
+
+    def train_ivf(self, lists, iterations=10, sample_size=50000, seed=0):
+        """Cluster live vectors into `lists` k-means lists (spherical) and assign every row."""
+        snapshot = self._load()
+        live = np.flatnonzero(snapshot.alive)
+        if len(live) < lists:
+            raise ValueError(f"Need at least {lists} vectors to train {lists} lists, have {len(live)}")
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))
+        data = np.asarray(snapshot.vectors[sample])
+        centroids = data[rng.choice(len(data), size=lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, data)
+            empty = np.bincount(assignment, minlength=lists) == 0
+            # List kosong diisi ulang dengan titik acak agar semua list terpakai
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+
+        assignment = np.empty(len(snapshot.vectors), dtype=np.int64)
+        for start in range(0, len(snapshot.vectors), 65536):
+            block = np.asarray(snapshot.vectors[start:start + 65536])
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        with self._write() as conn:
+            if int(self._meta(conn, "generation", 0)) != snapshot.generation:
+                raise RuntimeError("Index was compacted while training; train again")
+            self._set_meta(conn, "centroids", centroids.astype(np.float32).tobytes())
+            conn.executemany("UPDATE rows SET list_id = ? WHERE row = ?",
+                             [(int(list_id), row) for row, list_id in enumerate(assignment)])
+            # Baris yang ditambahkan selama training di-assign saat itu juga
+            for row, in conn.execute("SELECT row FROM rows WHERE row >= ?", (len(assignment),)).fetchall():
+                vector = np.fromfile(self._vectors_path(snapshot.generation), dtype=np.float32,
+                                     count=centroids.shape[1], offset=row * centroids.shape[1] * 4)
+                conn.execute("UPDATE rows SET list_id = ? WHERE row = ?", (int(np.argmax(centroids @ vector)), row))
+
+    def compact(self):
+        """Rewrite the vector file without tombstoned rows; returns the number of rows dropped."""
+        with self._write() as conn:
+            generation = int(self._meta(conn, "generation", 0))
+            dim = int(self._meta(conn, "dim", 0))
+            rows = [row for row, in conn.execute("SELECT row FROM rows WHERE alive = 1 ORDER BY row")]
+            dropped = conn.execute("SELECT COUNT(*) FROM rows WHERE alive = 0").fetchone()[0]
+            if not dropped or not dim:
+                return 0
+            old_path = self._vectors_path(generation)
+            source = np.memmap(old_path, dtype=np.float32, mode="r", shape=(rows[-1] + 1, dim)) if rows else None
+            with open(self._vectors_path(generation + 1), "wb") as f:
+                for start in range(0, len(rows), 65536):
+                    f.write(np.asarray(source[rows[start:start + 65536]]).tobytes())
+            del source
+            conn.execute("DELETE FROM rows WHERE alive = 0")
+            # Nomor baris baru selalu <= yang lama, jadi update berurutan tidak pernah bentrok
+            conn.executemany("UPDATE rows SET row = ? WHERE row = ?",
+                             [(new, old) for new, old in enumerate(rows) if new != old])
+            self._set_meta(conn, "generation", generation + 1)
+        # Pembaca yang masih memetakan file lama tetap aman; di POSIX isinya baru dilepas setelah unmap
+        try:
+            os.remove(old_path)
+        except OSError as e:
+            logger.warning("Error removing old vector file %s: %s", old_path, e)
+        return dropped
+
+    def stats(self) -> dict:
+        snapshot = self._load()
+        with self._lock:
+            return {
+                "rows": len(snapshot.alive),
+                "live": int(snapshot.alive.sum()),
+                "tombstoned": int(len(snapshot.alive) - snapshot.alive.sum()),
+                "dimensions": snapshot.vectors.shape[1] if snapshot.vectors.ndim == 2 else 0,
+                "ivf_lists": len(snapshot.centroids) if snapshot.centroids is not None else 0,
+                "generation": snapshot.generation,
+                "searches": self._searches,
+                "ivf_searches": self._ivf_searches,
+                "reloads": self._reloads,
+                "avg_search_ms": self._search_time / self._searches * 1000 if self._searches else 0.0,
+            }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index(collection_name, path=None) -> MmapVectorIndex:
+    """Process-wide MmapVectorIndex for a collection, under VECTOR_INDEX_PATH."""
+    root = path or getattr(settings, "VECTOR_INDEX_PATH", os.path.join(settings.VECTOR_STORE_PATH, "mmap"))
+    location = os.path.join(root, collection_name)
+    with _indexes_lock:
+        index = _indexes.get(location)
+        if index is None:
+            index = _indexes[location] = MmapVectorIndex(location)
+        return index
+
+
+def loaded_vector_indexes() -> dict:
+    """The indexes opened by this process so far, by collection directory name."""
+    with _indexes_lock:
+        return {os.path.basename(location): index for location, index in _indexes.items()}
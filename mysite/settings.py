@@ -183,6 +183,152 @@ LANGCHAIN_TRACING_V2 = True
 # Vector store settings
 VECTOR_STORE_PATH = os.path.join(BASE_DIR, 'vector_store')
 
+# Backend vector store: 'chroma' atau 'mmap' (matriks float32 memory-mapped yang dipakai bersama
+# semua worker; isi dari Chroma dengan `python manage.py vector_index import`)
+VECTOR_BACKEND = 'chroma'
+VECTOR_INDEX_PATH = os.path.join(VECTOR_STORE_PATH, 'mmap')
+VECTOR_INDEX_IVF_NPROBE = 8  # list IVF yang dicari per query setelah `vector_index train-ivf`
+
+# Retriever pool: seberapa sering (detik) marker vector store dicek untuk perubahan
+RETRIEVER_POOL_REFRESH_INTERVAL = 5.0
+# Retrieval async: jumlah thread retrieval paralel per proses dan batas waktu per query (detik)
+RETRIEVAL_MAX_WORKERS = 4
+RETRIEVAL_TIMEOUT = 10.0
+
+# Retrieval hybrid: hasil vektor digabung dengan BM25 lewat reciprocal rank fusion
+HYBRID_RETRIEVAL_ENABLED = True
+HYBRID_CANDIDATES = 8  # kandidat dari tiap sumber sebelum fusi
+HYBRID_VECTOR_WEIGHT = 1.0
+HYBRID_LEXICAL_WEIGHT = 1.0
+HYBRID_RRF_K = 60
+# Index BM25 di memori atas DocumentChunk.content
+LEXICAL_BM25_K1 = 1.2
+LEXICAL_BM25_B = 0.75
+LEXICAL_QUERY_BUDGET_MS = 5.0  # term yang lebih umum dilewati setelah budget habis
+LEXICAL_MAX_DF_RATIO = 0.5  # term yang muncul di lebih banyak chunk diabaikan
+LEXICAL_COMPACT_RATIO = 0.3  # postings dipadatkan saat slot mati melebihi rasio ini
+# Rerank setelah retrieval: ambang similarity, lalu MMR untuk chunk yang beragam dan tidak duplikat
+RERANK_ENABLED = True
+RERANK_CANDIDATES = 20  # kandidat yang diambil sebelum rerank
+RERANK_MIN_SIMILARITY = 0.2  # cosine similarity minimum ke query
+RERANK_MMR_LAMBDA = 0.7  # 1.0 = hanya relevansi, 0.0 = hanya keragaman
+RERANK_DUPLICATE_THRESHOLD = 0.95  # chunk semirip ini dengan chunk terpilih dibuang
+RERANK_TOKEN_BUDGET = 1536  # total token konteks dari chunk terpilih
+
+# Backend embedding: 'openai', 'ollama' (lewat server Ollama lokal) atau 'hashing' (CPU, offline).
+# Setiap model embedding memakai koleksi Chroma sendiri.
+EMBEDDING_BACKEND = 'openai'
+EMBEDDING_MODEL = None  # None = model default backend
+EMBEDDING_DIMENSIONS = 768  # hanya untuk backend 'hashing'
+EMBEDDING_BATCH_SIZE = 256
+
+# Antrian ingestion dokumen (dijalankan dengan `python manage.py ingest_worker`)
+INGESTION_USE_QUEUE = True  # False = proses dokumen langsung saat upload
+INGESTION_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+INGESTION_MAX_ATTEMPTS = 3
+INGESTION_RETRY_BACKOFF = 30  # detik, dikali dua setiap percobaan ulang
+INGESTION_POLL_INTERVAL = 2.0
+INGESTION_STALE_AFTER = 15 * 60  # detik tanpa heartbeat sebelum job dianggap macet dan diantrekan ulang
+INGESTION_HEARTBEAT_INTERVAL = 30  # detik antar penulisan heartbeat selama ekstraksi
+INGESTION_BATCH_SIZE = 64  # chunk per panggilan embedding dan per upsert ke Chroma
+
+# Ekstraksi teks: PDF besar diekstrak paralel per rentang halaman di process pool
+EXTRACTION_WORKERS = os.cpu_count() or 1
+EXTRACTION_PAGES_PER_TASK = 8
+EXTRACTION_PARALLEL_MIN_PAGES = 32
+
+# Streaming chat: token digabung per frame websocket, dikirim setiap interval (detik)
+# atau saat buffer mencapai ukuran byte tertentu, mana yang lebih dulu
+CHAT_STREAM_COALESCE = True
+CHAT_STREAM_FLUSH_INTERVAL = 0.03
+CHAT_STREAM_FLUSH_BYTES = 256
+
+# Memori percakapan: N turn terakhir disimpan utuh dalam anggaran token, sisanya diringkas
+CHAT_MEMORY_MAX_TURNS = 6
+CHAT_MEMORY_MAX_TOKENS = 1500
+CHAT_MEMORY_SUMMARY_MAX_TOKENS = 300
+
+# Anggaran prompt per model (token) untuk fit_prompt; batas atas num_ctx yang diminta ke Ollama
+LLM_CONTEXT_WINDOWS = {
+    'gemma3:1b': 8192,
+    'qwen2.5-coder:0.5b': 8192,
+    'deepseek-r1:1.5b': 8192,
+    'chatgpt-4o-latest': 128000,
+}
+LLM_DEFAULT_CONTEXT_WINDOW = 4096
+LLM_RESPONSE_TOKENS = 1024  # dicadangkan untuk jawaban model
+# num_ctx tetap per model; model yang tidak ada di sini memakai ukuran prompt + LLM_RESPONSE_TOKENS
+LLM_NUM_CTX = {}
+PROMPT_PERSONA_SHARE = 0.2
+PROMPT_CONTEXT_SHARE = 0.6
+# 'estimate' (tanpa dependensi) atau 'tiktoken' (lebih akurat, butuh file encoding cl100k_base)
+TOKEN_COUNTER = 'estimate'
+# Batas umur (detik) persona pengguna yang di-cache; perubahan di proses lain terlihat setelah ini
+PROMPT_CACHE_TTL = 300
+
+# Klien LLM dipakai ulang per (provider, model, opsi) dengan pool koneksi keep-alive.
+# Untuk uji tanpa model, jalankan `python manage.py ollama_stub` dan arahkan OLLAMA_HOST ke sana.
+OLLAMA_BASE_URL = os.environ.get('OLLAMA_HOST', 'http://localhost:11434')
+OLLAMA_KEEP_ALIVE = '30m'  # lama model tetap dimuat di server Ollama setelah dipakai
+LLM_REGISTRY_MAX_CLIENTS = 16
+LLM_POOL_MAX_CONNECTIONS = 20
+LLM_POOL_MAX_KEEPALIVE = 10
+LLM_POOL_KEEPALIVE_EXPIRY = 120.0  # detik
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_REQUEST_TIMEOUT = 120.0
+LLM_HEALTH_CHECK_INTERVAL = 30.0  # detik; 0 = tanpa health check
+LLM_HEALTH_CHECK_TIMEOUT = 2.0
+
+# Antrean generasi per proses: batas generasi bersamaan per model, giliran adil antar pengguna
+GENERATION_CONCURRENCY = 2
+GENERATION_MODEL_CONCURRENCY = {}  # mis. {'deepseek-r1:1.5b': 1}
+GENERATION_MAX_QUEUE = 20  # lebih dari ini langsung ditolak
+GENERATION_MAX_QUEUED_PER_USER = 3
+GENERATION_QUEUE_TIMEOUT = 120.0  # detik menunggu slot sebelum menyerah
+GENERATION_CANCEL_TIMEOUT = 5.0  # detik menunggu jawaban parsial tersimpan saat koneksi ditutup
+
+# Cache jawaban untuk pertanyaan pembuka sesi (turn tanpa riwayat), dipakai bersama semua pengguna.
+# Kunci: model, persona, hash konteks hasil retrieval dan pertanyaan yang dinormalisasi.
+RESPONSE_CACHE_ENABLED = True
+# Pertanyaan yang embedding-nya sangat mirip (dan angka/kode di dalamnya sama) juga dianggap sama.
+# Nonaktif secara default: "tugas 2" dan "tugas 3" hampir tidak dibedakan oleh embedding.
+RESPONSE_CACHE_SEMANTIC = False
+RESPONSE_CACHE_SEMANTIC_THRESHOLD = 0.92  # cosine similarity minimum
+RESPONSE_CACHE_MAX_CANDIDATES = 200
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # detik
+# Jawaban dari cache diputar ulang per potongan karakter dengan jeda (detik)
+RESPONSE_CACHE_REPLAY_CHUNK_CHARS = 16
+RESPONSE_CACHE_REPLAY_INTERVAL = 0.02
+
+# Cache embedding: LRU di memori + file SQLite yang dipakai bersama semua worker
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, 'cache', 'embeddings.sqlite3')
+EMBEDDING_CACHE_MEMORY_SIZE = 2048
+EMBEDDING_CACHE_MAX_ENTRIES = 200000
+EMBEDDING_CACHE_TTL = 30 * 24 * 3600
+
+# Metrik Prometheus di /metrics/: scraper mengirim "Authorization: Bearer <METRICS_TOKEN>".
+# Tanpa token endpoint tertutup, kecuali saat DEBUG untuk alamat di METRICS_ALLOWED_IPS
+# (di balik reverse proxy semua request datang dari 127.0.0.1, jadi daftar alamat saja tidak cukup)
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Log di jalur panas chat (query, model, prompt) hanya ditulis jika levelnya aktif,
+# dan itu pun hanya untuk sebagian pesan
+CHAT_LOG_SAMPLE_RATE = 0.1
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'chat': {'handlers': ['console'], 'level': os.environ.get('CHAT_LOG_LEVEL', 'WARNING')},
+        'documents': {'handlers': ['console'], 'level': os.environ.get('CHAT_LOG_LEVEL', 'WARNING')},
+    },
+}
+
 
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 
@@ -7,6 +7,7 @@ PersonaAI.createChatApp = function() {
         // State
         messageText: '',
         isTyping: false,
+        isGenerating: false,
         hasConnectedMessage: false,
         sidebarOpen: window.innerWidth >= 768,
         selectedModel: null,
@@ -67,15 +68,23 @@ PersonaAI.createChatApp = function() {
             switch (data.type) {
                 case 'assistant_response_start':
                     this.isTyping = false;
+                    this.isGenerating = true;
                     this.ui.clearTypingIndicator();
                     this.ui.createAssistantMessage();
                     break;
                     
+                case 'queue_position':
+                    this.ui.showQueuePosition(data.position);
+                    break;
+                    
                 case 'assistant_response_chunk':
+                    this.ui.clearQueuePosition();
                     this.ui.appendAssistantMessage(data.message);
                     break;
                     
                 case 'assistant_response_end':
+                    this.isGenerating = false;
+                    this.ui.clearQueuePosition();
                     this.ui.finalizeAssistantMessage();
                     this.ui.focusInput();
                     break;
@@ -127,6 +136,11 @@ PersonaAI.createChatApp = function() {
             this.ui.scrollToBottom();
         },
 
+        stopGenerating: function() {
+            // Server menyimpan jawaban yang sudah terkirim sebagai pesan terpotong
+            this.socket.sendMessage({ type: 'stop' });
+        },
+
         selectModel: function(model) {
             if(!model) return;
             this.selectedModel = model;
@@ -62,6 +62,24 @@ PersonaAI.ChatUI.prototype = {
         }
     },
     
+    showQueuePosition: function(position) {
+        // Satu elemen status yang diperbarui, bukan pesan baru setiap posisi berubah
+        if (!this.queueStatusElement) {
+            this.queueStatusElement = document.createElement('div');
+            this.queueStatusElement.className = 'message system-message';
+            this.messageContainer.appendChild(this.queueStatusElement);
+        }
+        this.queueStatusElement.textContent = 'Waiting for a free model slot (position ' + position + ' in queue)';
+        this.scrollToBottom();
+    },
+    
+    clearQueuePosition: function() {
+        if (this.queueStatusElement) {
+            this.queueStatusElement.remove();
+            this.queueStatusElement = null;
+        }
+    },
+    
     createAssistantMessage: function() {
         this.assistantMessageElement = document.createElement('div');
         this.assistantMessageElement.className = 'message assistant-message';